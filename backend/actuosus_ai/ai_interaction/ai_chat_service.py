@@ -1,6 +1,10 @@
+import time
 from asyncio import Event
 from typing import Optional, Generator, List, Tuple, Any, TypedDict
 
+from actuosus_ai.ai_interaction.inference_metrics import CHAT_TEMPLATE_SECONDS
+from actuosus_ai.ai_interaction.load_progress import LoadProgressTracker
+from actuosus_ai.ai_interaction.profiler import CHAT_TEMPLATE
 from actuosus_ai.ai_interaction.text_generation_service import TextGenerationService
 from actuosus_ai.common.utils import parse_jinja2_messages, remove_trailing_eot_token
 
@@ -23,9 +27,10 @@ class AIChatService:
         ai_model_id: int,
         quantization: Optional[str] = None,
         gguf_file_name: Optional[str] = None,
+        progress: Optional[LoadProgressTracker] = None,
     ) -> None:
         await self.text_generation_service.load_model(
-            ai_model_id, quantization, gguf_file_name
+            ai_model_id, quantization, gguf_file_name, progress
         )
 
     def _format_chat(self, messages: List[ChatMessage]) -> str:
@@ -55,6 +60,7 @@ class AIChatService:
         min_prob: float = 0.001,
         stop_event: Optional[Event] = None,
     ) -> Generator[List[Tuple[str, float]], None, None]:
+        start = time.perf_counter()
         if self.gguf:
             # Check if the model has a jinja2 chat template
             if "tokenizer.chat_template" in self.model.metadata:
@@ -67,6 +73,9 @@ class AIChatService:
                 prompt = self._format_chat(messages)
         else:
             prompt = self._format_chat(messages)
+        end = time.perf_counter()
+        CHAT_TEMPLATE_SECONDS.labels(*self.metric_labels).observe(end - start)
+        self.profiler.add(CHAT_TEMPLATE, start, end)
         yield from self.text_generation_service.generate_tokens_with_probabilities(
             prompt=prompt,
             max_length=max_length,
@@ -0,0 +1,142 @@
+"""
+Compact binary frames for the /ws/chat/ token stream, used when a client
+connects with protocol=binary. Every other frame stays JSON.
+
+All integers are little endian. A frame starts with a uint8 BinaryFrameType.
+
+VOCABULARY: uint32 count, then count pieces as uint16 byte length + UTF-8 bytes.
+The piece at position n is the text of token id n.
+
+TOKENS: uint8 source length + UTF-8 source, uint16 item count, then the items.
+
+WORD_REFRESH: uint32 i, uint32 j, then one item.
+
+An item is uint8 k, uint16 chosen text length + UTF-8 chosen text, then k entries
+of uint32 token id + float16 probability, the chosen token first. A chosen text
+length of 0xFFFF means the chosen word is the vocabulary piece of its token,
+otherwise the text replaces it (multi-byte characters completed across tokens).
+"""
+
+import struct
+from typing import List, Sequence, Tuple
+
+from actuosus_ai.ai_interaction.detokenizer import TokenWordProbList
+
+USE_PIECE = 0xFFFF
+
+
+class BinaryFrameType:
+    VOCABULARY = 1
+    TOKENS = 2
+    WORD_REFRESH = 3
+
+
+def _encode_text(text: str, length_format: str) -> bytes:
+    data = text.encode("utf-8")
+    return struct.pack(length_format, len(data)) + data
+
+
+def encode_vocabulary(pieces: Sequence[str]) -> bytes:
+    out = bytearray(struct.pack("<BI", BinaryFrameType.VOCABULARY, len(pieces)))
+    for piece in pieces:
+        out += _encode_text(piece, "<H")
+    return bytes(out)
+
+
+def _encode_item(
+    out: bytearray, item: TokenWordProbList, pieces: Sequence[str]
+) -> None:
+    token_ids = item.token_ids
+    chosen = item[0][0]
+    out += struct.pack("<B", len(item))
+    if chosen == pieces[token_ids[0]]:
+        out += struct.pack("<H", USE_PIECE)
+    else:
+        out += _encode_text(chosen, "<H")
+    out += struct.pack(
+        "<" + "Ie" * len(item),
+        *(
+            value
+            for token_id, (_, prob) in zip(token_ids, item)
+            for value in (token_id, prob)
+        ),
+    )
+
+
+def encode_tokens(
+    source: str, items: Sequence[TokenWordProbList], pieces: Sequence[str]
+) -> bytes:
+    out = bytearray(struct.pack("<B", BinaryFrameType.TOKENS))
+    out += _encode_text(source, "<B")
+    out += struct.pack("<H", len(items))
+    for item in items:
+        _encode_item(out, item, pieces)
+    return bytes(out)
+
+
+def encode_word_refresh(
+    i: int, j: int, item: TokenWordProbList, pieces: Sequence[str]
+) -> bytes:
+    out = bytearray(struct.pack("<BII", BinaryFrameType.WORD_REFRESH, i, j))
+    _encode_item(out, item, pieces)
+    return bytes(out)
+
+
+class _Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def read(self, fmt: str) -> Tuple[int | float, ...]:
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def read_text(self, length_format: str) -> str:
+        (length,) = self.read(length_format)
+        return self.read_bytes(int(length)).decode("utf-8")
+
+    def read_bytes(self, length: int) -> bytes:
+        data = self.data[self.offset : self.offset + length]
+        self.offset += length
+        return data
+
+
+def _decode_item(reader: _Reader, pieces: Sequence[str]) -> List[Tuple[str, float]]:
+    (k,) = reader.read("<B")
+    (length,) = reader.read("<H")
+    chosen = (
+        None if length == USE_PIECE else reader.read_bytes(int(length)).decode("utf-8")
+    )
+    values = reader.read("<" + "Ie" * int(k))
+    words = [
+        (pieces[int(values[n])], float(values[n + 1])) for n in range(0, len(values), 2)
+    ]
+    if chosen is not None and words:
+        words[0] = (chosen, words[0][1])
+    return words
+
+
+def decode_vocabulary(data: bytes) -> List[str]:
+    reader = _Reader(data)
+    _, count = reader.read("<BI")
+    return [reader.read_text("<H") for _ in range(int(count))]
+
+
+def decode_tokens(
+    data: bytes, pieces: Sequence[str]
+) -> Tuple[str, List[List[Tuple[str, float]]]]:
+    """Return the source and WordProbLists of a TOKENS frame"""
+    reader = _Reader(data)
+    reader.read("<B")
+    source = reader.read_text("<B")
+    (count,) = reader.read("<H")
+    return source, [_decode_item(reader, pieces) for _ in range(int(count))]
+
+
+def decode_word_refresh(
+    data: bytes, pieces: Sequence[str]
+) -> Tuple[int, int, List[Tuple[str, float]]]:
+    reader = _Reader(data)
+    _, i, j = reader.read("<BII")
+    return int(i), int(j), _decode_item(reader, pieces)
@@ -1,20 +1,41 @@
 import asyncio
 import copy
+import functools
+import json
+import os
+import threading
 import time
 from asyncio import Event
-from typing import Optional, Any, Union, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, Union, Dict, List, Callable, Iterator, AsyncGenerator
 
-from fastapi import WebSocket
+from fastapi import WebSocket, WebSocketDisconnect
 
 from actuosus_ai.ai_interaction.ai_chat_service import AIChatService, ChatMessage
+from actuosus_ai.ai_interaction.binary_protocol import encode_tokens, encode_vocabulary, encode_word_refresh
+from actuosus_ai.ai_interaction.detokenizer import TokenWordProbList
+from actuosus_ai.ai_interaction.inference_metrics import SEND_SECONDS
+from actuosus_ai.ai_interaction.load_progress import LoadProgress, LoadProgressTracker
+from actuosus_ai.ai_interaction.profiler import DISABLED_RECORDER, SEND, ProfileBreakdown, SpanRecorder
 from pydantic import BaseModel
 
 from actuosus_ai.ai_interaction.text_generation_service import WordProbList
-from actuosus_ai.common.actuosus_exception import ValidationException, ActuosusException
+from actuosus_ai.common.actuosus_exception import ValidationException, ActuosusException, CancelledException
 from actuosus_ai.common.message_trie import MessageTrie, Message
 
 from enum import Enum
 
+# Token generators run here so forward passes never block the event loop
+_generation_executor = ThreadPoolExecutor(thread_name_prefix="generation")
+# Marks the end of a generation stream
+_END = object()
+
+
+class ChatProtocol(Enum):
+    JSON = "json"
+    # Token streams as packed token ids and float16 probabilities, see binary_protocol
+    BINARY = "binary"
+
 
 class ChatType(Enum):
     TEXT_GENERATION = "text_generation"
@@ -51,12 +72,26 @@ class ClearMessagesRequest(BaseModel):
 class StopGenerationRequest(BaseModel):
     type_id: int = 5
 
+
+class VocabularyRequest(BaseModel):
+    type_id: int = 6
+
+
+class ProfilingRequest(BaseModel):
+    type_id: int = 7
+    enabled: bool
+    # Also write each generation's spans to a Chrome trace file on the server
+    chrome_trace: bool = False
+
 class ResponseTypeId:
     ERROR = -1
     MODEL_INFO = 0
     NEW_MESSAGE = 1
     NEW_MESSAGE_END = 2
     REFRESH_WORD = 3
+    LOAD_PROGRESS = 4
+    NEW_MESSAGE_BATCH = 5
+    PROFILE = 6
 
 class ModelInfo(BaseModel):
     ai_model_name: str
@@ -70,6 +105,10 @@ class NewMessage(BaseModel):
     source: str
     content: WordProbList
 
+class NewMessageBatch(BaseModel):
+    source: str
+    contents: List[WordProbList]
+
 class WordRefresh(BaseModel):
     i: int
     j: int
@@ -77,7 +116,92 @@ class WordRefresh(BaseModel):
 
 class ChatResponse(BaseModel):
     type_id: int
-    payload: None | ModelInfo | NewMessage | WordRefresh | bool | str
+    payload: None | ModelInfo | NewMessage | NewMessageBatch | WordRefresh | LoadProgress | ProfileBreakdown | bool | str
+
+class TimedWebSocket:
+    """Forward to the websocket, recording how long each frame takes to send"""
+
+    def __init__(self, websocket: WebSocket, text_generation_service: Any):
+        self.websocket = websocket
+        # Labels are read at send time, the model is only known once loaded
+        self.text_generation_service = text_generation_service
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.websocket, name)
+
+    async def send_json(self, data: Any) -> None:
+        start = time.perf_counter()
+        await self.websocket.send_json(data)
+        self._record(start)
+
+    async def send_bytes(self, data: bytes) -> None:
+        start = time.perf_counter()
+        await self.websocket.send_bytes(data)
+        self._record(start)
+
+    def _record(self, start: float) -> None:
+        end = time.perf_counter()
+        SEND_SECONDS.labels(*self.text_generation_service.metric_labels).observe(end - start)
+        self.text_generation_service.profiler.add(SEND, start, end)
+
+
+class MessageFrameBuffer:
+    """
+    Batch generated items into NEW_MESSAGE_BATCH frames. The first item is sent at
+    once, later ones when flush_items are buffered or flush_interval seconds after
+    the oldest buffered item.
+    """
+
+    def __init__(
+        self,
+        websocket: Union[WebSocket, TimedWebSocket],
+        source: str,
+        flush_interval: float,
+        flush_items: int,
+        pieces: Optional[List[str]] = None,
+    ):
+        self.websocket = websocket
+        self.source = source
+        self.flush_interval = flush_interval
+        self.flush_items = flush_items
+        # Vocabulary of the binary protocol, None for JSON frames
+        self.pieces = pieces
+        self.items: List[WordProbList] = []
+        self.sent_first = False
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task[None]] = None
+        # Keeps frames in order when a timed flush and an explicit one overlap
+        self._send_lock = asyncio.Lock()
+
+    async def add(self, item: WordProbList) -> None:
+        self.items.append(item)
+        if not self.sent_first or len(self.items) >= self.flush_items:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_later)
+
+    def _flush_later(self) -> None:
+        self._timer = None
+        self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> None:
+        self.cancel()
+        items, self.items = self.items, []
+        self.sent_first = self.sent_first or bool(items)
+        # Taking the lock even without items waits for a timed flush still sending
+        async with self._send_lock:
+            if not items:
+                return
+            if self.pieces is not None and all(isinstance(item, TokenWordProbList) for item in items):
+                await self.websocket.send_bytes(encode_tokens(self.source, items, self.pieces))  # type: ignore[arg-type]
+            else:
+                await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.NEW_MESSAGE_BATCH, payload=NewMessageBatch(source=self.source, contents=items)).model_dump())
+
+    def cancel(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
 
 class ChatWebSocketOrchestrator:
     def __init__(self, ai_chat_service: AIChatService):
@@ -85,14 +209,37 @@ class ChatWebSocketOrchestrator:
         self.trie = MessageTrie()
         self.messages: list[Message] = []
         self.text_generation_service = ai_chat_service.text_generation_service
-        self.chat_type = None
-        self.websocket = None
+        self.chat_type: Optional[ChatType] = None
+        self.protocol = ChatProtocol.JSON
+        self._websocket: Optional[TimedWebSocket] = None
         self.user_role = "user"
         self.ai_role = "assistant"
         self.system_prompt = "You are a helpful assistant"
         self.temperature = 1.0
         self.max_new_tokens = 300
         self.min_prob = 0.001
+        # Seconds between load progress frames
+        self.load_progress_interval = 0.25
+        # Generated items buffered between the generation thread and the socket
+        self.generation_queue_size = 16
+        # Generated items are batched into frames, flushed after this many seconds or items
+        self.flush_interval = 0.05
+        self.flush_items = 8
+        # Messages received while the model was loading
+        self.pending_messages: List[Dict[str, Any]] = []
+        # Send a timing breakdown of each generation, optionally with a Chrome trace
+        self.profiling = False
+        self.profiling_chrome_trace = False
+
+    @property
+    def websocket(self) -> TimedWebSocket:
+        if self._websocket is None:
+            raise ValidationException("The websocket is set when the model is loaded")
+        return self._websocket
+
+    @websocket.setter
+    def websocket(self, websocket: TimedWebSocket) -> None:
+        self._websocket = websocket
 
     async def load(
         self,
@@ -101,16 +248,66 @@ class ChatWebSocketOrchestrator:
         ai_model_id: int,
         quantization: Optional[str] = None,
         gguf_file_name: Optional[str] = None,
+        protocol: str = ChatProtocol.JSON.value,
     ) -> None:
-        await self.chat_service.load_model(ai_model_id, quantization, gguf_file_name)
         self.chat_type = ChatType(chat_type)
-        self.websocket = websocket
+        self.protocol = ChatProtocol(protocol)
+        self.websocket = TimedWebSocket(websocket, self.text_generation_service)
+        progress = LoadProgressTracker()
+        loading = asyncio.create_task(
+            self.chat_service.load_model(ai_model_id, quantization, gguf_file_name, progress)
+        )
+        # Keep reading the socket so that a client leaving cancels the load
+        receiving = asyncio.create_task(websocket.receive())
+        sent = None
+        try:
+            while True:
+                await asyncio.wait({loading, receiving}, timeout=self.load_progress_interval)
+                if receiving.done():
+                    message = receiving.result()
+                    if message["type"] == "websocket.disconnect":
+                        progress.cancel_event.set()
+                        try:
+                            await loading
+                        except CancelledException:
+                            pass
+                        raise WebSocketDisconnect(message.get("code", 1000))
+                    self.pending_messages.append(dict(message))
+                    receiving = asyncio.create_task(websocket.receive())
+                if loading.done():
+                    break
+                snapshot = progress.snapshot()
+                if snapshot != sent:
+                    await websocket.send_json(ChatResponse(type_id=ResponseTypeId.LOAD_PROGRESS, payload=snapshot).model_dump())
+                    sent = snapshot
+        finally:
+            receiving.cancel()
+        loading.result()
+
+    def binary_pieces(self) -> Optional[List[str]]:
+        """Return the vocabulary of the binary protocol, None when frames are JSON"""
+        detokenizer = self.text_generation_service.detokenizer
+        if self.protocol != ChatProtocol.BINARY or detokenizer is None:
+            return None
+        return detokenizer.pieces
+
+    async def send_vocabulary(self) -> None:
+        pieces = self.binary_pieces()
+        if pieces is None:
+            raise ValidationException("The vocabulary is only sent with the binary protocol")
+        await self.websocket.send_bytes(encode_vocabulary(pieces))
+
+    async def _receive_json(self) -> Any:
+        if self.pending_messages:
+            message = self.pending_messages.pop(0)
+            return json.loads(message.get("text") or message["bytes"])
+        return await self.websocket.receive_json()
 
     @staticmethod
     def _parse_chat_request(
-        json_body: Dict,
+        json_body: Dict[str, Any],
     ) -> Union[
-        NewMessageRequest, SelectWordRequest, ChangeConfigRequest, RefreshWordRequest, ClearMessagesRequest, StopGenerationRequest
+        NewMessageRequest, SelectWordRequest, ChangeConfigRequest, RefreshWordRequest, ClearMessagesRequest, StopGenerationRequest, VocabularyRequest, ProfilingRequest
     ]:
         type_id = json_body.get("type_id")
 
@@ -126,6 +323,10 @@ class ChatWebSocketOrchestrator:
             return ClearMessagesRequest(**json_body)
         elif type_id == 5:
             return StopGenerationRequest(**json_body)
+        elif type_id == 6:
+            return VocabularyRequest(**json_body)
+        elif type_id == 7:
+            return ProfilingRequest(**json_body)
         else:
             raise ValidationException("Invalid type_id")
 
@@ -147,35 +348,104 @@ class ChatWebSocketOrchestrator:
     def convert_for_text_generation(self, messages: List[Message]) -> str:
         return self.flatten_messages(messages[-1]["content"])
 
+    async def stream_in_executor(
+        self, generate: Callable[[], Iterator[WordProbList]]
+    ) -> AsyncGenerator[WordProbList, None]:
+        """Run a token generator on the generation executor and yield its items on the event loop"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue[Any] = asyncio.Queue(self.generation_queue_size)
+        closed = threading.Event()
+
+        def put(item: Any) -> None:
+            # Blocks while the queue is full, so generation never runs far ahead of sending
+            if not closed.is_set():
+                asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+        def produce() -> None:
+            try:
+                generator = generate()
+                try:
+                    for item in generator:
+                        if closed.is_set():
+                            break
+                        put(item)
+                finally:
+                    close = getattr(generator, "close", None)
+                    if close:
+                        close()
+            except Exception as e:
+                put(e)
+            finally:
+                put(_END)
+
+        loop.run_in_executor(_generation_executor, produce)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Stop the producer and unblock a pending put
+            closed.set()
+            while not queue.empty():
+                queue.get_nowait()
+
     async def generation(self, stop_event: Event) -> None:
+        # The services record their phases on the session's profiler while it runs
+        profiler = SpanRecorder() if self.profiling else DISABLED_RECORDER
+        self.text_generation_service.profiler = profiler
+        start = time.perf_counter()
+        try:
+            await self._generation(stop_event)
+        finally:
+            self.text_generation_service.profiler = DISABLED_RECORDER
+        if profiler.enabled:
+            await self.send_profile(profiler, time.perf_counter() - start)
+
+    async def send_profile(self, profiler: SpanRecorder, total_seconds: float) -> None:
+        breakdown = profiler.breakdown(total_seconds)
+        if self.profiling_chrome_trace:
+            settings = self.text_generation_service.settings
+            trace_dir = settings.profile_trace_dir or os.path.join(settings.base_file_storage_path, "traces")
+            breakdown.trace_file = f"generation-{time.time_ns()}.json"
+            await asyncio.to_thread(profiler.dump_chrome_trace, os.path.join(trace_dir, breakdown.trace_file))
+        await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.PROFILE, payload=breakdown).model_dump())
+
+    async def _generation(self, stop_event: Event) -> None:
         # Generate the messages
         if self.chat_type == ChatType.CHAT:
             if self.messages[-1]["source"] == self.user_role:
                 self.messages.append({"content": [], "source": self.ai_role})
-            for item in await asyncio.to_thread(
+            generate = functools.partial(
                 self.chat_service.generate_chat_tokens_with_probabilities,
                 messages=self.convert_for_chat(self.messages),
                 temperature=self.temperature,
                 max_new_tokens=self.max_new_tokens,
                 min_prob=self.min_prob,
                 stop_event=stop_event
-            ):
-                await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.NEW_MESSAGE, payload=NewMessage(source='ai', content=item)).model_dump())
-                await asyncio.to_thread(self.messages[-1]["content"].append, item)
-
-        elif self.chat_type == ChatType.TEXT_GENERATION:
-            for item in await asyncio.to_thread(
+            )
+        else:
+            generate = functools.partial(
                 self.text_generation_service.generate_tokens_with_probabilities,
                 prompt=self.convert_for_text_generation(self.messages),
                 temperature=self.temperature,
                 max_new_tokens=self.max_new_tokens,
                 min_prob=self.min_prob,
                 stop_event=stop_event
-            ):
-                await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.NEW_MESSAGE, payload=NewMessage(source='ai', content=item)).model_dump())
-                await asyncio.to_thread(self.messages[-1]["content"].append, item)
-
-        # End and save the message
+            )
+        buffer = MessageFrameBuffer(self.websocket, 'ai', self.flush_interval, int(self.flush_items), self.binary_pieces())
+        try:
+            async for item in self.stream_in_executor(generate):
+                self.messages[-1]["content"].append(item)
+                await buffer.add(item)
+        finally:
+            buffer.cancel()
+
+        # End and save the message, the buffered items go out first
+        await buffer.flush()
         await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.NEW_MESSAGE_END, payload=self.chat_service.text_generation_service.end_with_eos).model_dump())
         self.trie.insert(self.messages)
 
@@ -207,43 +477,54 @@ class ChatWebSocketOrchestrator:
         ]
         await self.generation(stop_event)
 
+    async def send_word_refresh(self, request: RefreshWordRequest, item: WordProbList, type_id: int) -> None:
+        pieces = self.binary_pieces()
+        if pieces is not None and isinstance(item, TokenWordProbList):
+            await self.websocket.send_bytes(encode_word_refresh(request.i, request.j, item, pieces))
+        else:
+            await self.websocket.send_json(ChatResponse(type_id=type_id, payload=WordRefresh(i=request.i, j=request.j, content=item)).model_dump())
+
     async def handle_refresh_word(self, request: RefreshWordRequest) -> None:
         temp_message = copy.deepcopy(self.messages[: request.i + 1])
         temp_message[-1]["content"] = temp_message[-1]["content"][: request.j]
         if self.chat_type == ChatType.CHAT:
-            for item in self.chat_service.generate_chat_tokens_with_probabilities(
+            async for item in self.stream_in_executor(functools.partial(
+                    self.chat_service.generate_chat_tokens_with_probabilities,
                     messages=self.convert_for_chat(temp_message), max_new_tokens=1, temperature=self.temperature, min_prob=self.min_prob
-            ):
-                await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.REFRESH_WORD,
-                                                            payload=WordRefresh(i=request.i, j=request.j, content=item)).model_dump())
+            )):
+                await self.send_word_refresh(request, item, ResponseTypeId.REFRESH_WORD)
 
         elif self.chat_type == ChatType.TEXT_GENERATION:
-            for item in self.text_generation_service.generate_tokens_with_probabilities(
+            async for item in self.stream_in_executor(functools.partial(
+                    self.text_generation_service.generate_tokens_with_probabilities,
                     prompt=self.convert_for_text_generation(temp_message), max_new_tokens=1, temperature=self.temperature, min_prob=self.min_prob
-            ):
-                await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.NEW_MESSAGE,
-                                                            payload=WordRefresh(i=request.i, j=request.j, content=item)).model_dump())
+            )):
+                await self.send_word_refresh(request, item, ResponseTypeId.NEW_MESSAGE)
+
 
+    def handle_profiling(self, request: ProfilingRequest) -> None:
+        self.profiling = request.enabled
+        self.profiling_chrome_trace = request.chrome_trace
 
     async def run(self) -> None:
         current_task = None
         stop_event = asyncio.Event()
         while True:
-            data = await self.websocket.receive_json()
+            data = await self._receive_json()
             request = self._parse_chat_request(data)
             try:
-                match request.type_id:
-                    case 0:
+                match request:
+                    case NewMessageRequest():
                         current_task = asyncio.create_task(self.handle_new_message(request, stop_event))
-                    case 1:
+                    case SelectWordRequest():
                         current_task = asyncio.create_task(self.handle_select_new_word(request, stop_event))
-                    case 2:
+                    case ChangeConfigRequest():
                         setattr(self, request.config_name, int(request.config_value) if request.config_value.isdigit() else float(request.config_value))
-                    case 3:
+                    case RefreshWordRequest():
                         await self.handle_refresh_word(request)
-                    case 4:
+                    case ClearMessagesRequest():
                         self.messages = []
-                    case 5:
+                    case StopGenerationRequest():
                         if current_task:
                             stop_event.set()
                             try:
@@ -251,6 +532,10 @@ class ChatWebSocketOrchestrator:
                             except asyncio.CancelledError:
                                 pass
                             stop_event.clear()
+                    case VocabularyRequest():
+                        await self.send_vocabulary()
+                    case ProfilingRequest():
+                        self.handle_profiling(request)
 
             except Exception as e:
                 await self.websocket.send_json(ChatResponse(type_id=ResponseTypeId.ERROR, payload=str(e)).model_dump())
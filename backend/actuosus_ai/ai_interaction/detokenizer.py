@@ -0,0 +1,125 @@
+import codecs
+from typing import Any, List, Optional, Sequence, Tuple
+
+# Token ids with their probabilities
+TokenProbList = List[Tuple[int, float]]
+
+
+class TokenWordProbList(List[Tuple[str, float]]):
+    """A WordProbList that also keeps the token ids of its words"""
+
+    def __init__(self, words: List[Tuple[str, float]], token_ids: List[int]):
+        super().__init__(words)
+        self.token_ids = token_ids
+
+
+class DetokenizerStream:
+    """Incremental text of one generated sequence, partial characters are held back"""
+
+    # Prompt tokens kept as decoding context so leading spaces come out right
+    CONTEXT_TOKENS = 6
+
+    def __init__(self, detokenizer: "Detokenizer", prompt_tokens: Sequence[int]):
+        self.detokenizer = detokenizer
+        self.tokens = list(prompt_tokens[-self.CONTEXT_TOKENS :])
+        self.prefix_offset = 0
+        self.read_offset = len(self.tokens)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def push(self, token_id: int) -> str:
+        """Add the chosen token and return the text it completes"""
+        piece_bytes = self.detokenizer.piece_bytes
+        if piece_bytes is not None:
+            # Byte level pieces, an incomplete UTF-8 sequence stays in the decoder
+            return str(self._utf8.decode(piece_bytes[token_id]))
+
+        self.tokens.append(token_id)
+        decode = self.detokenizer.decode
+        prefix_text = decode(self.tokens[self.prefix_offset : self.read_offset])
+        new_text = decode(self.tokens[self.prefix_offset :])
+        if new_text.endswith("�"):
+            # Wait for the rest of the multi-byte character
+            return ""
+        self.prefix_offset = self.read_offset
+        self.read_offset = len(self.tokens)
+        return str(new_text[len(prefix_text) :])
+
+    def words(self, top_k_with_prob: TokenProbList) -> TokenWordProbList:
+        """Turn a sampled step into a WordProbList, the first token is the chosen one"""
+        (next_token, next_prob), *alternatives = top_k_with_prob
+        pieces = self.detokenizer.pieces
+        return TokenWordProbList(
+            [(self.push(next_token), next_prob)]
+            + [(pieces[token], prob) for token, prob in alternatives],
+            [token for token, _ in top_k_with_prob],
+        )
+
+
+class Detokenizer:
+    """
+    Decoded text of every token in a model's vocabulary, computed once at load
+    time, so the alternatives at each step are table lookups instead of tokenizer
+    calls.
+
+    Pieces keep their leading space. Tokens that are only part of a multi-byte
+    character show up as U+FFFD in the table.
+    """
+
+    def __init__(
+        self,
+        pieces: List[str],
+        tokenizer: Any = None,
+        piece_bytes: Optional[List[bytes]] = None,
+    ):
+        self.pieces = pieces
+        self.tokenizer = tokenizer
+        self.piece_bytes = piece_bytes
+
+    @classmethod
+    def from_hf(cls, tokenizer: Any, vocab_size: Optional[int] = None) -> "Detokenizer":
+        """
+        vocab_size is the model's, the logits dimension. It may be padded past the
+        tokenizer's vocabulary, the ids without a token get an empty piece.
+        """
+        # Decode every token after an anchor and strip the anchor, so SentencePiece
+        # keeps the leading space it drops at the start of a text
+        anchor = tokenizer.encode("a", add_special_tokens=False)[-1:]
+        anchor_text = tokenizer.decode(
+            anchor, skip_special_tokens=False, clean_up_tokenization_spaces=False
+        )
+        decoded = tokenizer.batch_decode(
+            [anchor + [token_id] for token_id in range(len(tokenizer))],
+            skip_special_tokens=False,
+            clean_up_tokenization_spaces=False,
+        )
+        pieces = [text[len(anchor_text) :] for text in decoded]
+        pieces += [""] * ((vocab_size or 0) - len(pieces))
+        return cls(pieces, tokenizer=tokenizer)
+
+    @classmethod
+    def from_llama(cls, model: Any) -> "Detokenizer":
+        piece_bytes = [
+            model.detokenize([token_id], special=True)
+            for token_id in range(model.n_vocab())
+        ]
+        return cls(
+            [piece.decode("utf-8", errors="replace") for piece in piece_bytes],
+            piece_bytes=piece_bytes,
+        )
+
+    def __len__(self) -> int:
+        return len(self.pieces)
+
+    def piece(self, token_id: int) -> str:
+        return self.pieces[token_id]
+
+    def decode(self, tokens: Sequence[int]) -> str:
+        return str(
+            self.tokenizer.decode(
+                tokens, skip_special_tokens=False, clean_up_tokenization_spaces=False
+            )
+        )
+
+    def stream(self, prompt_tokens: Sequence[int] = ()) -> DetokenizerStream:
+        """Start incremental decoding of a sequence generated after the prompt"""
+        return DetokenizerStream(self, prompt_tokens)
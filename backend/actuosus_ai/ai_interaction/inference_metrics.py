@@ -0,0 +1,127 @@
+import time
+from typing import Generator, Iterator, Optional, Tuple, TypeVar
+
+from actuosus_ai.ai_interaction.model_memory import ProcessMemory
+from actuosus_ai.common.metrics import metrics_registry
+
+# (model name, quantization) every inference metric is labeled with
+MetricLabels = Tuple[str, str]
+LABEL_NAMES = ("model", "quantization")
+UNKNOWN_LABELS: MetricLabels = ("unknown", "none")
+
+T = TypeVar("T")
+
+TIME_TO_FIRST_TOKEN = metrics_registry.histogram(
+    "actuosus_time_to_first_token_seconds",
+    "Time from a generation request to its first token, prefill included",
+    LABEL_NAMES,
+)
+INTER_TOKEN_LATENCY = metrics_registry.histogram(
+    "actuosus_inter_token_latency_seconds",
+    "Time between consecutive tokens of a generation, as the model's worker "
+    "produces them",
+    LABEL_NAMES,
+)
+TOKENS_PER_SECOND = metrics_registry.histogram(
+    "actuosus_tokens_per_second",
+    "Decode rate of a generation, after its first token",
+    LABEL_NAMES,
+    buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000),
+)
+PREFILL_SECONDS = metrics_registry.histogram(
+    "actuosus_prefill_seconds",
+    "Forward pass over the uncached prompt tokens",
+    LABEL_NAMES,
+)
+DECODE_STEP_SECONDS = metrics_registry.histogram(
+    "actuosus_decode_step_seconds",
+    "Forward pass of one decode step, shared by the batched sequences",
+    LABEL_NAMES,
+)
+CHAT_TEMPLATE_SECONDS = metrics_registry.histogram(
+    "actuosus_chat_template_seconds",
+    "Rendering the chat messages into a prompt",
+    LABEL_NAMES,
+)
+SEND_SECONDS = metrics_registry.histogram(
+    "actuosus_websocket_send_seconds",
+    "Sending one frame to the chat websocket",
+    LABEL_NAMES,
+)
+MODEL_LOAD_SECONDS = metrics_registry.gauge(
+    "actuosus_model_load_seconds",
+    "How long the last load of the model took",
+    LABEL_NAMES,
+)
+QUEUE_WAIT_SECONDS = metrics_registry.gauge(
+    "actuosus_queue_wait_seconds",
+    "How long the last generation waited for the model's worker",
+    LABEL_NAMES,
+)
+ACTIVE_SESSIONS = metrics_registry.gauge(
+    "actuosus_active_sessions",
+    "Sessions holding the model",
+    LABEL_NAMES,
+)
+LOADED_MODEL_RAM_BYTES = metrics_registry.gauge(
+    "actuosus_loaded_model_ram_bytes",
+    "RAM held by the loaded model's weights and context",
+    LABEL_NAMES,
+)
+LOADED_MODEL_VRAM_BYTES = metrics_registry.gauge(
+    "actuosus_loaded_model_vram_bytes",
+    "VRAM held by the loaded model's weights and context",
+    LABEL_NAMES,
+)
+PROCESS_RSS_BYTES = metrics_registry.gauge(
+    "actuosus_process_rss_bytes",
+    "Resident memory of the server process",
+)
+PROCESS_PSS_BYTES = metrics_registry.gauge(
+    "actuosus_process_pss_bytes",
+    "Proportional set size of the server process",
+)
+PROCESS_VRAM_BYTES = metrics_registry.gauge(
+    "actuosus_process_vram_bytes",
+    "VRAM used by the server process on every GPU",
+)
+
+
+def model_labels(
+    name: str, quantization: Optional[str], gguf_file_name: Optional[str]
+) -> MetricLabels:
+    """GGUF models are labeled with their file, which names the quantization"""
+    if quantization == "gguf" and gguf_file_name:
+        return name, gguf_file_name
+    return name, quantization or "none"
+
+
+def record_process_memory(memory: ProcessMemory) -> None:
+    PROCESS_RSS_BYTES.labels().set(memory.rss_bytes)
+    PROCESS_PSS_BYTES.labels().set(memory.pss_bytes)
+    PROCESS_VRAM_BYTES.labels().set(memory.vram_bytes)
+
+
+def timed_tokens(items: Iterator[T], labels: MetricLabels) -> Generator[T, None, None]:
+    """
+    Yield the items, recording the time to the first one and the decode rate as
+    the consumer sees them
+    """
+    start = last = time.perf_counter()
+    first = None
+    count = 0
+    try:
+        for item in items:
+            now = time.perf_counter()
+            if first is None:
+                first = now
+                TIME_TO_FIRST_TOKEN.labels(*labels).observe(now - start)
+            last = now
+            count += 1
+            yield item
+    finally:
+        close = getattr(items, "close", None)
+        if close:
+            close()
+        if first is not None and count > 1 and last > first:
+            TOKENS_PER_SECOND.labels(*labels).observe((count - 1) / (last - first))
@@ -0,0 +1,496 @@
+import queue
+import threading
+import time
+from asyncio import Event
+from collections import deque
+from typing import Any, Deque, Generator, Iterator, List, Optional, Tuple
+
+import torch
+from torch import Tensor
+from transformers import DynamicCache
+
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer, DetokenizerStream
+from actuosus_ai.ai_interaction.inference_metrics import (
+    DECODE_STEP_SECONDS,
+    INTER_TOKEN_LATENCY,
+    LOADED_MODEL_RAM_BYTES,
+    LOADED_MODEL_VRAM_BYTES,
+    PREFILL_SECONDS,
+    QUEUE_WAIT_SECONDS,
+    UNKNOWN_LABELS,
+    MetricLabels,
+)
+from actuosus_ai.ai_interaction.model_memory import ModelMemory
+from actuosus_ai.ai_interaction.model_state_cache import ModelStateCache
+from actuosus_ai.ai_interaction.profiler import (
+    DECODING,
+    DISABLED_RECORDER,
+    FORWARD,
+    PREFILL,
+    SAMPLING,
+    SpanRecorder,
+)
+from actuosus_ai.ai_interaction.sampling import MIN_PROB_ERROR_MESSAGE, sample_top_k
+from actuosus_ai.common.actuosus_exception import InternalException
+
+# Marks the end of a sequence's result stream
+_END = object()
+
+
+class ScheduledSequence:
+    """A generation request handled by the scheduler, results are read with stream()"""
+
+    def __init__(
+        self,
+        prompt_tokens: List[int],
+        max_new_tokens: int,
+        k: int,
+        temperature: float,
+        min_prob: float,
+        stop_event: Optional[Event],
+        state_cache: Optional[ModelStateCache],
+        source: Optional[Iterator[List[Tuple[str, float]]]] = None,
+        profiler: SpanRecorder = DISABLED_RECORDER,
+    ):
+        self.prompt_tokens = prompt_tokens
+        self.max_new_tokens = max_new_tokens
+        self.k = k
+        self.temperature = temperature
+        self.min_prob = min_prob
+        self.stop_event = stop_event
+        self.state_cache = state_cache
+        # Generator run as a whole by the worker instead of being batched
+        self.source = source
+        self.profiler = profiler
+        self.results: queue.Queue[Any] = queue.Queue()
+        self.end_with_eos = False
+        self.cancelled = False
+        self.queued_at = time.perf_counter()
+        self.last_token_at: Optional[float] = None
+
+        # Decoding state owned by the worker thread
+        self.tokens: List[int] = []
+        self.pending: List[int] = []
+        self.past_key_values: Any = None
+        self.detokenizer_stream: Optional[DetokenizerStream] = None
+        self.logits: Optional[Tensor] = None
+        self.sampled = 0
+
+    def stream(self) -> Generator[List[Tuple[str, float]], None, None]:
+        """Yield the generated WordProbLists until the sequence finishes"""
+        try:
+            while True:
+                item = self.results.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Tell the worker to drop the sequence if the consumer stopped early
+            self.cancelled = True
+
+    def should_stop(self) -> bool:
+        return self.cancelled or bool(self.stop_event and self.stop_event.is_set())
+
+
+class InferenceScheduler:
+    """
+    Own a loaded model and run every session's generation on it from one worker
+    thread.
+
+    For HF models, the decode steps of all active sequences are merged into one
+    batched forward pass. Sequences join after their own prefill and leave at any
+    token boundary. llama.cpp keeps a single context per model, so GGUF
+    generations run one after another on the worker instead.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        tokenizer: Any,
+        gguf: bool,
+        detokenizer: Optional[Detokenizer] = None,
+        memory: Optional[ModelMemory] = None,
+        labels: Optional[MetricLabels] = None,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.gguf = gguf
+        if detokenizer is None:
+            detokenizer = (
+                Detokenizer.from_llama(model)
+                if gguf
+                else Detokenizer.from_hf(tokenizer, model.config.vocab_size)
+            )
+        self.detokenizer = detokenizer
+        self.memory = memory or ModelMemory()
+        self.device = None if gguf else model.device
+        # Metrics of the model are labeled with these, set only for loaded models
+        self.labels = labels or UNKNOWN_LABELS
+        self._has_memory_metrics = labels is not None
+        if self._has_memory_metrics:
+            LOADED_MODEL_RAM_BYTES.labels(*self.labels).set(self.memory.ram_bytes)
+            LOADED_MODEL_VRAM_BYTES.labels(*self.labels).set(self.memory.vram_bytes)
+
+        # The caches of the decoding sequences merged into one left padded batch,
+        # rebuilt only when sequences join or leave
+        self._batch: List[ScheduledSequence] = []
+        self._batch_past: Optional[DynamicCache] = None
+        # None while no row is padded
+        self._batch_mask: Optional[Tensor] = None
+        self._waiting: Deque[ScheduledSequence] = deque()
+        self._active: List[ScheduledSequence] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="inference-scheduler", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def estimated_ram(self) -> float:
+        """RAM held by the model in GB"""
+        return self.memory.ram_gb
+
+    @property
+    def estimated_vram(self) -> float:
+        """VRAM held by the model in GB"""
+        return self.memory.vram_gb
+
+    @property
+    def active_sequences(self) -> int:
+        return len(self._active) + len(self._waiting)
+
+    def submit(
+        self,
+        prompt_tokens: List[int],
+        max_new_tokens: int,
+        k: int,
+        temperature: float,
+        min_prob: float,
+        stop_event: Optional[Event] = None,
+        state_cache: Optional[ModelStateCache] = None,
+        profiler: SpanRecorder = DISABLED_RECORDER,
+    ) -> ScheduledSequence:
+        """Queue a prompt to join the decode batch at the next token boundary"""
+        return self._enqueue(
+            ScheduledSequence(
+                prompt_tokens,
+                max_new_tokens,
+                k,
+                temperature,
+                min_prob,
+                stop_event,
+                state_cache,
+                profiler=profiler,
+            )
+        )
+
+    def submit_serial(
+        self, source: Iterator[List[Tuple[str, float]]]
+    ) -> ScheduledSequence:
+        """Queue a generator to be run on the worker without batching"""
+        return self._enqueue(
+            ScheduledSequence([], 0, 0, 1.0, 0.0, None, None, source=source)
+        )
+
+    def _enqueue(self, sequence: ScheduledSequence) -> ScheduledSequence:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The inference scheduler is closed")
+            self._waiting.append(sequence)
+            self._condition.notify()
+        return sequence
+
+    def close(self) -> None:
+        """Stop the worker, pending sequences are ended"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        if self._has_memory_metrics:
+            LOADED_MODEL_RAM_BYTES.remove(*self.labels)
+            LOADED_MODEL_VRAM_BYTES.remove(*self.labels)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._waiting and not self._active and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    for sequence in [*self._waiting, *self._active]:
+                        sequence.results.put(_END)
+                    self._waiting.clear()
+                    self._active.clear()
+                    self._drop_batch()
+                    self.model = None
+                    return
+                joining = list(self._waiting)
+                self._waiting.clear()
+
+            for sequence in joining:
+                if sequence.source is not None:
+                    self._run_serial(sequence)
+                else:
+                    self._prefill(sequence)
+            if self._active:
+                self._sample_active()
+            if self._active:
+                self._decode_active()
+
+    def _record_queue_wait(self, sequence: ScheduledSequence) -> None:
+        QUEUE_WAIT_SECONDS.labels(*self.labels).set(
+            time.perf_counter() - sequence.queued_at
+        )
+
+    @staticmethod
+    def _record_batch(
+        sequences: List[ScheduledSequence], name: str, start: float
+    ) -> None:
+        """Record a step shared by the batch on every sequence that is profiled"""
+        end = time.perf_counter()
+        for sequence in sequences:
+            sequence.profiler.add(name, start, end)
+
+    def _put_token(self, sequence: ScheduledSequence, item: Any) -> None:
+        """Hand a token to the consumer, timed from the sequence's previous one"""
+        now = time.perf_counter()
+        if sequence.last_token_at is not None:
+            INTER_TOKEN_LATENCY.labels(*self.labels).observe(
+                now - sequence.last_token_at
+            )
+        sequence.last_token_at = now
+        sequence.results.put(item)
+
+    def _run_serial(self, sequence: ScheduledSequence) -> None:
+        assert sequence.source is not None
+        self._record_queue_wait(sequence)
+        try:
+            for item in sequence.source:
+                if sequence.cancelled:
+                    break
+                self._put_token(sequence, item)
+        except Exception as e:
+            sequence.results.put(e)
+        finally:
+            close = getattr(sequence.source, "close", None)
+            if close:
+                close()
+            sequence.results.put(_END)
+
+    @staticmethod
+    def _as_cache(past_key_values: Any) -> Optional[DynamicCache]:
+        """
+        Wrap legacy tuples into a DynamicCache, the only form models take from
+        transformers 4.47 on. The tensors are shared, not copied.
+        """
+        if past_key_values is None or isinstance(past_key_values, DynamicCache):
+            return past_key_values
+        return DynamicCache.from_legacy_cache(past_key_values)
+
+    def _legacy_past(self, sequence: ScheduledSequence) -> Any:
+        """Views of the sequence's keys and values as legacy tuples, None if it has none"""
+        if sequence in self._batch:
+            assert self._batch_past is not None
+            row = self._batch.index(sequence)
+            pad = self._batch_past.get_seq_length() - len(sequence.tokens)
+            return tuple(
+                tuple(tensor[row : row + 1, ..., pad:, :] for tensor in layer)
+                for layer in self._batch_past.to_legacy_cache()
+            )
+        if sequence.past_key_values is None:
+            return None
+        return sequence.past_key_values.to_legacy_cache()
+
+    def _drop_batch(self) -> None:
+        self._batch = []
+        self._batch_past = None
+        self._batch_mask = None
+
+    def _prefill(self, sequence: ScheduledSequence) -> None:
+        self._record_queue_wait(sequence)
+        if sequence.max_new_tokens <= 0:
+            sequence.results.put(_END)
+            return
+        try:
+            cached_length, past_key_values = (
+                sequence.state_cache.restore_hf_past(sequence.prompt_tokens)
+                if sequence.state_cache is not None
+                else (0, None)
+            )
+            sequence.tokens = sequence.prompt_tokens[:cached_length]
+            pending = sequence.prompt_tokens[cached_length:]
+            start = time.perf_counter()
+            with torch.no_grad():
+                outputs = self.model(
+                    torch.tensor([pending], device=self.device),
+                    past_key_values=self._as_cache(past_key_values),
+                    use_cache=True,
+                )
+            end = time.perf_counter()
+            PREFILL_SECONDS.labels(*self.labels).observe(end - start)
+            sequence.profiler.add(PREFILL, start, end)
+            sequence.past_key_values = self._as_cache(outputs.past_key_values)
+            sequence.tokens += pending
+            sequence.logits = outputs.logits[:, -1, :]
+            sequence.detokenizer_stream = self.detokenizer.stream(
+                sequence.prompt_tokens
+            )
+            self._active.append(sequence)
+        except Exception as e:
+            sequence.results.put(e)
+            sequence.results.put(_END)
+
+    def _finish(self, sequence: ScheduledSequence) -> None:
+        past = self._legacy_past(sequence)
+        if sequence.state_cache is not None and past is not None:
+            sequence.state_cache.save_hf_past(sequence.tokens, self._compact(past))
+        sequence.past_key_values = None
+        sequence.logits = None
+        sequence.detokenizer_stream = None
+        sequence.results.put(_END)
+
+    @staticmethod
+    def _compact(past_key_values: Any) -> Any:
+        """Copy the tensors that are views into a batched cache, so it can be freed"""
+        return tuple(
+            tuple(
+                tensor.clone()
+                if tensor.untyped_storage().nbytes()
+                > tensor.numel() * tensor.element_size()
+                else tensor
+                for tensor in layer
+            )
+            for layer in past_key_values
+        )
+
+    def _sample_active(self) -> None:
+        # Sample every active sequence at once with its own settings
+        start = time.perf_counter()
+        logits = torch.cat([sequence.logits for sequence in self._active])  # type: ignore[misc]
+        rows = sample_top_k(
+            logits,
+            max(sequence.k for sequence in self._active),
+            temperature=[sequence.temperature for sequence in self._active],
+            min_prob=[sequence.min_prob for sequence in self._active],
+        )
+        self._record_batch(self._active, SAMPLING, start)
+
+        still_active = []
+        for sequence, row in zip(self._active, rows):
+            top_k_with_prob = row[: sequence.k]
+            if not top_k_with_prob:
+                sequence.results.put(InternalException(MIN_PROB_ERROR_MESSAGE))
+                self._finish(sequence)
+                continue
+            sequence.sampled += 1
+
+            # Check for stop event or the consumer going away
+            if sequence.should_stop():
+                self._finish(sequence)
+                continue
+
+            # Check for eos token
+            next_token = top_k_with_prob[0][0]
+            if next_token == self.tokenizer.eos_token_id:
+                sequence.end_with_eos = True
+                self._finish(sequence)
+                continue
+
+            assert sequence.detokenizer_stream is not None
+            with sequence.profiler.span(DECODING):
+                words = sequence.detokenizer_stream.words(top_k_with_prob)
+            self._put_token(sequence, words)
+            if sequence.sampled >= sequence.max_new_tokens:
+                self._finish(sequence)
+                continue
+            sequence.pending = [next_token]
+            still_active.append(sequence)
+        self._active = still_active
+        # Return the cached blocks once the batch drains, not on every token
+        if not self._active:
+            self._drop_batch()
+            torch.cuda.empty_cache()
+
+    def _rebuild_batch(self) -> None:
+        """Merge the caches of the active sequences into one left padded batch"""
+        sequences = self._active
+        pasts = [self._legacy_past(sequence) for sequence in sequences]
+        lengths = [len(sequence.tokens) for sequence in sequences]
+        longest = max(lengths)
+
+        def pad(tensor: Tensor, length: int) -> Tensor:
+            if length == longest:
+                return tensor
+            return torch.nn.functional.pad(tensor, (0, 0, longest - length, 0))
+
+        batched_past = pasts[0]
+        if len(sequences) > 1:
+            batched_past = tuple(
+                tuple(
+                    torch.cat(
+                        [
+                            pad(past[layer][i], length)
+                            for past, length in zip(pasts, lengths)
+                        ],
+                        dim=0,
+                    )
+                    for i in range(len(pasts[0][layer]))
+                )
+                for layer in range(len(pasts[0]))
+            )
+        self._batch_mask = None
+        if min(lengths) < longest:
+            self._batch_mask = torch.zeros(
+                (len(sequences), longest), dtype=torch.long, device=self.device
+            )
+            for row, length in enumerate(lengths):
+                self._batch_mask[row, longest - length :] = 1
+        self._batch = list(sequences)
+        self._batch_past = self._as_cache(batched_past)
+        # The batch holds their keys and values from now on
+        for sequence in sequences:
+            sequence.past_key_values = None
+
+    def _decode_active(self) -> None:
+        sequences = self._active
+        if sequences != self._batch:
+            self._rebuild_batch()
+        if self._batch_mask is not None:
+            self._batch_mask = torch.cat(
+                [self._batch_mask, self._batch_mask.new_ones((len(sequences), 1))],
+                dim=1,
+            )
+
+        start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                outputs = self.model(
+                    torch.tensor(
+                        [sequence.pending for sequence in sequences], device=self.device
+                    ),
+                    past_key_values=self._batch_past,
+                    attention_mask=self._batch_mask,
+                    position_ids=torch.tensor(
+                        [[len(sequence.tokens)] for sequence in sequences],
+                        device=self.device,
+                    ),
+                    use_cache=True,
+                )
+        except Exception as e:
+            # The cache may have been extended for some layers only
+            self._drop_batch()
+            for sequence in sequences:
+                sequence.results.put(e)
+                self._finish(sequence)
+            self._active = []
+            return
+        DECODE_STEP_SECONDS.labels(*self.labels).observe(time.perf_counter() - start)
+        self._record_batch(sequences, FORWARD, start)
+
+        # Models that still return legacy tuples get them wrapped again
+        self._batch_past = self._as_cache(outputs.past_key_values)
+        for row, sequence in enumerate(sequences):
+            sequence.tokens += sequence.pending
+            sequence.logits = outputs.logits[row : row + 1, -1, :]
@@ -0,0 +1,69 @@
+import os
+import threading
+from typing import List, Optional
+
+import psutil
+from pydantic import BaseModel
+
+from actuosus_ai.common.actuosus_exception import CancelledException
+
+
+class LoadProgress(BaseModel):
+    stage: str = "waiting"
+    files_read: int = 0
+    files_total: int = 0
+    bytes_read: int = 0
+    bytes_total: int = 0
+    layers_total: int = 0
+
+
+class LoadProgressTracker:
+    """
+    Progress of a model load running on a worker thread, read from the event loop.
+
+    Setting cancel_event makes the load stop at its next checkpoint with a
+    CancelledException.
+    """
+
+    CHUNK_SIZE = 8 * 1024**2
+
+    def __init__(self, cancel_event: Optional[threading.Event] = None):
+        self.cancel_event = cancel_event or threading.Event()
+        self._progress = LoadProgress()
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> LoadProgress:
+        with self._lock:
+            return self._progress.model_copy()
+
+    def update(self, **changes: object) -> None:
+        with self._lock:
+            self._progress = self._progress.model_copy(update=changes)
+
+    def check_cancelled(self) -> None:
+        if self.cancel_event.is_set():
+            raise CancelledException("Model loading was cancelled")
+
+    def read_files(self, paths: List[str], read_ahead: bool = True) -> None:
+        """
+        Read the weight files into the page cache so that mapping them is fast.
+
+        This is a full extra pass over the files: the load reads them again, from
+        memory when they stayed cached. It is skipped when they do not fit in the
+        available memory or read_ahead is False, leaving only the totals reported.
+        """
+        self.check_cancelled()
+        bytes_total = sum(os.path.getsize(path) for path in paths)
+        self.update(stage="reading", files_total=len(paths), bytes_total=bytes_total)
+        if not read_ahead or bytes_total > psutil.virtual_memory().available:
+            return
+
+        buffer = bytearray(self.CHUNK_SIZE)
+        bytes_read = 0
+        for files_read, path in enumerate(paths, start=1):
+            with open(path, "rb", buffering=0) as file:
+                while size := file.readinto(buffer):
+                    bytes_read += size
+                    self.update(bytes_read=bytes_read)
+                    self.check_cancelled()
+            self.update(files_read=files_read)
@@ -0,0 +1,294 @@
+import functools
+import json
+import os
+import struct
+from typing import IO, Any, Dict, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel
+
+from actuosus_ai.ai_interaction.model_memory import ModelMemory
+
+# Quantizations TextGenerationService loads HF models with, None is float32
+HF_QUANTIZATIONS: Tuple[Optional[str], ...] = (
+    None,
+    "float16",
+    "bfloat16",
+    "int8",
+    "int4",
+)
+# Without a GPU, the others are loaded as bfloat16
+CPU_HF_QUANTIZATIONS: Tuple[Optional[str], ...] = (None, "bfloat16")
+
+# Bytes per parameter of the weights bitsandbytes quantizes and of the others
+_HF_PARAMETER_BYTES: Dict[Optional[str], Tuple[float, float]] = {
+    None: (4.0, 4.0),
+    "float16": (2.0, 2.0),
+    "bfloat16": (2.0, 2.0),
+    "int8": (1.0, 2.0),
+    # 4 bit weights with a float32 absmax per block of 64
+    "int4": (0.5 + 4 / 64, 2.0),
+}
+# Embeddings and the output layer are not quantized
+_UNQUANTIZED_NAMES = ("embed", "wte", "wpe", "lm_head")
+
+_GGUF_MAGIC = b"GGUF"
+_GGUF_STRING = 8
+_GGUF_ARRAY = 9
+_GGUF_SCALARS = {
+    0: "B",
+    1: "b",
+    2: "H",
+    3: "h",
+    4: "I",
+    5: "i",
+    6: "f",
+    7: "?",
+    10: "Q",
+    11: "q",
+    12: "d",
+}
+# Logits rows llama_cpp.Llama keeps, its default n_batch
+_LLAMA_BATCH = 512
+
+
+class MemoryEstimate(BaseModel):
+    quantization: Optional[str]
+    gguf_file_name: Optional[str] = None
+    memory: ModelMemory
+
+
+class _SafetensorsSummary(NamedTuple):
+    quantizable_parameters: int
+    other_parameters: int
+
+
+class _GGUFSummary(NamedTuple):
+    weight_bytes: int
+    context_length: int
+    block_count: int
+    key_width: int
+    value_width: int
+    vocab_size: int
+
+
+def _read(file: IO[bytes], fmt: str) -> Any:
+    size = struct.calcsize("<" + fmt)
+    data = file.read(size)
+    if len(data) < size:
+        raise ValueError("The header is truncated")
+    return struct.unpack("<" + fmt, data)[0]
+
+
+def _read_gguf_value(file: IO[bytes], value_type: int) -> Any:
+    """Read a metadata value, string arrays like the vocabulary become their length"""
+    if value_type == _GGUF_STRING:
+        return file.read(_read(file, "Q")).decode("utf-8", "replace")
+    if value_type == _GGUF_ARRAY:
+        item_type = _read(file, "I")
+        count = _read(file, "Q")
+        if item_type == _GGUF_STRING:
+            for _ in range(count):
+                file.seek(_read(file, "Q"), os.SEEK_CUR)
+            return count
+        if item_type == _GGUF_ARRAY:
+            return [_read_gguf_value(file, item_type) for _ in range(count)]
+        fmt = _GGUF_SCALARS[item_type]
+        data = file.read(struct.calcsize(fmt) * count)
+        return list(struct.unpack(f"<{count}{fmt}", data))
+    if value_type not in _GGUF_SCALARS:
+        raise ValueError(f"Unknown GGUF value type {value_type}")
+    return _read(file, _GGUF_SCALARS[value_type])
+
+
+@functools.lru_cache(maxsize=256)
+def _gguf_summary(path: str, mtime_ns: int, size: int) -> _GGUFSummary:
+    """Read the metadata and tensor infos of a GGUF file, not its tensors"""
+    with open(path, "rb") as file:
+        if file.read(4) != _GGUF_MAGIC:
+            raise ValueError(f"{path} is not a GGUF file")
+        if _read(file, "I") < 2:
+            raise ValueError(f"{path} has an unsupported GGUF version")
+        tensor_count = _read(file, "Q")
+        metadata = {}
+        for _ in range(_read(file, "Q")):
+            key = _read_gguf_value(file, _GGUF_STRING)
+            metadata[key] = _read_gguf_value(file, _read(file, "I"))
+        for _ in range(tensor_count):
+            file.seek(_read(file, "Q"), os.SEEK_CUR)
+            file.seek(8 * _read(file, "I") + 4 + 8, os.SEEK_CUR)
+        alignment = int(metadata.get("general.alignment", 32))
+        data_start = -(-file.tell() // alignment) * alignment
+
+    def value(name: str, default: int = 0) -> int:
+        found = metadata.get(f"{architecture}.{name}", default)
+        # Some architectures give a value per layer
+        return max(found) if isinstance(found, list) else int(found)
+
+    architecture = metadata.get("general.architecture", "")
+    head_count = value("attention.head_count", 1) or 1
+    head_count_kv = value("attention.head_count_kv", head_count)
+    head_size = value("embedding_length") // head_count
+    return _GGUFSummary(
+        weight_bytes=size - data_start,
+        context_length=value("context_length"),
+        block_count=value("block_count"),
+        key_width=head_count_kv * value("attention.key_length", head_size),
+        value_width=head_count_kv * value("attention.value_length", head_size),
+        vocab_size=int(metadata.get("tokenizer.ggml.tokens", 0)),
+    )
+
+
+def _gguf_memory(path: str, gpu: bool) -> ModelMemory:
+    stat = os.stat(path)
+    summary = _gguf_summary(path, stat.st_mtime_ns, stat.st_size)
+    # Models are loaded with their whole trained context, with a float16 KV cache
+    n_ctx = summary.context_length
+    kv_cache = (
+        n_ctx * summary.block_count * (summary.key_width + summary.value_width) * 2
+    )
+    host_buffers = _LLAMA_BATCH * summary.vocab_size * 4 + n_ctx * 4
+    # Every layer is offloaded when llama.cpp can use the GPU
+    device_bytes = summary.weight_bytes + kv_cache
+    return ModelMemory(
+        parameter_bytes=summary.weight_bytes,
+        context_bytes=kv_cache + host_buffers,
+        ram_bytes=host_buffers + (0 if gpu else device_bytes),
+        vram_bytes=device_bytes if gpu else 0,
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _safetensors_summary(path: str, mtime_ns: int, size: int) -> _SafetensorsSummary:
+    """Count the parameters listed in a safetensors header, without reading them"""
+    with open(path, "rb") as file:
+        header = json.loads(file.read(_read(file, "Q")))
+    header.pop("__metadata__", None)
+    quantizable = other = 0
+    for name, info in header.items():
+        count = 1
+        for dimension in info["shape"]:
+            count *= dimension
+        is_linear = len(info["shape"]) == 2 and name.endswith(".weight")
+        if is_linear and not any(part in name for part in _UNQUANTIZED_NAMES):
+            quantizable += count
+        else:
+            other += count
+    return _SafetensorsSummary(quantizable, other)
+
+
+def _hf_config(storage_path: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(storage_path, "config.json")) as file:
+            config = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return config if isinstance(config, dict) else {}
+
+
+def _config_value(config: Dict[str, Any], *names: str) -> Optional[int]:
+    for name in names:
+        if isinstance(config.get(name), int):
+            return int(config[name])
+    return None
+
+
+def _hf_kv_cache_bytes(
+    config: Dict[str, Any], element_bytes: float, context_tokens: Optional[int]
+) -> int:
+    """KV cache of one sequence of context_tokens, the whole context when not given"""
+    layers = _config_value(config, "num_hidden_layers", "n_layer", "num_layers") or 0
+    heads = _config_value(config, "num_attention_heads", "n_head") or 1
+    hidden = _config_value(config, "hidden_size", "n_embd", "d_model") or 0
+    kv_heads = _config_value(config, "num_key_value_heads") or heads
+    head_size = _config_value(config, "head_dim") or hidden // heads
+    max_tokens = _config_value(
+        config, "max_position_embeddings", "n_positions", "n_ctx"
+    )
+    tokens = min(filter(None, (context_tokens, max_tokens)), default=0)
+    return int(2 * tokens * layers * kv_heads * head_size * element_bytes)
+
+
+def _hf_memory(
+    storage_path: str,
+    safetensors: List[str],
+    quantization: Optional[str],
+    gpu: bool,
+    context_tokens: Optional[int],
+) -> ModelMemory:
+    quantized_bytes, other_bytes = _HF_PARAMETER_BYTES.get(
+        quantization, _HF_PARAMETER_BYTES[None]
+    )
+    weights = 0
+    for path in safetensors:
+        stat = os.stat(path)
+        summary = _safetensors_summary(path, stat.st_mtime_ns, stat.st_size)
+        weights += int(
+            summary.quantizable_parameters * quantized_bytes
+            + summary.other_parameters * other_bytes
+        )
+    kv_cache = _hf_kv_cache_bytes(_hf_config(storage_path), other_bytes, context_tokens)
+    # device_map="auto" puts the whole model on the GPU when there is one
+    return ModelMemory(
+        parameter_bytes=weights,
+        context_bytes=kv_cache,
+        ram_bytes=0 if gpu else weights + kv_cache,
+        vram_bytes=weights + kv_cache if gpu else 0,
+    )
+
+
+def _model_files(storage_path: str, extension: str) -> List[str]:
+    return sorted(
+        os.path.join(storage_path, name)
+        for name in os.listdir(storage_path)
+        if name.endswith(extension)
+    )
+
+
+def estimate_memory(
+    storage_path: str,
+    quantization: Optional[str],
+    gguf_file_name: Optional[str],
+    gpu: bool,
+    context_tokens: Optional[int] = None,
+) -> Optional[ModelMemory]:
+    """
+    Predict the memory a model takes once loaded, from the headers of its weight
+    files. None when it cannot be told, like for models without safetensors.
+    """
+    try:
+        if quantization == "gguf":
+            if not gguf_file_name:
+                return None
+            return _gguf_memory(os.path.join(storage_path, gguf_file_name), gpu)
+        safetensors = _model_files(storage_path, ".safetensors")
+        if not safetensors:
+            return None
+        return _hf_memory(storage_path, safetensors, quantization, gpu, context_tokens)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+
+def estimate_model_memory(
+    storage_path: str, gpu: bool, context_tokens: Optional[int] = None
+) -> List[MemoryEstimate]:
+    """Predict the memory of every way a model can be loaded"""
+    try:
+        gguf_file_names = [
+            os.path.basename(path) for path in _model_files(storage_path, ".gguf")
+        ]
+    except OSError:
+        return []
+    estimates = []
+    for gguf_file_name in gguf_file_names:
+        memory = estimate_memory(storage_path, "gguf", gguf_file_name, gpu)
+        if memory:
+            estimates.append(
+                MemoryEstimate(
+                    quantization="gguf", gguf_file_name=gguf_file_name, memory=memory
+                )
+            )
+    for quantization in HF_QUANTIZATIONS if gpu else CPU_HF_QUANTIZATIONS:
+        memory = estimate_memory(storage_path, quantization, None, gpu, context_tokens)
+        if memory:
+            estimates.append(MemoryEstimate(quantization=quantization, memory=memory))
+    return estimates
@@ -0,0 +1,116 @@
+from typing import Any
+
+import psutil
+from pydantic import BaseModel
+
+from actuosus_ai.common.utils import process_vram_bytes
+
+# Bytes per element of the llama.cpp KV cache types, by ggml type id
+_GGML_TYPE_BYTES = {
+    0: 4.0,  # F32
+    1: 2.0,  # F16
+    2: 18 / 32,  # Q4_0
+    3: 20 / 32,  # Q4_1
+    6: 22 / 32,  # Q5_0
+    7: 24 / 32,  # Q5_1
+    8: 34 / 32,  # Q8_0
+    30: 2.0,  # BF16
+}
+
+
+class ModelMemory(BaseModel):
+    """Bytes held by one loaded model"""
+
+    parameter_bytes: int = 0
+    buffer_bytes: int = 0
+    # llama.cpp KV cache for the whole context and the logits kept by the wrapper
+    context_bytes: int = 0
+    ram_bytes: int = 0
+    vram_bytes: int = 0
+    # Growth of the process' resident memory over the load, for comparison only
+    # since concurrent loads in the same process show up in it too
+    load_rss_delta_bytes: int = 0
+
+    @property
+    def ram_gb(self) -> float:
+        return self.ram_bytes / 1024**3
+
+    @property
+    def vram_gb(self) -> float:
+        return self.vram_bytes / 1024**3
+
+
+class ProcessMemory(BaseModel):
+    rss_bytes: int
+    # Proportional set size, shared pages split between the processes mapping
+    # them, the resident size where it is not available
+    pss_bytes: int
+    vram_bytes: int
+
+
+def hf_model_memory(model: Any) -> ModelMemory:
+    """Parameter and buffer bytes of a transformers model, by the device holding them"""
+    memory = ModelMemory()
+    for tensors, is_parameter in ((model.parameters(), True), (model.buffers(), False)):
+        for tensor in tensors:
+            # Weights offloaded to disk are left on the meta device
+            if tensor.device.type == "meta":
+                continue
+            size = tensor.numel() * tensor.element_size()
+            if is_parameter:
+                memory.parameter_bytes += size
+            else:
+                memory.buffer_bytes += size
+            if tensor.device.type == "cpu":
+                memory.ram_bytes += size
+            else:
+                memory.vram_bytes += size
+    return memory
+
+
+def llama_model_memory(model: Any) -> ModelMemory:
+    """Weight and context bytes of a llama_cpp.Llama, split by its offloaded layers"""
+    import llama_cpp
+
+    llama_model = model._model.model
+    weights = llama_cpp.llama_model_size(llama_model)
+    n_layer = llama_cpp.llama_model_n_layer(llama_model)
+    n_head = llama_cpp.llama_model_n_head(llama_model)
+    n_head_kv = llama_cpp.llama_model_n_head_kv(llama_model)
+    n_embd_kv = llama_cpp.llama_model_n_embd(llama_model) * n_head_kv // max(n_head, 1)
+    params = model.context_params
+    kv_cache = int(
+        model.n_ctx()
+        * n_layer
+        * n_embd_kv
+        * (
+            _GGML_TYPE_BYTES.get(params.type_k, 2.0)
+            + _GGML_TYPE_BYTES.get(params.type_v, 2.0)
+        )
+    )
+
+    offloaded = 0.0
+    if llama_cpp.llama_supports_gpu_offload() and n_layer:
+        offloaded = min(max(model.model_params.n_gpu_layers, 0), n_layer) / n_layer
+    kv_offloaded = offloaded if params.offload_kqv else 0.0
+    # Logits and tokens the Python wrapper keeps for the context
+    host_buffers = model.scores.nbytes + model.input_ids.nbytes
+    return ModelMemory(
+        parameter_bytes=weights,
+        context_bytes=kv_cache + host_buffers,
+        ram_bytes=int(weights * (1 - offloaded) + kv_cache * (1 - kv_offloaded))
+        + host_buffers,
+        vram_bytes=int(weights * offloaded + kv_cache * kv_offloaded),
+    )
+
+
+def process_memory() -> ProcessMemory:
+    """Resident and proportional memory of this process, with its VRAM on every GPU"""
+    process = psutil.Process()
+    try:
+        info = process.memory_full_info()
+        rss = info.rss
+        pss = getattr(info, "pss", rss)
+    except psutil.AccessDenied:
+        rss = pss = process.memory_info().rss
+    return ProcessMemory(rss_bytes=rss, pss_bytes=pss, vram_bytes=process_vram_bytes())
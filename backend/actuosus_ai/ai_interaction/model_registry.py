@@ -0,0 +1,316 @@
+import gc
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from actuosus_ai.ai_interaction.model_memory import ModelMemory
+from actuosus_ai.ai_interaction.model_state_cache import StateCacheBudget
+from actuosus_ai.common.actuosus_exception import (
+    CancelledException,
+    InsufficientMemoryException,
+)
+from actuosus_ai.common.settings import get_settings
+
+if TYPE_CHECKING:
+    from actuosus_ai.ai_interaction.inference_scheduler import InferenceScheduler
+
+ModelKey = Tuple[int, Optional[str], Optional[str]]
+
+
+class LoadedModel(BaseModel):
+    ai_model_id: int
+    quantization: Optional[str]
+    gguf_file_name: Optional[str]
+    users: int
+    active_sequences: int
+    estimated_ram: float
+    estimated_vram: float
+    memory: ModelMemory
+    last_used: float
+
+
+class _RegistryEntry:
+    def __init__(self, scheduler: "InferenceScheduler"):
+        self.scheduler = scheduler
+        self.users = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """
+    Share loaded models between sessions, keyed by (ai_model_id, quantization,
+    gguf_file_name).
+
+    Sessions asking for a model that is being loaded wait for that load. A model
+    stays loaded after its last session leaves so a reconnect or another
+    tab does not pay the load again. Idle models are evicted least recently used
+    first whenever the RAM or VRAM held by the loaded models' weights and contexts
+    goes over the budget (in GB), models in use are never evicted. The model states
+    cached by the sessions count against the budget too and are dropped first.
+    Loads estimated to go over the budget are queued until enough memory is freed,
+    and rejected when that never happens.
+    """
+
+    def __init__(
+        self,
+        ram_budget_gb: Optional[float] = None,
+        vram_budget_gb: Optional[float] = None,
+        admission_timeout: float = 300.0,
+        state_cache_bytes: int = 512 * 1024**2,
+    ):
+        self.ram_budget_gb = ram_budget_gb
+        self.vram_budget_gb = vram_budget_gb
+        self.admission_timeout = admission_timeout
+        # Shared by the model state caches of every session
+        self.state_budget = StateCacheBudget(state_cache_bytes)
+        self._entries: OrderedDict[ModelKey, _RegistryEntry] = OrderedDict()
+        self._loading: Dict[ModelKey, Future[None]] = {}
+        # Estimated memory of the models being loaded
+        self._reserved: Dict[ModelKey, ModelMemory] = {}
+        self._lock = threading.Lock()
+        # Notified whenever a model is released, evicted or done loading
+        self._memory_freed = threading.Condition(self._lock)
+
+    def acquire(
+        self,
+        key: ModelKey,
+        load: Callable[[], "InferenceScheduler"],
+        cancel_event: Optional[threading.Event] = None,
+        estimate: Optional[ModelMemory] = None,
+        on_queued: Optional[Callable[[], None]] = None,
+    ) -> "InferenceScheduler":
+        """
+        Return the scheduler of a loaded model, loading it on first use.
+
+        A load with an estimate only starts once it fits the budgets next to the
+        loaded and loading models, idle models are evicted to make room for it.
+        Until then it waits for models in use to be released, on_queued is called
+        when it starts waiting.
+        """
+        reserved = estimate or ModelMemory()
+        needed = f"Loading the model needs about {self._describe(reserved)}"
+        deadline = time.monotonic() + self.admission_timeout
+        queued = False
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry:
+                    return self._use(key, entry)
+                loading = self._loading.get(key)
+                if loading is None:
+                    if self._exceeds_budget(reserved.ram_bytes, reserved.vram_bytes):
+                        raise InsufficientMemoryException(
+                            f"{needed}, more than the memory budget"
+                        )
+                    evicted = self._make_room(reserved)
+                    if evicted is not None:
+                        loading = self._loading[key] = Future()
+                        self._reserved[key] = reserved
+                        break
+
+            if loading is None:
+                # Wait for memory to be freed by the models in use
+                if cancel_event and cancel_event.is_set():
+                    raise CancelledException("Model loading was cancelled")
+                if time.monotonic() > deadline:
+                    raise InsufficientMemoryException(
+                        f"{needed}, the models in use did not free enough in time"
+                    )
+                if not queued and on_queued:
+                    on_queued()
+                queued = True
+                with self._lock:
+                    self._memory_freed.wait(timeout=0.1)
+                continue
+
+            # Another session is loading the same model, wait for it and retry
+            while not loading.done():
+                if cancel_event and cancel_event.is_set():
+                    raise CancelledException("Model loading was cancelled")
+                wait([loading], timeout=0.1)
+
+        self._close(evicted)
+        try:
+            loaded = load()
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+                del self._reserved[key]
+                self._memory_freed.notify_all()
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            del self._reserved[key]
+            entry = self._entries[key] = _RegistryEntry(loaded)
+            scheduler = self._use(key, entry)
+            evicted = self._evict_over_budget()
+            self._memory_freed.notify_all()
+        loading.set_result(None)
+        self._close(evicted)
+        return scheduler
+
+    def release(self, key: ModelKey) -> None:
+        """Drop a session's hold on a model, it stays loaded until evicted"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return
+            entry.users = max(entry.users - 1, 0)
+            entry.last_used = time.time()
+            evicted = self._evict_over_budget()
+            self._memory_freed.notify_all()
+        self._close(evicted)
+
+    def evict(self, key: ModelKey) -> bool:
+        """Unload an idle model, returns False when it is in use or not loaded"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry or entry.users > 0:
+                return False
+            del self._entries[key]
+            self._memory_freed.notify_all()
+        self._close([entry.scheduler])
+        return True
+
+    def loaded_models(self) -> List[LoadedModel]:
+        """Describe the loaded models, least recently used first"""
+        with self._lock:
+            return [
+                LoadedModel(
+                    ai_model_id=key[0],
+                    quantization=key[1],
+                    gguf_file_name=key[2],
+                    users=entry.users,
+                    active_sequences=entry.scheduler.active_sequences,
+                    estimated_ram=entry.scheduler.estimated_ram,
+                    estimated_vram=entry.scheduler.estimated_vram,
+                    memory=entry.scheduler.memory,
+                    last_used=entry.last_used,
+                )
+                for key, entry in self._entries.items()
+            ]
+
+    def clear(self) -> None:
+        """Unload every model"""
+        with self._lock:
+            schedulers = [entry.scheduler for entry in self._entries.values()]
+            self._entries.clear()
+            self._memory_freed.notify_all()
+        self._close(schedulers)
+
+    def _use(self, key: ModelKey, entry: _RegistryEntry) -> "InferenceScheduler":
+        entry.users += 1
+        entry.last_used = time.time()
+        # Mark as recently used
+        self._entries.move_to_end(key)
+        return entry.scheduler
+
+    def _used(self) -> Tuple[int, int]:
+        """
+        RAM and VRAM bytes of the loaded models, the loads in progress and the
+        cached model states
+        """
+        memories = [entry.scheduler.memory for entry in self._entries.values()]
+        memories += self._reserved.values()
+        states_ram, states_vram = self._state_bytes()
+        return (
+            sum(memory.ram_bytes for memory in memories) + states_ram,
+            sum(memory.vram_bytes for memory in memories) + states_vram,
+        )
+
+    def _exceeds_budget(self, ram: int, vram: int) -> bool:
+        return (
+            self.ram_budget_gb is not None and ram > self.ram_budget_gb * 1024**3
+        ) or (self.vram_budget_gb is not None and vram > self.vram_budget_gb * 1024**3)
+
+    def _over_budget(self) -> bool:
+        return self._exceeds_budget(*self._used())
+
+    def _make_room(self, memory: ModelMemory) -> Optional[List["InferenceScheduler"]]:
+        """Evict idle models until a load fits, None when it cannot fit yet"""
+        ram, vram = self._used()
+        ram += memory.ram_bytes
+        vram += memory.vram_bytes
+        idle = [(key, entry) for key, entry in self._entries.items() if not entry.users]
+        idle_ram = sum(entry.scheduler.memory.ram_bytes for _, entry in idle)
+        idle_vram = sum(entry.scheduler.memory.vram_bytes for _, entry in idle)
+        states_ram, states_vram = self._state_bytes()
+        if self._exceeds_budget(
+            ram - idle_ram - states_ram, vram - idle_vram - states_vram
+        ):
+            return None
+        # Cached states are cheaper to recompute than a model is to reload
+        self.state_budget.evict_while(lambda: not self._fits(memory))
+        ram, vram = self._used()
+        ram += memory.ram_bytes
+        vram += memory.vram_bytes
+        evicted = []
+        for key, entry in idle:
+            if not self._exceeds_budget(ram, vram):
+                break
+            del self._entries[key]
+            evicted.append(entry.scheduler)
+            ram -= entry.scheduler.memory.ram_bytes
+            vram -= entry.scheduler.memory.vram_bytes
+        return evicted
+
+    @staticmethod
+    def _describe(memory: ModelMemory) -> str:
+        return f"{memory.ram_gb:.2f} GB of RAM and {memory.vram_gb:.2f} GB of VRAM"
+
+    def _fits(self, memory: ModelMemory) -> bool:
+        ram, vram = self._used()
+        return not self._exceeds_budget(
+            ram + memory.ram_bytes, vram + memory.vram_bytes
+        )
+
+    def _state_bytes(self) -> Tuple[int, int]:
+        with self.state_budget.lock:
+            return self.state_budget.ram_bytes, self.state_budget.vram_bytes
+
+    def _evict_over_budget(self) -> List["InferenceScheduler"]:
+        self.state_budget.evict_while(self._over_budget)
+        evicted = []
+        for key in list(self._entries):
+            if not self._over_budget():
+                break
+            entry = self._entries[key]
+            if entry.users == 0:
+                del self._entries[key]
+                evicted.append(entry.scheduler)
+        return evicted
+
+    @staticmethod
+    def _close(schedulers: List["InferenceScheduler"]) -> None:
+        if not schedulers:
+            return
+        import torch
+
+        for scheduler in schedulers:
+            scheduler.close()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+_model_registry: Optional[ModelRegistry] = None
+_model_registry_lock = threading.Lock()
+
+
+def get_model_registry() -> ModelRegistry:
+    global _model_registry
+    with _model_registry_lock:
+        if _model_registry is None:
+            settings = get_settings()
+            _model_registry = ModelRegistry(
+                settings.model_registry_ram_budget_gb,
+                settings.model_registry_vram_budget_gb,
+                settings.model_admission_timeout,
+                settings.model_state_cache_mb * 1024**2,
+            )
+        return _model_registry
@@ -0,0 +1,155 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Sequence, Tuple
+
+
+class StateCacheBudget:
+    """
+    Memory budget shared by the state caches of every session. Storing a state over
+    the budget evicts the least recently used states of any cache.
+    """
+
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self.ram_bytes = 0
+        self.vram_bytes = 0
+        # Caches are used from the event loop and the inference worker threads
+        self.lock = threading.RLock()
+        # The states of every cache, least recently used first
+        self._order: OrderedDict[Tuple[int, Tuple[int, ...]], "ModelStateCache"] = (
+            OrderedDict()
+        )
+
+    @property
+    def used_bytes(self) -> int:
+        return self.ram_bytes + self.vram_bytes
+
+    def evict_while(self, condition: Callable[[], bool]) -> None:
+        """Drop the least recently used states until the condition is false"""
+        with self.lock:
+            while self._order and condition():
+                (_, key), cache = next(iter(self._order.items()))
+                cache._remove(key)
+
+
+class ModelStateCache:
+    """
+    Keep model states (HF past_key_values or llama.cpp sequence state) keyed by
+    the token sequence that produced them, bounded by a memory budget.
+
+    Every generated message path in the MessageTrie ends with a checkpoint here,
+    so a branch off any word of that path only needs to prefill the tokens after
+    the divergence point. Sessions share their budget through a StateCacheBudget.
+    """
+
+    def __init__(
+        self,
+        budget_bytes: Optional[int] = None,
+        budget: Optional[StateCacheBudget] = None,
+    ):
+        if budget is None:
+            budget = StateCacheBudget(budget_bytes or 0)
+        self.budget = budget
+        self.used_bytes = 0
+        self._entries: OrderedDict[Tuple[int, ...], Tuple[Any, int, bool]] = (
+            OrderedDict()
+        )
+
+    @property
+    def budget_bytes(self) -> int:
+        return self.budget.budget_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+        length = 0
+        for x, y in zip(a, b):
+            if x != y:
+                break
+            length += 1
+        return length
+
+    def longest_prefix(
+        self, tokens: Sequence[int]
+    ) -> Tuple[int, Optional[Any], Tuple[int, ...]]:
+        """Return the prefix length shared with the best stored state, the state and its key"""
+        with self.budget.lock:
+            best_length, best_key = 0, None
+            for key in self._entries:
+                length = self.common_prefix_length(key, tokens)
+                if length > best_length:
+                    best_length, best_key = length, key
+            if best_key is None:
+                return 0, None, ()
+            # Mark as recently used
+            self._entries.move_to_end(best_key)
+            self.budget._order.move_to_end((id(self), best_key))
+            return best_length, self._entries[best_key][0], best_key
+
+    def put(
+        self, tokens: Sequence[int], state: Any, size: int, on_gpu: bool = False
+    ) -> None:
+        """Store a state, evicting least recently used ones to stay under budget"""
+        if size > self.budget_bytes or not tokens:
+            return
+        key = tuple(tokens)
+        budget = self.budget
+        with budget.lock:
+            for existing in list(self._entries):
+                # A longer stored sequence already covers this one
+                if len(existing) > len(key) and existing[: len(key)] == key:
+                    self._entries.move_to_end(existing)
+                    budget._order.move_to_end((id(self), existing))
+                    return
+                # States for prefixes of this sequence are covered by the new one
+                if key[: len(existing)] == existing:
+                    self._remove(existing)
+            self._entries[key] = (state, size, on_gpu)
+            budget._order[(id(self), key)] = self
+            self.used_bytes += size
+            if on_gpu:
+                budget.vram_bytes += size
+            else:
+                budget.ram_bytes += size
+            budget.evict_while(lambda: budget.used_bytes > budget.budget_bytes)
+
+    def _remove(self, key: Tuple[int, ...]) -> None:
+        _, size, on_gpu = self._entries.pop(key)
+        del self.budget._order[(id(self), key)]
+        self.used_bytes -= size
+        if on_gpu:
+            self.budget.vram_bytes -= size
+        else:
+            self.budget.ram_bytes -= size
+
+    def restore_hf_past(self, tokens: Sequence[int]) -> Tuple[int, Any]:
+        """Return the legacy past_key_values of the longest cached prefix of the tokens"""
+        length, state, _ = self.longest_prefix(tokens)
+        # At least one token has to be fed to get the next token logits
+        length = min(length, len(tokens) - 1)
+        if state is None or length <= 0:
+            return 0, None
+        # Slicing makes views, the stored tensors are never written to
+        return length, tuple(
+            tuple(tensor[..., :length, :] for tensor in layer) for layer in state
+        )
+
+    def save_hf_past(self, tokens: Sequence[int], past_key_values: Any) -> None:
+        """Checkpoint legacy past_key_values for the tokens they were computed from"""
+        if not isinstance(past_key_values, tuple) or not past_key_values:
+            return
+        size = sum(
+            tensor.numel() * tensor.element_size()
+            for layer in past_key_values
+            for tensor in layer
+        )
+        on_gpu = past_key_values[0][0].device.type != "cpu"
+        self.put(tokens, past_key_values, size, on_gpu)
+
+    def clear(self) -> None:
+        """Drop every stored state"""
+        with self.budget.lock:
+            for key in list(self._entries):
+                self._remove(key)
@@ -0,0 +1,132 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from types import TracebackType
+from typing import Any, ContextManager, Dict, List, NamedTuple, Optional, Type
+
+from pydantic import BaseModel
+
+# Phases of a generation, in the order they first run
+TOKENIZATION = "tokenization"
+CHAT_TEMPLATE = "chat_template"
+PREFILL = "prefill"
+FORWARD = "forward"
+SAMPLING = "sampling"
+DECODING = "decoding"
+SEND = "send"
+
+# Returned by spans of a disabled recorder, entering it does nothing
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Span(NamedTuple):
+    name: str
+    start: float
+    duration: float
+    thread: str
+
+
+class PhaseTiming(BaseModel):
+    count: int = 0
+    total_ms: float = 0.0
+
+
+class ProfileBreakdown(BaseModel):
+    total_ms: float
+    phases: Dict[str, PhaseTiming]
+    # Name of the Chrome trace file written for the generation, if any
+    trace_file: Optional[str] = None
+
+
+class _ActiveSpan:
+    def __init__(self, recorder: "SpanRecorder", name: str):
+        self.recorder = recorder
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self.recorder.add(self.name, self.start, time.perf_counter())
+
+
+class SpanRecorder:
+    """
+    Record how long each phase of a generation takes, from any thread.
+
+    A disabled recorder keeps nothing and its spans are a shared no-op, so the hot
+    loops can always wrap their phases in one.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.spans: List[Span] = []
+
+    def span(self, name: str) -> ContextManager[None]:
+        if not self.enabled:
+            return _NO_SPAN
+        return _ActiveSpan(self, name)
+
+    def add(self, name: str, start: float, end: float) -> None:
+        """Record a span timed by the caller with time.perf_counter()"""
+        if self.enabled:
+            # list.append is atomic, spans come from the loop and worker threads
+            self.spans.append(
+                Span(name, start, end - start, threading.current_thread().name)
+            )
+
+    def breakdown(self, total_seconds: float) -> ProfileBreakdown:
+        """Count and total time of every phase"""
+        phases: Dict[str, PhaseTiming] = {}
+        for span in list(self.spans):
+            timing = phases.setdefault(span.name, PhaseTiming())
+            timing.count += 1
+            timing.total_ms += span.duration * 1000
+        return ProfileBreakdown(total_ms=total_seconds * 1000, phases=phases)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """The spans in the Chrome trace event format, viewable in Perfetto"""
+        pid = os.getpid()
+        thread_ids: Dict[str, int] = {}
+        events: List[Dict[str, Any]] = []
+        for span in list(self.spans):
+            if span.thread not in thread_ids:
+                thread_ids[span.thread] = len(thread_ids) + 1
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": thread_ids[span.thread],
+                        "args": {"name": span.thread},
+                    }
+                )
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": (span.start - self.origin) * 1e6,
+                    "dur": span.duration * 1e6,
+                    "pid": pid,
+                    "tid": thread_ids[span.thread],
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump_chrome_trace(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+
+# Used whenever profiling is off
+DISABLED_RECORDER = SpanRecorder(enabled=False)
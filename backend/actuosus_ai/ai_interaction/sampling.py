@@ -0,0 +1,83 @@
+import math
+from typing import Any, List, Sequence, Union
+
+import torch
+from torch import Tensor
+
+from actuosus_ai.ai_interaction.detokenizer import TokenProbList
+from actuosus_ai.common.actuosus_exception import InternalException
+
+MIN_PROB_ERROR_MESSAGE = "All probabilities are below the minimum threshold 0.01%, please reduce the temperature"
+
+
+def _per_row(value: Union[float, Sequence[float]], logits: Tensor) -> Any:
+    if isinstance(value, (int, float)):
+        return value
+    return torch.tensor(value, device=logits.device).unsqueeze(-1)
+
+
+def sample_top_k(
+    logits: Tensor,
+    k: int,
+    temperature: Union[float, Sequence[float]] = 1.0,
+    min_prob: Union[float, Sequence[float]] = 0.0,
+) -> List[TokenProbList]:
+    """
+    Sample k distinct tokens for every row of a [batch, vocab] logits tensor.
+
+    The first token of each row is the sampled next token, the alternatives follow
+    sorted by probability. Tokens at or below min_prob are never picked, a row is
+    empty when no token is above it. temperature and min_prob may be given per
+    row. Everything runs on the logits' device and the results are copied to the
+    host in one transfer.
+    """
+    vocab_size = logits.shape[-1]
+    probabilities = torch.softmax(
+        logits.float() / _per_row(temperature, logits), dim=-1
+    )
+
+    # Fewer than 1 / min_prob tokens can be above min_prob, so only the most
+    # likely ones are candidates and the random draw runs over those
+    smallest_min_prob = (
+        min_prob if isinstance(min_prob, (int, float)) else min(min_prob)
+    )
+    candidates = vocab_size
+    if smallest_min_prob > 0:
+        candidates = min(vocab_size, max(k, math.ceil(1 / smallest_min_prob)))
+    candidate_ids = None
+    if candidates < vocab_size:
+        probabilities, candidate_ids = torch.topk(probabilities, candidates, dim=-1)
+    probabilities = probabilities.masked_fill(
+        probabilities <= _per_row(min_prob, logits), 0.0
+    )
+
+    # Exponential race: the top k of p / Exp(1) is a sample without replacement
+    # in draw order, so the largest key is the sampled token
+    keys = probabilities / torch.empty_like(probabilities).exponential_()
+    _, order = torch.topk(keys, min(k, candidates), dim=-1)
+    selected = probabilities.gather(-1, order)
+    samples = order if candidate_ids is None else candidate_ids.gather(-1, order)
+
+    # Leave the first element as is, sort the rest by probability so that the answer is more varied
+    remaining, rest_order = torch.sort(selected[:, 1:], dim=-1, descending=True)
+    samples = torch.cat((samples[:, :1], samples[:, 1:].gather(-1, rest_order)), dim=-1)
+    selected = torch.cat((selected[:, :1], remaining), dim=-1)
+
+    # float64 holds every token id exactly, so one copy brings back ids and probabilities
+    host_samples, host_selected = torch.stack(
+        (samples.double(), selected.double())
+    ).tolist()
+    return [
+        [(int(token), prob) for token, prob in zip(tokens, probs) if prob > 0]
+        for tokens, probs in zip(host_samples, host_selected)
+    ]
+
+
+def sample_top_k_single(
+    logits: Tensor, k: int, temperature: float, min_prob: float
+) -> TokenProbList:
+    """Sample k tokens for a single [1, vocab] row of logits"""
+    top_k_with_prob = sample_top_k(logits, k, temperature, min_prob)[0]
+    if not top_k_with_prob:
+        raise InternalException(MIN_PROB_ERROR_MESSAGE)
+    return top_k_with_prob
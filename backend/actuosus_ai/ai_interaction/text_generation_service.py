@@ -1,34 +1,84 @@
+import asyncio
+import ctypes
+import json
 import os
+import time
 from asyncio import Event
-from typing import Tuple, List, Optional, Any, Generator, Dict
-
-import torch
-from llama_cpp import Llama, llama_get_logits
-from torch import Tensor
-from transformers import AutoModelForCausalLM, AutoTokenizer
-
-try:
-    from transformers import BitsAndBytesConfig
-
-    bitsandbytes_available = True
-except ImportError:
-    BitsAndBytesConfig = None
-    bitsandbytes_available = False
-
-import numpy as np
+from typing import (
+    TYPE_CHECKING,
+    Tuple,
+    List,
+    Optional,
+    Any,
+    Generator,
+    Dict,
+    Iterator,
+)
 
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer
+from actuosus_ai.ai_interaction.inference_metrics import (
+    ACTIVE_SESSIONS,
+    DECODE_STEP_SECONDS,
+    MODEL_LOAD_SECONDS,
+    PREFILL_SECONDS,
+    UNKNOWN_LABELS,
+    MetricLabels,
+    model_labels,
+    timed_tokens,
+)
+from actuosus_ai.ai_interaction.load_progress import LoadProgressTracker
+from actuosus_ai.ai_interaction.memory_estimator import estimate_memory
+from actuosus_ai.ai_interaction.model_memory import (
+    hf_model_memory,
+    llama_model_memory,
+    process_memory,
+)
+from actuosus_ai.ai_interaction.model_registry import (
+    ModelKey,
+    ModelRegistry,
+    get_model_registry,
+)
+from actuosus_ai.ai_interaction.model_state_cache import ModelStateCache
+from actuosus_ai.ai_interaction.profiler import (
+    DECODING,
+    DISABLED_RECORDER,
+    FORWARD,
+    PREFILL,
+    SAMPLING,
+    TOKENIZATION,
+    SpanRecorder,
+)
 from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
-from actuosus_ai.common.actuosus_exception import NotFoundException, ValidationException, InternalException
-from actuosus_ai.common.utils import get_memory_footprint
+from actuosus_ai.common.actuosus_exception import (
+    CancelledException,
+    NotFoundException,
+    ValidationException,
+)
+from actuosus_ai.common.settings import Settings, get_settings
+
+# torch, transformers and llama_cpp take seconds to import, so they are only
+# imported once a model is loaded
+if TYPE_CHECKING:
+    from actuosus_ai.ai_interaction.inference_scheduler import InferenceScheduler
 
 WordProbList = List[Tuple[str, float]]
 
 
 class TextGenerationService:
-    def __init__(self, storage_service: AIModelStorageService):
+    def __init__(
+        self,
+        storage_service: AIModelStorageService,
+        settings: Optional[Settings] = None,
+        model_registry: Optional[ModelRegistry] = None,
+    ):
         self.storage_service = storage_service
+        self.settings = settings or get_settings()
+        self.model_registry = model_registry or get_model_registry()
+        # The budget of the cached states is shared by every session
+        self.state_cache = ModelStateCache(budget=self.model_registry.state_budget)
         self.model: Any = None
         self.tokenizer: Any = None
+        self.detokenizer: Optional[Detokenizer] = None
         self.device = None
         self.ai_model_name = ""
         self.gguf = False
@@ -36,18 +86,26 @@ class TextGenerationService:
         self.estimated_vram = 0.0
         self.max_length = 8192
         self.end_with_eos = False
+        self.scheduler: Optional["InferenceScheduler"] = None
+        self.scheduler_key: Optional[ModelKey] = None
+        self.metric_labels = UNKNOWN_LABELS
+        # Records the phases of the session's generations while profiling is on
+        self.profiler: SpanRecorder = DISABLED_RECORDER
 
     async def load_model(
         self,
         ai_model_id: int,
         quantization: Optional[str] = None,
         gguf_file_name: Optional[str] = None,
+        progress: Optional[LoadProgressTracker] = None,
     ) -> None:
-        initial_ram, initial_vram = get_memory_footprint()
         dto = await self.storage_service.get_model_by_id(ai_model_id)
         if not dto:
             raise NotFoundException(f"Model with id {ai_model_id} not found")
         self.ai_model_name = dto.name
+        self.unload_model()
+
+        import torch
 
         # Without gpu, pytorch only supports bfloat16
         if not torch.cuda.is_available() and quantization in (
@@ -57,94 +115,255 @@ class TextGenerationService:
         ):
             quantization = "bfloat16"
 
+        if quantization == "gguf" and not gguf_file_name:
+            raise ValidationException(
+                "gguf_file_name must be provided when loading a GGUF model"
+            )
+
+        tracker = progress or LoadProgressTracker()
+        labels = model_labels(dto.name, quantization, gguf_file_name)
+        if quantization == "gguf":
+            import llama_cpp
+
+            gpu = bool(llama_cpp.llama_supports_gpu_offload())
+        else:
+            gpu = torch.cuda.is_available()
+        # Loads that would go over the memory budget are queued or rejected
+        estimate = await asyncio.to_thread(
+            estimate_memory,
+            dto.storage_path,
+            quantization,
+            gguf_file_name,
+            gpu,
+            self.settings.kv_cache_estimate_tokens,
+        )
+        # Sessions on the same model share its weights and its scheduler. Loading
+        # blocks for a long time, so it runs on a worker thread.
+        key = (ai_model_id, quantization, gguf_file_name)
+        scheduler = await asyncio.to_thread(
+            self.model_registry.acquire,
+            key,
+            lambda: self._load_scheduler(
+                dto.storage_path, quantization, gguf_file_name, tracker, labels
+            ),
+            tracker.cancel_event,
+            estimate,
+            lambda: tracker.update(stage="queued"),
+        )
+        self.scheduler_key = key
+        self.scheduler = scheduler
+        self.metric_labels = labels
+        ACTIVE_SESSIONS.labels(*labels).inc()
+        # A model that finished loading after a cancel stays warm in the registry
+        try:
+            tracker.check_cancelled()
+        except CancelledException:
+            self.unload_model()
+            raise
+        tracker.update(stage="ready")
+        self.model = self.scheduler.model
+        self.tokenizer = self.scheduler.tokenizer
+        self.detokenizer = self.scheduler.detokenizer
+        self.gguf = self.scheduler.gguf
+        self.device = self.scheduler.device
+        self.estimated_ram = self.scheduler.estimated_ram
+        self.estimated_vram = self.scheduler.estimated_vram
+
+        if not self.gguf:
+            self.max_length = self.tokenizer.model_max_length
+        else:
+            self.max_length = self.model.n_ctx()
+
+    def _load_scheduler(
+        self,
+        storage_path: str,
+        quantization: Optional[str],
+        gguf_file_name: Optional[str],
+        progress: LoadProgressTracker,
+        labels: MetricLabels = UNKNOWN_LABELS,
+    ) -> "InferenceScheduler":
+        import torch
+        from llama_cpp import Llama
+        from transformers import (
+            AutoModelForCausalLM,
+            AutoTokenizer,
+            BitsAndBytesConfig,
+        )
+
+        from actuosus_ai.ai_interaction.inference_scheduler import InferenceScheduler
+
+        start = time.perf_counter()
+        if quantization == "gguf":
+            assert gguf_file_name
+            progress.read_files(
+                [os.path.join(storage_path, gguf_file_name)],
+                read_ahead=self.settings.read_ahead_weights,
+            )
+        else:
+            progress.read_files(
+                self._weight_files(storage_path),
+                read_ahead=self.settings.read_ahead_weights,
+            )
+            progress.update(layers_total=self._hf_layer_count(storage_path))
+        progress.update(stage="placing")
+
+        initial_rss = process_memory().rss_bytes
+        model: Any
+        gguf = False
+
         match quantization:
             case "gguf":
-                if not gguf_file_name:
-                    raise ValidationException(
-                        "gguf_file_name must be provided when loading a GGUF model"
-                    )
-                self.model = Llama(
-                    model_path=os.path.join(dto.storage_path, gguf_file_name),
+                assert gguf_file_name
+                model = Llama(
+                    model_path=os.path.join(storage_path, gguf_file_name),
                     n_gpu_layers=-1,
                     n_ctx=0
                 )
-                self.tokenizer = self.model.tokenizer()
-                self.gguf = True
+                tokenizer = model.tokenizer()
+                gguf = True
 
             case "int4":
                 quant_config = BitsAndBytesConfig(
                     load_in_4bit=True, bnb_4bit_compute_dtype=torch.float16
                 )
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    dto.storage_path,
+                model = AutoModelForCausalLM.from_pretrained(
+                    storage_path,
                     quantization_config=quant_config,
                     device_map="auto",
                 )
-                self.tokenizer = AutoTokenizer.from_pretrained(dto.storage_path)
+                tokenizer = AutoTokenizer.from_pretrained(storage_path)
 
             case "int8":
                 quant_config = BitsAndBytesConfig(
                     load_in_8bit=True, bnb_4bit_compute_dtype=torch.float16
                 )
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    dto.storage_path,
+                model = AutoModelForCausalLM.from_pretrained(
+                    storage_path,
                     quantization_config=quant_config,
                     device_map="auto",
                 )
-                self.tokenizer = AutoTokenizer.from_pretrained(dto.storage_path)
+                tokenizer = AutoTokenizer.from_pretrained(storage_path)
 
             case "float16":
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    dto.storage_path, torch_dtype=torch.float16, device_map="auto"
+                model = AutoModelForCausalLM.from_pretrained(
+                    storage_path, torch_dtype=torch.float16, device_map="auto"
                 )
-                self.tokenizer = AutoTokenizer.from_pretrained(dto.storage_path)
+                tokenizer = AutoTokenizer.from_pretrained(storage_path)
 
             case "bfloat16":
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    dto.storage_path, torch_dtype=torch.bfloat16, device_map="auto"
+                model = AutoModelForCausalLM.from_pretrained(
+                    storage_path, torch_dtype=torch.bfloat16, device_map="auto"
                 )
-                self.tokenizer = AutoTokenizer.from_pretrained(dto.storage_path)
+                tokenizer = AutoTokenizer.from_pretrained(storage_path)
             case _:
-                self.model = AutoModelForCausalLM.from_pretrained(
-                    dto.storage_path, device_map="auto"
+                model = AutoModelForCausalLM.from_pretrained(
+                    storage_path, device_map="auto"
                 )
-                self.tokenizer = AutoTokenizer.from_pretrained(dto.storage_path)
+                tokenizer = AutoTokenizer.from_pretrained(storage_path)
 
-        if not self.gguf:
-            self.device = self.model.device
-            self.max_length = self.tokenizer.model_max_length
-        else:
-            self.max_length = self.model.n_ctx()
-        final_ram, final_vram = get_memory_footprint()
-        self.estimated_ram = final_ram - initial_ram
-        self.estimated_vram = final_vram - initial_vram
+        if gguf:
+            architecture = model.metadata.get("general.architecture", "")
+            progress.update(
+                layers_total=int(model.metadata.get(f"{architecture}.block_count", 0))
+            )
+
+        # Decode the whole vocabulary once instead of every alternative at every step
+        detokenizer = (
+            Detokenizer.from_llama(model)
+            if gguf
+            else Detokenizer.from_hf(tokenizer, model.config.vocab_size)
+        )
+
+        memory = llama_model_memory(model) if gguf else hf_model_memory(model)
+        memory.load_rss_delta_bytes = process_memory().rss_bytes - initial_rss
+        snapshot = progress.snapshot()
+        progress.update(
+            stage="ready",
+            files_read=snapshot.files_total,
+            bytes_read=snapshot.bytes_total,
+        )
+        MODEL_LOAD_SECONDS.labels(*labels).set(time.perf_counter() - start)
+        return InferenceScheduler(
+            model,
+            tokenizer,
+            gguf,
+            detokenizer=detokenizer,
+            memory=memory,
+            labels=labels,
+        )
 
     @staticmethod
-    def _generate_top_k_token_with_prob(
-        logits: Tensor, k: int, temperature: float, min_prob: float
-    ) -> List[Tuple[torch.Tensor, float]]:
-        scaled_logits = logits / temperature
-        probabilities = torch.nn.functional.softmax(scaled_logits, dim=-1)
-        probabilities = torch.where(
-            probabilities > min_prob, probabilities, torch.tensor(0.0)
+    def _weight_files(storage_path: str) -> List[str]:
+        """List the weight files from_pretrained reads, safetensors when present"""
+        files = sorted(
+            os.path.join(storage_path, name) for name in os.listdir(storage_path)
         )
+        safetensors = [path for path in files if path.endswith(".safetensors")]
+        return safetensors or [
+            path for path in files if path.endswith((".bin", ".pt", ".pth"))
+        ]
 
-        if probabilities.sum() == 0:
-            raise InternalException("All probabilities are below the minimum threshold 0.01%, please reduce the temperature")
+    @staticmethod
+    def _hf_layer_count(storage_path: str) -> int:
+        try:
+            with open(os.path.join(storage_path, "config.json")) as file:
+                config = json.load(file)
+        except (OSError, ValueError):
+            return 0
+        for name in ("num_hidden_layers", "n_layer", "num_layers"):
+            if isinstance(config.get(name), int):
+                return int(config[name])
+        return 0
+
+    def unload_model(self) -> None:
+        """Release this session's hold on the shared model"""
+        if self.scheduler_key is not None:
+            ACTIVE_SESSIONS.labels(*self.metric_labels).dec()
+            self.model_registry.release(self.scheduler_key)
+        self.scheduler_key = None
+        self.scheduler = None
+        self.model = None
+        self.tokenizer = None
+        self.detokenizer = None
+        self.state_cache.clear()
 
-        # Sample from the filtered probabilities
-        samples = torch.multinomial(probabilities, num_samples=k)
-        selected_probabilities = [prob.item() for prob in probabilities[0, samples][0]]
+    def _restore_gguf_state(self, tokens: List[int]) -> int:
+        """Keep or load the llama.cpp state of the longest already evaluated prefix of the tokens"""
+        from llama_cpp import llama_state_seq_set_data
 
-        # Leave the first element as is, sort the rest by probability so that the answer is more varied
-        first_element = samples[0][0], selected_probabilities[0]
-        remaining_elements = sorted(
-            zip(samples[0][1:], [prob for prob in selected_probabilities[1:] if prob > 0]),
-            key=lambda x: x[1],
-            reverse=True,
+        # Tokens already in the live context are the cheapest to reuse
+        live_length = min(
+            ModelStateCache.common_prefix_length(
+                self.model.input_ids[: self.model.n_tokens].tolist(), tokens
+            ),
+            len(tokens) - 1,
         )
-        top_k_with_prob = [first_element] + remaining_elements
-        return top_k_with_prob
+        length, state, key = self.state_cache.longest_prefix(tokens)
+        length = min(length, len(tokens) - 1)
+        if live_length > 0 and live_length >= length:
+            # The next eval drops everything in the context after n_tokens
+            self.model.n_tokens = live_length
+            return live_length
+        if state is None or length <= 0:
+            self.model.reset()
+            return 0
+        llama_state_seq_set_data(self.model.ctx, state, len(state), 0)
+        # The next eval drops everything in the context after n_tokens
+        self.model.input_ids[:length] = key[:length]
+        self.model.n_tokens = length
+        return length
+
+    def _save_gguf_state(self) -> None:
+        """Checkpoint the llama.cpp sequence state for the evaluated tokens"""
+        from llama_cpp import llama_state_seq_get_data, llama_state_seq_get_size
+
+        n_tokens = self.model.n_tokens
+        if not n_tokens:
+            return
+        size = llama_state_seq_get_size(self.model.ctx, 0)
+        state = (ctypes.c_uint8 * size)()
+        llama_state_seq_get_data(self.model.ctx, state, size, 0)
+        self.state_cache.put(self.model.input_ids[:n_tokens].tolist(), state, size)
 
     def generate_tokens_with_probabilities_gguf(
         self,
@@ -156,41 +375,66 @@ class TextGenerationService:
         min_prob: float,
         stop_event: Optional[Event] = None,
     ) -> Generator[WordProbList, None, None]:
-        self.model.reset()
-        prompt_tokens = self.tokenizer.encode(prompt)
+        import numpy as np
+        import torch
+        from llama_cpp import llama_get_logits
+
+        from actuosus_ai.ai_interaction.sampling import sample_top_k_single
+
+        profiler = self.profiler
+        with profiler.span(TOKENIZATION):
+            prompt_tokens = self.tokenizer.encode(prompt)
         if max_length:
             max_new_tokens = max_length - len(prompt_tokens)
-        for _ in range(max_new_tokens):
-            self.model.eval(prompt_tokens)
-            logits_ptr = llama_get_logits(self.model.ctx)
-            next_token_logits = torch.tensor(
-                np.array(
-                    [
-                        np.ctypeslib.as_array(
-                            logits_ptr, shape=(1, self.model.n_vocab())
-                        )[-1]
-                    ]
-                )
-            )
-            top_k_with_prob = self._generate_top_k_token_with_prob(
-                next_token_logits, k=k, temperature=temperature, min_prob=min_prob
-            )
-            # Check for stop event
-            if stop_event and stop_event.is_set():
-                break
+        assert self.detokenizer is not None
+        stream = self.detokenizer.stream(prompt_tokens)
+        # Only evaluate the tokens after the longest cached prefix
+        pending = prompt_tokens[self._restore_gguf_state(prompt_tokens) :]
+        # The first eval is the prompt's prefill, the others decode one token
+        step_seconds, step_phase = PREFILL_SECONDS, PREFILL
+        try:
+            for _ in range(max_new_tokens):
+                start = time.perf_counter()
+                self.model.eval(pending)
+                end = time.perf_counter()
+                step_seconds.labels(*self.metric_labels).observe(end - start)
+                profiler.add(step_phase, start, end)
+                step_seconds, step_phase = DECODE_STEP_SECONDS, FORWARD
+                with profiler.span(SAMPLING):
+                    logits_ptr = llama_get_logits(self.model.ctx)
+                    next_token_logits = torch.tensor(
+                        np.array(
+                            [
+                                np.ctypeslib.as_array(
+                                    logits_ptr, shape=(1, self.model.n_vocab())
+                                )[-1]
+                            ]
+                        )
+                    )
+                    top_k_with_prob = sample_top_k_single(
+                        next_token_logits,
+                        k=k,
+                        temperature=temperature,
+                        min_prob=min_prob,
+                    )
+                # Check for stop event
+                if stop_event and stop_event.is_set():
+                    break
 
-            # Check for eos token
-            if top_k_with_prob[0][0].item() == self.model.token_eos():
-                self.end_with_eos = True
-                break
+                # Check for eos token
+                next_token = top_k_with_prob[0][0]
+                if next_token == self.model.token_eos():
+                    self.end_with_eos = True
+                    break
 
-            prompt_tokens = top_k_with_prob[0][0].view(1, 1)
+                pending = [next_token]
 
-            # yield the newly generated line
-            yield [
-                (self.tokenizer.decode([token]), prob)
-                for token, prob in top_k_with_prob
-            ]
+                with profiler.span(DECODING):
+                    words = stream.words(top_k_with_prob)
+                # yield the newly generated line
+                yield words
+        finally:
+            self._save_gguf_state()
 
     def generate_tokens_with_probabilities_hf(
         self,
@@ -202,40 +446,25 @@ class TextGenerationService:
         min_prob: float,
         stop_event: Optional[Event] = None,
     ) -> Generator[WordProbList, None, None]:
-        prompt_tokens = self.tokenizer.encode(prompt, return_tensors="pt").to(
-            self.device
-        )
+        with self.profiler.span(TOKENIZATION):
+            prompt_ids = self.tokenizer.encode(prompt, return_tensors="pt")
+        prompt_tokens = prompt_ids[0].tolist()
         if max_length:
-            max_new_tokens = max_length - len(prompt_tokens[0])
-        for _ in range(max_new_tokens):
-            with torch.no_grad():
-                outputs = self.model(prompt_tokens)
-            next_token_logits = outputs.logits[:, -1, :]
-            top_k_with_prob = self._generate_top_k_token_with_prob(
-                next_token_logits, k=k, temperature=temperature, min_prob=min_prob
-            )
-            # Process output
-            del outputs
-            torch.cuda.empty_cache()
-
-            # Check for stop event
-            if stop_event and stop_event.is_set():
-                break
-
-            # Check for eos token
-            if top_k_with_prob[0][0].item() == self.tokenizer.eos_token_id:
-                self.end_with_eos = True
-                break
-
-            # yield the newly generated line
-            yield [
-                (self.tokenizer.decode(token), prob) for token, prob in top_k_with_prob
-            ]
-
-            # Prepare the input for the next iteration
-            prompt_tokens = torch.cat(
-                (prompt_tokens, top_k_with_prob[0][0].view(1, 1)), dim=1
-            )
+            max_new_tokens = max_length - len(prompt_tokens)
+        # Decode steps are batched with the other sessions on this model
+        assert self.scheduler is not None
+        sequence = self.scheduler.submit(
+            prompt_tokens,
+            max_new_tokens=max_new_tokens,
+            k=k,
+            temperature=temperature,
+            min_prob=min_prob,
+            stop_event=stop_event,
+            state_cache=self.state_cache,
+            profiler=self.profiler,
+        )
+        yield from sequence.stream()
+        self.end_with_eos = sequence.end_with_eos
 
     def generate_tokens_with_probabilities(
         self,
@@ -248,8 +477,9 @@ class TextGenerationService:
         stop_event: Optional[Event] = None,
     ) -> Generator[WordProbList, None, None]:
         self.end_with_eos = False
+        generator: Iterator[WordProbList]
         if self.gguf:
-            yield from self.generate_tokens_with_probabilities_gguf(
+            generator = self.generate_tokens_with_probabilities_gguf(
                 prompt=prompt,
                 max_length=max_length,
                 max_new_tokens=max_new_tokens,
@@ -258,8 +488,11 @@ class TextGenerationService:
                 min_prob=min_prob,
                 stop_event=stop_event,
             )
+            if self.scheduler:
+                # The llama.cpp context is shared, so run on the scheduler's worker
+                generator = self.scheduler.submit_serial(generator).stream()
         else:
-            yield from self.generate_tokens_with_probabilities_hf(
+            generator = self.generate_tokens_with_probabilities_hf(
                 prompt=prompt,
                 max_length=max_length,
                 max_new_tokens=max_new_tokens,
@@ -268,3 +501,4 @@ class TextGenerationService:
                 min_prob=min_prob,
                 stop_event=stop_event,
             )
+        yield from timed_tokens(generator, self.metric_labels)
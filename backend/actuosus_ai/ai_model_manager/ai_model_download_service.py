@@ -1,46 +1,102 @@
 import asyncio
 import os
-from typing import List
+import shutil
+from typing import Any, List, Optional
 
-from huggingface_hub import HfApi, snapshot_download
+import httpx
+from huggingface_hub import hf_hub_url
+from huggingface_hub.utils import (
+    RepositoryNotFoundError,
+    build_hf_headers,
+    filter_repo_objects,
+)
 
+from actuosus_ai.ai_model_manager.blob_store import (
+    BLOB_DIR_NAME,
+    BlobStore,
+    sha256_file,
+)
 from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
-from actuosus_ai.ai_model_manager.dto import CreateNewAIModelDTO
+from actuosus_ai.ai_model_manager.chunked_transfer import ChunkedTransfer
+from actuosus_ai.ai_model_manager.hub_client import CachedHubClient, HubClient
+from actuosus_ai.ai_model_manager.download_progress import (
+    DownloadJob,
+    DownloadProgressTracker,
+)
+from actuosus_ai.ai_model_manager.dto import (
+    CreateNewAIModelDTO,
+    FileSelectionDTO,
+    RemoteFileDTO,
+)
 from actuosus_ai.common.actuosus_exception import (
+    ActuosusException,
+    CancelledException,
     InternalException,
     NotFoundException,
     NetworkException,
+    ValidationException,
 )
 from actuosus_ai.common.settings import Settings
 
+# Unfinished downloads stay here between attempts so a retry resumes them
+DOWNLOAD_DIR_NAME = ".downloads"
+
 
 class AIModelDownloadService:
     def __init__(
-        self, language_model_service: AIModelStorageService, settings: Settings
+        self,
+        language_model_service: AIModelStorageService,
+        settings: Settings,
+        endpoint: Optional[str] = None,
+        hub_client: Optional[CachedHubClient] = None,
     ):
         self.language_model_service = language_model_service
         self.settings = settings
+        # Hugging Face endpoint, None for the default (or HF_ENDPOINT)
+        self.endpoint = endpoint
+        self.hub_client = hub_client or CachedHubClient(
+            HubClient(endpoint, settings.huggingface_token)
+        )
+        self.blob_store = BlobStore(
+            os.path.join(settings.base_file_storage_path, BLOB_DIR_NAME)
+        )
 
-    async def download_lm_from_hugging_face(self, model_name: str) -> None:
+    async def download_lm_from_hugging_face(
+        self,
+        model_name: str,
+        progress: Optional[DownloadProgressTracker] = None,
+        selection: Optional[FileSelectionDTO] = None,
+        ai_model_id: Optional[int] = None,
+    ) -> None:
+        """
+        Download the selected files of the repo and register them as a new model, or
+        add them to the registered model ai_model_id, skipping the files it already has
+        """
+        progress = progress or DownloadProgressTracker(
+            DownloadJob(hf_model_id=model_name)
+        )
         try:
-            api = HfApi()
-            pipeline_tag = api.model_info(model_name).pipeline_tag or "Unknown"
-            storage_path = os.path.join(
-                self.settings.base_file_storage_path, model_name
-            )
-
-            # Make sure the storage path is unique by adding a suffix
-            copy_suffix = "_copy"
-            original_storage_path = storage_path
+            target = None
+            if ai_model_id is not None:
+                target = await self.language_model_service.get_model_by_id(ai_model_id)
+                if not target:
+                    raise NotFoundException("Model not found")
 
-            while os.path.exists(storage_path):
-                storage_path = original_storage_path + copy_suffix
-                copy_suffix += "_copy"
-
-            await asyncio.get_running_loop().run_in_executor(
+            info = await self.hub_client.model_info(model_name)
+            siblings = self._select_files(info.siblings or [], selection)
+            pipeline_tag = info.pipeline_tag or "Unknown"
+            storage_path = await asyncio.get_running_loop().run_in_executor(
                 None,
-                lambda: snapshot_download(repo_id=model_name, local_dir=storage_path),
+                lambda: self._download_snapshot(
+                    model_name,
+                    info,
+                    siblings,
+                    progress,
+                    target.storage_path if target else None,
+                ),
             )
+            if target:
+                return
             # Add model and tokenizer to db
             await self.language_model_service.add_new_model(
                 CreateNewAIModelDTO(
@@ -50,30 +106,190 @@ class AIModelDownloadService:
                 ),
             )
 
+        except ActuosusException:
+            raise
+        except Exception as e:
+            raise self._hub_exception(e)
+
+    async def list_remote_files(self, model_name: str) -> List[RemoteFileDTO]:
+        """The files of the repo with their sizes, to choose from before downloading"""
+        try:
+            info = await self.hub_client.model_info(model_name)
         except Exception as e:
-            msg = str(e)
+            raise self._hub_exception(e)
+        return [
+            RemoteFileDTO(name=sibling.rfilename, size=sibling.size)
+            for sibling in info.siblings or []
+        ]
+
+    @staticmethod
+    def _hub_exception(e: Exception) -> ActuosusException:
+        msg = str(e)
 
-            if (
-                "is not a local folder and is not a valid model identifier listed on 'https://huggingface.co/models'"
-                in msg
-            ):
-                raise NotFoundException("Model not found on Hugging Face")
+        if isinstance(e, RepositoryNotFoundError) or (
+            "is not a local folder and is not a valid model identifier listed on 'https://huggingface.co/models'"
+            in msg
+        ):
+            return NotFoundException("Model not found on Hugging Face")
 
-            elif (
-                "We couldn't connect to 'https://huggingface.co' to download model"
-                in msg
-            ):
-                raise NetworkException("Couldn't connect to Hugging Face")
+        elif isinstance(e, httpx.TransportError) or (
+            "We couldn't connect to 'https://huggingface.co' to download model" in msg
+        ):
+            return NetworkException("Couldn't connect to Hugging Face")
 
-            else:
-                raise InternalException(msg)
+        else:
+            return InternalException(msg)
 
     @staticmethod
-    async def search_hub_with_name(ai_model_name: str, limit: int) -> List[str]:
-        try:
-            api = HfApi()
-            return [
-                model.id for model in api.list_models(search=ai_model_name, limit=limit)
+    def _select_files(
+        siblings: List[Any], selection: Optional[FileSelectionDTO]
+    ) -> List[Any]:
+        """The repo files matching the selection, all of them without one"""
+        if selection is None:
+            return list(siblings)
+
+        names = {sibling.rfilename for sibling in siblings}
+        files = set(selection.files or [])
+        missing = sorted(files - names)
+        if missing:
+            raise ValidationException(
+                f"Files not found in the repo: {', '.join(missing)}"
+            )
+
+        matched = set()
+        # Listing files without patterns downloads only those files
+        if selection.include or not files:
+            matched = set(
+                filter_repo_objects(
+                    names,
+                    allow_patterns=selection.include,
+                    ignore_patterns=selection.exclude,
+                )
+            )
+        selected = [
+            sibling
+            for sibling in siblings
+            if sibling.rfilename in files or sibling.rfilename in matched
+        ]
+        if not selected:
+            raise ValidationException("No files in the repo match the selection")
+        return selected
+
+    def _download_snapshot(
+        self,
+        model_name: str,
+        info: Any,
+        siblings: List[Any],
+        progress: DownloadProgressTracker,
+        storage_path: Optional[str] = None,
+    ) -> str:
+        """
+        Download the files of the repo's revision, into storage_path when given or a
+        new storage path otherwise, returns the model's storage path
+        """
+        staging = os.path.join(
+            self.settings.base_file_storage_path,
+            DOWNLOAD_DIR_NAME,
+            model_name,
+            info.sha or "main",
+        )
+        if storage_path:
+            siblings = [
+                sibling
+                for sibling in siblings
+                if not os.path.exists(os.path.join(storage_path, sibling.rfilename))
             ]
+        progress.update(
+            files_total=len(siblings),
+            bytes_total=sum(sibling.size or 0 for sibling in siblings),
+        )
+        os.makedirs(staging, exist_ok=True)
+        with httpx.Client(timeout=httpx.Timeout(30.0, read=120.0)) as client:
+            transfer = ChunkedTransfer(
+                client,
+                chunk_size=self.settings.download_chunk_mb * 1024**2,
+                max_workers=self.settings.download_parallel_chunks,
+                headers=build_hf_headers(token=self.settings.huggingface_token),
+            )
+            try:
+                for sibling in siblings:
+                    self._download_file(
+                        model_name, info, sibling, staging, transfer, progress
+                    )
+            except CancelledException:
+                # Unlike a failure, a cancelled download is not resumed later
+                self._remove_staging(staging)
+                raise
+        self.blob_store.ingest_tree(staging)
+
+        if not storage_path:
+            storage_path = os.path.join(
+                self.settings.base_file_storage_path, model_name
+            )
+
+            # Make sure the storage path is unique by adding a suffix
+            copy_suffix = "_copy"
+            original_storage_path = storage_path
+
+            while os.path.exists(storage_path):
+                storage_path = original_storage_path + copy_suffix
+                copy_suffix += "_copy"
+
+        # Move in only the selected files, the staging directory may hold others left
+        # by an earlier download of the repo with another selection
+        for sibling in siblings:
+            destination = os.path.join(storage_path, sibling.rfilename)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(os.path.join(staging, sibling.rfilename), destination)
+        os.makedirs(storage_path, exist_ok=True)
+        self._remove_staging(staging)
+        return storage_path
+
+    @staticmethod
+    def _remove_staging(staging: str) -> None:
+        """Remove the staging directory, and its parents once they are empty"""
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            os.removedirs(os.path.dirname(staging))
+        except OSError:
+            pass
+
+    def _download_file(
+        self,
+        model_name: str,
+        info: Any,
+        sibling: Any,
+        staging: str,
+        transfer: ChunkedTransfer,
+        progress: DownloadProgressTracker,
+    ) -> None:
+        path = os.path.join(staging, sibling.rfilename)
+        sha256 = sibling.lfs.sha256 if sibling.lfs else None
+        # Finished by an earlier attempt, or already in the blob store
+        if os.path.exists(path) or (sha256 and self.blob_store.link(sha256, path)):
+            progress.add_bytes(sibling.size or 0)
+            progress.file_done()
+            return
+
+        transfer.download(
+            hf_hub_url(
+                model_name, sibling.rfilename, revision=info.sha, endpoint=self.endpoint
+            ),
+            path,
+            sibling.size,
+            progress.add_bytes,
+            progress.cancel_event,
+        )
+        if sha256:
+            digest = sha256_file(path)
+            if digest != sha256:
+                os.unlink(path)
+                raise InternalException(f"Checksum mismatch for {sibling.rfilename}")
+            self.blob_store.ingest_file(path, digest)
+        progress.file_done()
+
+    async def search_hub_with_name(self, ai_model_name: str, limit: int) -> List[str]:
+        try:
+            return await self.hub_client.search(ai_model_name, limit)
         except Exception as e:
             raise InternalException(str(e))
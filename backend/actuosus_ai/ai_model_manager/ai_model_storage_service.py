@@ -1,26 +1,61 @@
 import asyncio
+import base64
+import binascii
 import copy
+import json
 import os
 import shutil
 import uuid
+from datetime import datetime
 from typing import Optional, List, Any
 
 from pydantic import BaseModel
-from sqlalchemy import select, asc, desc
+from sqlalchemy import (
+    ColumnElement,
+    DateTime,
+    asc,
+    column,
+    desc,
+    func,
+    literal_column,
+    select,
+    table,
+    tuple_,
+)
 from sqlalchemy.dialects.mysql import dialect as mysql_dialect
 from sqlalchemy.dialects.postgresql import dialect as postgresql_dialect
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from actuosus_ai.ai_model_manager.blob_store import BLOB_DIR_NAME, BlobStore
 from actuosus_ai.ai_model_manager.dto import AIModelDTO, CreateNewAIModelDTO
-from actuosus_ai.ai_model_manager.orm import AIModelORM
-from actuosus_ai.common.actuosus_exception import InternalException, NotFoundException
+from actuosus_ai.ai_model_manager.model_files import (
+    copy_model_tree,
+    save_replacing_files,
+)
+from actuosus_ai.ai_model_manager.orm import (
+    AI_MODEL_FTS_TABLE,
+    AIModelORM,
+    sqlite_has_fts5_trigram,
+)
+from actuosus_ai.common.actuosus_exception import (
+    InternalException,
+    NotFoundException,
+    ValidationException,
+)
 from actuosus_ai.common.settings import Settings
 
+_ai_model_fts = table(AI_MODEL_FTS_TABLE, column("rowid"), column(AI_MODEL_FTS_TABLE))
+# The SQLite trigram index only matches search terms of at least 3 characters
+FTS_MIN_LENGTH = 3
+
 
 class AIModelStorageService:
     def __init__(self, settings: Settings, async_session: AsyncSession):
         self.settings = settings
         self.async_session = async_session
+        self.blob_store = BlobStore(
+            os.path.join(settings.base_file_storage_path, BLOB_DIR_NAME)
+        )
 
     @staticmethod
     def _dto_to_orm(dto: BaseModel) -> AIModelORM:
@@ -61,9 +96,13 @@ class AIModelStorageService:
             await self.async_session.commit()
             # Save model and required tokenizer, processor, etc to storage
             loop = asyncio.get_running_loop()
+            # Files shared with copies of this model are replaced, not written through
             tasks = [
                 loop.run_in_executor(
-                    None, lambda: item.save_pretrained(dto.storage_path)
+                    None,
+                    save_replacing_files,
+                    item.save_pretrained,
+                    dto.storage_path,
                 )
                 for item in items
             ]
@@ -92,7 +131,15 @@ class AIModelStorageService:
         pipeline_tag: Optional[str] = None,
         order_by: Optional[str] = None,
         is_desc: Optional[bool] = True,
+        cursor: Optional[str] = None,
     ) -> List[AIModelDTO]:
+        """
+        Get models, a cursor from encode_cursor continues after the last model of
+        the previous page without scanning the skipped rows like offset does
+        """
+        keys = self._order_keys(order_by)
+        descending = bool(order_by and is_desc)
+        after = self._decode_cursor(cursor, keys) if cursor else None
         try:
             query = select(AIModelORM)
 
@@ -103,22 +150,19 @@ class AIModelStorageService:
                 query = query.offset(offset)
 
             if name:
-                # If the db is mysql or postgres, use match, otherwise use contains
-                if isinstance(
-                    self.async_session.bind.dialect, (mysql_dialect, postgresql_dialect)
-                ):
-                    query = query.filter(AIModelORM.name.match(name))
-                else:
-                    query = query.filter(AIModelORM.name.contains(name))
+                query = query.filter(self._name_filter(name))
 
             if pipeline_tag:
                 query = query.filter(AIModelORM.pipeline_tag == pipeline_tag)
 
-            if order_by:
-                if is_desc:
-                    query = query.order_by(desc(AIModelORM.__dict__[order_by]))
-                else:
-                    query = query.order_by(asc(AIModelORM.__dict__[order_by]))
+            if after is not None:
+                row, last = tuple_(*keys), tuple_(*after)
+                query = query.filter(row < last if descending else row > last)
+
+            # ai_model_id breaks ties so that every page boundary is exact
+            query = query.order_by(
+                *(desc(key) if descending else asc(key) for key in keys)
+            )
 
             result = await self.async_session.execute(query)
 
@@ -127,6 +171,65 @@ class AIModelStorageService:
         except Exception as e:
             raise InternalException(str(e))
 
+    def _name_filter(self, name: str) -> ColumnElement[bool]:
+        dialect = self.async_session.bind.dialect
+        # If the db is mysql or postgres, use their full text search
+        if isinstance(dialect, mysql_dialect):
+            return AIModelORM.name.match(name)
+        if isinstance(dialect, postgresql_dialect):
+            simple: ColumnElement[Any] = literal_column("'simple'")
+            return func.to_tsvector(simple, AIModelORM.name).bool_op("@@")(
+                func.plainto_tsquery(simple, name)
+            )
+        if (
+            dialect.name == "sqlite"
+            and len(name) >= FTS_MIN_LENGTH
+            and sqlite_has_fts5_trigram()
+        ):
+            # A quoted phrase matches the name as a substring, like contains
+            phrase = '"' + name.replace('"', '""') + '"'
+            return AIModelORM.ai_model_id.in_(
+                select(_ai_model_fts.c.rowid).where(
+                    _ai_model_fts.c[AI_MODEL_FTS_TABLE].op("MATCH")(phrase)
+                )
+            )
+        return AIModelORM.name.contains(name)
+
+    @staticmethod
+    def _order_keys(order_by: Optional[str]) -> List[Any]:
+        if not order_by or order_by == "ai_model_id":
+            return [AIModelORM.ai_model_id]
+        if order_by not in AIModelORM.__table__.columns:
+            raise ValidationException(f"Models can not be ordered by {order_by}")
+        return [getattr(AIModelORM, order_by), AIModelORM.ai_model_id]
+
+    @classmethod
+    def encode_cursor(cls, dto: AIModelDTO, order_by: Optional[str] = None) -> str:
+        """Cursor of the page that follows dto in the given order"""
+        values = [getattr(dto, key.key) for key in cls._order_keys(order_by)]
+        data = json.dumps(
+            [
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in values
+            ]
+        )
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    @staticmethod
+    def _decode_cursor(cursor: str, keys: List[Any]) -> List[Any]:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(values, list) or len(values) != len(keys):
+                raise ValueError
+            return [
+                datetime.fromisoformat(value)
+                if isinstance(key.type, DateTime)
+                else value
+                for key, value in zip(keys, values)
+            ]
+        except (ValueError, TypeError, binascii.Error):
+            raise ValidationException("Invalid cursor")
+
     async def delete_model_by_id(self, ai_model_id: int) -> None:
         try:
             query = await self.async_session.execute(
@@ -137,13 +240,21 @@ class AIModelStorageService:
                 await self.async_session.delete(model)
                 await self.async_session.commit()
                 await asyncio.get_running_loop().run_in_executor(
-                    None,
-                    lambda: shutil.rmtree(str(model.storage_path), ignore_errors=True),
+                    None, lambda: self._delete_files(str(model.storage_path))
                 )
         except Exception as e:
             raise InternalException(str(e))
 
-    async def copy_model_by_id(self, ai_model_id: int) -> None:
+    def _delete_files(self, storage_path: str) -> None:
+        shutil.rmtree(storage_path, ignore_errors=True)
+        # Blobs only this model linked to are no longer needed
+        self.blob_store.collect_garbage()
+
+    async def copy_model_by_id(self, ai_model_id: int, full_copy: bool = False) -> None:
+        """
+        Copy a model, the weight files are reflinked or hardlinked to the original's
+        unless full_copy is set
+        """
         try:
             model = await self.get_model_by_id(ai_model_id)
             if model:
@@ -154,7 +265,9 @@ class AIModelStorageService:
                 )
                 await asyncio.get_running_loop().run_in_executor(
                     None,
-                    lambda: shutil.copytree(model.storage_path, new_model.storage_path),
+                    lambda: copy_model_tree(
+                        model.storage_path, new_model.storage_path, full_copy
+                    ),
                 )
                 self.async_session.add(self._dto_to_orm(new_model))
                 await self.async_session.commit()
@@ -0,0 +1,117 @@
+import errno
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+from actuosus_ai.ai_model_manager.model_files import is_weight_file
+
+BLOB_DIR_NAME = ".blobs"
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Linking into and collecting the store must not interleave, across every instance
+_store_lock = threading.Lock()
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BlobStore:
+    """
+    Content addressed store of model weight files, named by their sha256 (the same
+    hash Hugging Face reports for LFS files).
+
+    A model directory holds hardlinks into the store, so identical files of
+    different models take disk space once and the link count of a blob is its
+    reference count: a blob with no link left besides its own is garbage.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.root, "sha256", digest[:2], digest)
+
+    def has(self, digest: str) -> bool:
+        return os.path.isfile(self.blob_path(digest))
+
+    def refcount(self, digest: str) -> int:
+        """Number of model files linked to the blob"""
+        try:
+            return os.stat(self.blob_path(digest)).st_nlink - 1
+        except FileNotFoundError:
+            return 0
+
+    def link(self, digest: str, path: str) -> bool:
+        """Place the blob at path, returns False when it is not in the store"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _store_lock:
+            try:
+                self._replace_with_link(self.blob_path(digest), path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def ingest_file(self, path: str, digest: Optional[str] = None) -> Optional[str]:
+        """
+        Move a file into the store, or swap it for a link to the identical blob
+        already there. Returns its digest, None when the filesystem has no hardlinks
+        """
+        digest = digest or sha256_file(path)
+        blob = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        with _store_lock:
+            try:
+                if os.path.exists(blob):
+                    if not os.path.samefile(blob, path):
+                        self._replace_with_link(blob, path)
+                else:
+                    os.link(path, blob)
+            except OSError as e:
+                if e.errno in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP):
+                    return None
+                raise
+        return digest
+
+    def ingest_tree(self, directory: str) -> Dict[str, str]:
+        """
+        Ingest the weight files of a model directory, returns the manifest of
+        relative path to digest. Small files (config, tokenizer) stay private
+        """
+        manifest = {}
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                if not is_weight_file(path) or os.path.islink(path):
+                    continue
+                if os.stat(path).st_nlink > 1:
+                    # Already shared, linked from the store or from a copied model
+                    continue
+                digest = self.ingest_file(path)
+                if digest:
+                    manifest[os.path.relpath(path, directory)] = digest
+        return manifest
+
+    def collect_garbage(self) -> int:
+        """Delete the blobs no model links to any more, returns the bytes freed"""
+        freed = 0
+        with _store_lock:
+            for root, _, files in os.walk(self.root):
+                for name in files:
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    if stat.st_nlink <= 1:
+                        os.unlink(path)
+                        freed += stat.st_size
+        return freed
+
+    @staticmethod
+    def _replace_with_link(blob: str, path: str) -> None:
+        temporary = path + ".blob"
+        os.link(blob, temporary)
+        os.replace(temporary, path)
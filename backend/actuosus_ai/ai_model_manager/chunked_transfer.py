@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set
+
+import httpx
+
+from actuosus_ai.common.actuosus_exception import CancelledException
+
+INCOMPLETE_SUFFIX = ".incomplete"
+STATE_SUFFIX = ".incomplete.json"
+BLOCK_SIZE = 1024 * 1024
+
+
+class RangesNotSupported(Exception):
+    pass
+
+
+class ChunkedTransfer:
+    """
+    Download files over HTTP in parallel byte range chunks.
+
+    A file is written to "<path>.incomplete" next to a small JSON state of the
+    finished chunks, so a failed or interrupted download resumes where it stopped
+    instead of starting over. Servers that ignore Range get one sequential request.
+    """
+
+    def __init__(
+        self,
+        client: httpx.Client,
+        chunk_size: int = 16 * 1024 * 1024,
+        max_workers: int = 4,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        self.client = client
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.headers = headers or {}
+
+    def download(
+        self,
+        url: str,
+        path: str,
+        size: Optional[int] = None,
+        on_progress: Callable[[int], None] = lambda _: None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> None:
+        """Download url to path, on_progress gets the bytes written as they come"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if size is None:
+            size = self._remote_size(url)
+        if size is None or size <= self.chunk_size:
+            self._download_sequential(url, path, on_progress, cancel_event)
+            return
+        reported = [0]
+        lock = threading.Lock()
+
+        def chunk_progress(length: int) -> None:
+            with lock:
+                reported[0] += length
+            on_progress(length)
+
+        try:
+            self._download_chunked(url, path, size, chunk_progress, cancel_event)
+        except RangesNotSupported:
+            on_progress(-reported[0])
+            self._download_sequential(url, path, on_progress, cancel_event)
+
+    def _remote_size(self, url: str) -> Optional[int]:
+        response = self.client.head(url, headers=self.headers, follow_redirects=True)
+        response.raise_for_status()
+        length = response.headers.get("content-length")
+        return int(length) if length is not None else None
+
+    def _download_chunked(
+        self,
+        url: str,
+        path: str,
+        size: int,
+        on_progress: Callable[[int], None],
+        cancel_event: Optional[threading.Event],
+    ) -> None:
+        partial, state_path = path + INCOMPLETE_SUFFIX, path + STATE_SUFFIX
+        chunks = range(0, (size + self.chunk_size - 1) // self.chunk_size)
+        done = self._load_state(state_path, size)
+        if not done or not os.path.exists(partial):
+            done = set()
+            with open(partial, "wb") as file:
+                file.truncate(size)
+        # Resumed chunks count as progress straight away
+        on_progress(sum(self._chunk_length(chunk, size) for chunk in done))
+
+        lock = threading.Lock()
+
+        def fetch(chunk: int) -> None:
+            start = chunk * self.chunk_size
+            end = start + self._chunk_length(chunk, size) - 1
+            written = 0
+            try:
+                with self.client.stream(
+                    "GET",
+                    url,
+                    headers={**self.headers, "Range": f"bytes={start}-{end}"},
+                    follow_redirects=True,
+                ) as response:
+                    response.raise_for_status()
+                    if response.status_code != httpx.codes.PARTIAL_CONTENT:
+                        raise RangesNotSupported()
+                    with open(partial, "r+b") as file:
+                        file.seek(start)
+                        for block in response.iter_bytes(BLOCK_SIZE):
+                            if cancel_event and cancel_event.is_set():
+                                raise CancelledException("Download was cancelled")
+                            file.write(block)
+                            written += len(block)
+                            on_progress(len(block))
+            except BaseException:
+                # The chunk is fetched again on resume
+                on_progress(-written)
+                raise
+            with lock:
+                done.add(chunk)
+                self._save_state(state_path, size, done)
+
+        with ThreadPoolExecutor(
+            self.max_workers, thread_name_prefix="download-chunk"
+        ) as executor:
+            futures = [
+                executor.submit(fetch, chunk) for chunk in chunks if chunk not in done
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        os.replace(partial, path)
+        os.unlink(state_path)
+
+    def _download_sequential(
+        self,
+        url: str,
+        path: str,
+        on_progress: Callable[[int], None],
+        cancel_event: Optional[threading.Event],
+    ) -> None:
+        partial = path + INCOMPLETE_SUFFIX
+        with self.client.stream(
+            "GET", url, headers=self.headers, follow_redirects=True
+        ) as response:
+            response.raise_for_status()
+            written = 0
+            try:
+                with open(partial, "wb") as file:
+                    for block in response.iter_bytes(BLOCK_SIZE):
+                        if cancel_event and cancel_event.is_set():
+                            raise CancelledException("Download was cancelled")
+                        file.write(block)
+                        written += len(block)
+                        on_progress(len(block))
+            except BaseException:
+                on_progress(-written)
+                raise
+        os.replace(partial, path)
+
+    def _chunk_length(self, chunk: int, size: int) -> int:
+        return min(self.chunk_size, size - chunk * self.chunk_size)
+
+    def _load_state(self, state_path: str, size: int) -> Set[int]:
+        try:
+            with open(state_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return set()
+        # A state written with another chunk size or for another file is useless
+        if state.get("size") != size or state.get("chunk_size") != self.chunk_size:
+            return set()
+        return set(state.get("done", []))
+
+    def _save_state(self, state_path: str, size: int, done: Set[int]) -> None:
+        with open(state_path + ".tmp", "w") as file:
+            json.dump(
+                {"size": size, "chunk_size": self.chunk_size, "done": sorted(done)},
+                file,
+            )
+        os.replace(state_path + ".tmp", state_path)
@@ -1,23 +1,86 @@
+import asyncio
 import os
+from typing import Any, AsyncGenerator, Dict, Set
 
 from fastapi import Depends
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from typing import AsyncGenerator
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 
-from actuosus_ai.ai_model_manager.orm import BaseORM
+from actuosus_ai.ai_model_manager.orm import create_schema
 from actuosus_ai.common.settings import Settings, get_settings
 
+# One engine (and its connection pool) per database url for the whole process
+_engines: Dict[str, AsyncEngine] = {}
+_session_makers: Dict[str, async_sessionmaker[AsyncSession]] = {}
+_initialized: Set[str] = set()
+_init_lock = asyncio.Lock()
+
+
+def _pool_options(settings: Settings) -> Dict[str, Any]:
+    url = make_url(settings.database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # In memory SQLite uses a single static connection, there is no pool to size
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+def get_async_engine(settings: Settings) -> AsyncEngine:
+    """Return the shared engine of the settings' database, creating it on first use"""
+    engine = _engines.get(settings.database_url)
+    if engine is None:
+        engine = _engines[settings.database_url] = create_async_engine(
+            settings.database_url, echo=settings.debug_mode, **_pool_options(settings)
+        )
+        _session_makers[settings.database_url] = async_sessionmaker(
+            bind=engine, autocommit=False, autoflush=False, class_=AsyncSession
+        )
+    return engine
+
+
+def get_async_session_maker(settings: Settings) -> async_sessionmaker[AsyncSession]:
+    get_async_engine(settings)
+    return _session_makers[settings.database_url]
+
+
+async def init_db(settings: Settings) -> None:
+    """Create the storage directory and the schema, once per database"""
+    if settings.database_url in _initialized:
+        return
+    async with _init_lock:
+        if settings.database_url in _initialized:
+            return
+        os.makedirs(settings.base_file_storage_path, exist_ok=True)
+        async with get_async_engine(settings).begin() as conn:
+            await conn.run_sync(create_schema)
+        _initialized.add(settings.database_url)
+
+
+async def dispose_engines() -> None:
+    """Close every pooled connection, used on application shutdown"""
+    engines = list(_engines.values())
+    _engines.clear()
+    _session_makers.clear()
+    _initialized.clear()
+    for engine in engines:
+        await engine.dispose()
+
 
 async def get_async_db_session(
     settings: Settings = Depends(get_settings),
 ) -> AsyncGenerator[AsyncSession, None]:
-    if not os.path.exists(settings.base_file_storage_path):
-        os.makedirs(settings.base_file_storage_path)
-    async_engine = create_async_engine(settings.database_url, echo=settings.debug_mode)
-    async_maker = async_sessionmaker(
-        bind=async_engine, autocommit=False, autoflush=False, class_=AsyncSession
-    )
-    async with async_engine.begin() as conn:
-        await conn.run_sync(BaseORM.metadata.create_all)
-    async with async_maker() as session:
+    # The lifespan hook has already run this for the app's own settings, it only does
+    # work for a database first seen here (e.g. overridden settings in tests)
+    await init_db(settings)
+    async with get_async_session_maker(settings)() as session:
         yield session
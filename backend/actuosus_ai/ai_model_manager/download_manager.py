@@ -0,0 +1,191 @@
+import asyncio
+import json
+import threading
+import weakref
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional
+
+from actuosus_ai.ai_model_manager.ai_model_download_service import (
+    AIModelDownloadService,
+)
+from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
+from actuosus_ai.ai_model_manager.connection import get_async_session_maker, init_db
+from actuosus_ai.ai_model_manager.dto import FileSelectionDTO
+from actuosus_ai.ai_model_manager.hub_client import get_hub_client
+from actuosus_ai.ai_model_manager.download_progress import (
+    DownloadJob,
+    DownloadProgressTracker,
+    DownloadStatus,
+)
+from actuosus_ai.common.actuosus_exception import (
+    CancelledException,
+    ValidationException,
+)
+from actuosus_ai.common.settings import Settings, get_settings
+
+
+class DownloadManager:
+    """
+    Run model downloads as background jobs on the event loop.
+
+    At most max_concurrent jobs download at once, the others wait queued. Asking for
+    files that are already queued or downloading returns the running job instead of
+    starting another, and jobs for the same repo run one after the other as they
+    share its staging directory. A failed download keeps its partial files, so
+    downloading the same repo again resumes it, a cancelled one removes them.
+    """
+
+    # Finished jobs kept for polling
+    HISTORY = 100
+
+    def __init__(self, settings: Settings, max_concurrent: int = 2):
+        self.settings = settings
+        self.max_concurrent = max_concurrent
+        self._trackers: OrderedDict[str, DownloadProgressTracker] = OrderedDict()
+        self._active: Dict[str, str] = {}
+        # A repo's lock goes away with the last job holding or waiting for it
+        self._repo_locks: weakref.WeakValueDictionary[str, asyncio.Lock] = (
+            weakref.WeakValueDictionary()
+        )
+        self._tasks: Dict[str, asyncio.Task[None]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def start(
+        self,
+        hf_model_id: str,
+        selection: Optional[FileSelectionDTO] = None,
+        ai_model_id: Optional[int] = None,
+    ) -> DownloadJob:
+        """
+        Queue a download of the selected files of the repo, as a new model or added to
+        the model ai_model_id, or return the job already downloading them
+        """
+        tracker = DownloadProgressTracker(
+            DownloadJob(
+                hf_model_id=hf_model_id,
+                selection=selection or FileSelectionDTO(),
+                ai_model_id=ai_model_id,
+            )
+        )
+        job = tracker.snapshot()
+        key = self._job_key(job)
+        job_id = self._active.get(key)
+        if job_id:
+            return self._trackers[job_id].snapshot()
+
+        self._trackers[job.job_id] = tracker
+        self._active[key] = job.job_id
+        self._forget_old_jobs()
+        task = asyncio.get_running_loop().create_task(self._run(tracker))
+        self._tasks[job.job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job.job_id, None))
+        return job
+
+    def cancel(self, job_id: str) -> Optional[DownloadJob]:
+        """
+        Cancel a job, a queued one at once and a downloading one once its transfer
+        threads see the cancel, which also removes its partial files
+        """
+        tracker = self._trackers.get(job_id)
+        if not tracker:
+            return None
+        job = tracker.snapshot()
+        if job.status in DownloadStatus.FINISHED:
+            raise ValidationException("The download job has already finished")
+        tracker.cancel_event.set()
+        task = self._tasks.get(job_id)
+        if job.status == DownloadStatus.QUEUED and task:
+            # Nothing was downloaded yet, stop waiting for a slot
+            task.cancel()
+        return tracker.snapshot()
+
+    def get(self, job_id: str) -> Optional[DownloadJob]:
+        tracker = self._trackers.get(job_id)
+        return tracker.snapshot() if tracker else None
+
+    def jobs(self) -> List[DownloadJob]:
+        """Every known job, oldest first"""
+        return [tracker.snapshot() for tracker in self._trackers.values()]
+
+    async def wait(self, job_id: str) -> Optional[DownloadJob]:
+        """Wait for a job to finish"""
+        async for job in self.events(job_id):
+            if job.status in DownloadStatus.FINISHED:
+                return job
+        return None
+
+    async def events(
+        self, job_id: str, interval: float = 0.25
+    ) -> AsyncIterator[DownloadJob]:
+        """Yield the job whenever its progress changes, until it finishes"""
+        last = None
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job != last:
+                yield job
+                last = job
+            if job.status in DownloadStatus.FINISHED:
+                return
+            await asyncio.sleep(interval)
+
+    async def _run(self, tracker: DownloadProgressTracker) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        job = tracker.snapshot()
+        repo_lock = self._repo_locks.setdefault(job.hf_model_id, asyncio.Lock())
+        try:
+            async with repo_lock, self._semaphore:
+                tracker.update(status=DownloadStatus.DOWNLOADING)
+                await self._download(job, tracker)
+            tracker.update(status=DownloadStatus.COMPLETED)
+        except (CancelledException, asyncio.CancelledError):
+            tracker.update(status=DownloadStatus.CANCELLED)
+        except Exception as e:
+            tracker.update(status=DownloadStatus.FAILED, error=str(e))
+        finally:
+            self._active.pop(self._job_key(job), None)
+
+    @staticmethod
+    def _job_key(job: DownloadJob) -> str:
+        return json.dumps(
+            [job.hf_model_id, job.ai_model_id, job.selection.model_dump()]
+        )
+
+    async def _download(
+        self, job: DownloadJob, tracker: DownloadProgressTracker
+    ) -> None:
+        # The job outlives the request that started it, so it has its own session
+        await init_db(self.settings)
+        async with get_async_session_maker(self.settings)() as session:
+            storage_service = AIModelStorageService(self.settings, session)
+            await AIModelDownloadService(
+                storage_service, self.settings, hub_client=get_hub_client()
+            ).download_lm_from_hugging_face(
+                job.hf_model_id, tracker, job.selection, job.ai_model_id
+            )
+
+    def _forget_old_jobs(self) -> None:
+        finished = [
+            job_id
+            for job_id, tracker in self._trackers.items()
+            if tracker.snapshot().status in DownloadStatus.FINISHED
+        ]
+        for job_id in finished[: max(len(finished) - self.HISTORY, 0)]:
+            del self._trackers[job_id]
+
+
+_download_manager: Optional[DownloadManager] = None
+_download_manager_lock = threading.Lock()
+
+
+def get_download_manager() -> DownloadManager:
+    global _download_manager
+    with _download_manager_lock:
+        if _download_manager is None:
+            settings = get_settings()
+            _download_manager = DownloadManager(
+                settings, settings.max_concurrent_downloads
+            )
+        return _download_manager
@@ -0,0 +1,58 @@
+import threading
+import uuid
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+from actuosus_ai.ai_model_manager.dto import FileSelectionDTO
+
+
+class DownloadStatus:
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+class DownloadJob(BaseModel):
+    job_id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    hf_model_id: str
+    selection: FileSelectionDTO = Field(default_factory=FileSelectionDTO)
+    # Registered model the files are added to, None to register a new model
+    ai_model_id: Optional[int] = None
+    status: str = DownloadStatus.QUEUED
+    files_done: int = 0
+    files_total: int = 0
+    bytes_done: int = 0
+    bytes_total: int = 0
+    error: Optional[str] = None
+
+
+class DownloadProgressTracker:
+    """Progress of a download written by the transfer threads, read from the event loop"""
+
+    def __init__(
+        self, job: DownloadJob, cancel_event: Optional[threading.Event] = None
+    ):
+        self.cancel_event = cancel_event or threading.Event()
+        self._job = job
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> DownloadJob:
+        with self._lock:
+            return self._job.model_copy()
+
+    def update(self, **changes: object) -> None:
+        with self._lock:
+            self._job = self._job.model_copy(update=changes)
+
+    def add_bytes(self, length: int) -> None:
+        with self._lock:
+            self._job.bytes_done += length
+
+    def file_done(self) -> None:
+        with self._lock:
+            self._job.files_done += 1
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import List, Optional
 
 
 class AIModelDTO(BaseModel):
@@ -15,3 +16,16 @@ class CreateNewAIModelDTO(BaseModel):
     name: str = Field(..., min_length=1)
     pipeline_tag: str = "Unknown"
     storage_path: str
+
+
+class FileSelectionDTO(BaseModel):
+    # Glob patterns matched against the repo's file paths, everything when not set
+    include: Optional[List[str]] = None
+    exclude: Optional[List[str]] = None
+    # Exact file paths, downloaded along with whatever the patterns match
+    files: Optional[List[str]] = None
+
+
+class RemoteFileDTO(BaseModel):
+    name: str
+    size: Optional[int] = None
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from huggingface_hub import HfApi, login
+
+from actuosus_ai.common.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class HubClient:
+    """
+    The blocking Hugging Face calls the app makes, subclass it to talk to something
+    other than the hub
+    """
+
+    def __init__(self, endpoint: Optional[str] = None, token: Optional[str] = None):
+        self.endpoint = endpoint
+        self.token = token
+
+    def search(self, ai_model_name: str, limit: int) -> List[str]:
+        api = HfApi(endpoint=self.endpoint, token=self.token)
+        return [
+            model.id for model in api.list_models(search=ai_model_name, limit=limit)
+        ]
+
+    def model_info(self, model_name: str) -> Any:
+        api = HfApi(endpoint=self.endpoint, token=self.token)
+        return api.model_info(model_name, files_metadata=True)
+
+
+def login_to_hub(token: Optional[str]) -> None:
+    """
+    Save the token for the libraries that read the hub login, like from_pretrained.
+    Logging in checks the token online, so the app runs it in the background.
+    """
+    if not token:
+        return
+    try:
+        login(token)
+    except Exception as e:
+        logger.warning("Hugging Face login failed: %s", e)
+
+
+class HubCache:
+    """
+    Results of blocking calls kept for ttl seconds, the least recently used dropped
+    past max_entries. Callers asking for a key that is being loaded wait for that
+    load instead of starting another, failed loads are not kept.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._pending: Dict[Hashable, Awaitable[Any]] = {}
+
+    async def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """The cached value of key, or the value of load run in the executor"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(key, load))
+            self._pending[key] = pending
+        # A caller that goes away must not cancel the load the others wait for
+        return await asyncio.shield(pending)
+
+    async def _load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        try:
+            value = await asyncio.get_running_loop().run_in_executor(None, load)
+        finally:
+            del self._pending[key]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CachedHubClient:
+    """Run the hub client's calls off the event loop and cache their results"""
+
+    def __init__(self, client: HubClient, ttl: float = 300, max_entries: int = 256):
+        self.client = client
+        self.cache = HubCache(ttl, max_entries)
+
+    async def search(self, ai_model_name: str, limit: int) -> List[str]:
+        result = await self.cache.get(
+            ("search", ai_model_name, limit),
+            lambda: self.client.search(ai_model_name, limit),
+        )
+        return list(result)
+
+    async def model_info(self, model_name: str) -> Any:
+        return await self.cache.get(
+            ("model_info", model_name), lambda: self.client.model_info(model_name)
+        )
+
+
+_hub_client: Optional[CachedHubClient] = None
+_hub_client_lock = threading.Lock()
+
+
+def get_hub_client() -> CachedHubClient:
+    global _hub_client
+    with _hub_client_lock:
+        if _hub_client is None:
+            settings = get_settings()
+            _hub_client = CachedHubClient(
+                HubClient(token=settings.huggingface_token),
+                settings.hub_cache_ttl,
+                settings.hub_cache_size,
+            )
+        return _hub_client
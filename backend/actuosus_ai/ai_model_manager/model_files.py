@@ -0,0 +1,105 @@
+import errno
+import os
+import shutil
+import sys
+import tempfile
+from typing import Callable, Literal
+
+try:
+    import fcntl
+
+    # Linux ioctl cloning a whole file, named in fcntl only since Python 3.12
+    FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+except ImportError:
+    fcntl = None  # type: ignore
+
+# Large read-only files, shared between copies of a model
+WEIGHT_FILE_EXTENSIONS = {
+    ".safetensors",
+    ".bin",
+    ".pt",
+    ".pth",
+    ".gguf",
+    ".h5",
+    ".msgpack",
+    ".onnx",
+}
+
+CopyKind = Literal["reflink", "hardlink", "copy"]
+
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EPERM,
+    errno.EBADF,
+}
+
+
+def is_weight_file(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in WEIGHT_FILE_EXTENSIONS
+
+
+def reflink(src: str, dst: str) -> bool:
+    """Clone src to dst sharing its blocks, returns False where the filesystem can't"""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+    os.unlink(dst)
+    return False
+
+
+def link_or_copy_file(src: str, dst: str) -> CopyKind:
+    """
+    Copy a file cheaply: reflink where supported, otherwise hardlink weight files and
+    copy everything else (config, tokenizer, ...) which may be rewritten in place
+    """
+    if reflink(src, dst):
+        shutil.copystat(src, dst)
+        return "reflink"
+    if is_weight_file(src):
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS | {errno.EMLINK}:
+                raise
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def copy_model_tree(src: str, dst: str, full_copy: bool = False) -> None:
+    """Copy a model directory, linking the weight files unless full_copy is set"""
+    shutil.copytree(
+        src,
+        dst,
+        copy_function=shutil.copy2 if full_copy else link_or_copy_file,
+    )
+
+
+def save_replacing_files(save: Callable[[str], None], directory: str) -> None:
+    """
+    Run save (e.g. save_pretrained) into a staging directory, then rename the files
+    it wrote into directory. Renaming replaces a hardlinked file instead of writing
+    through it, so the models it is shared with keep their copy, and the files left
+    alone are never copied.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Inside directory so the renames stay on the same filesystem
+    staging = tempfile.mkdtemp(prefix=".save-", dir=directory)
+    try:
+        save(staging)
+        for root, _, files in os.walk(staging):
+            target = os.path.join(directory, os.path.relpath(root, staging))
+            os.makedirs(target, exist_ok=True)
+            for name in files:
+                os.replace(os.path.join(root, name), os.path.join(target, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
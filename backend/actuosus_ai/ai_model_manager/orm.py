@@ -1,9 +1,25 @@
+import functools
+import logging
+import sqlite3
+from contextlib import closing
 from datetime import datetime
 
-from sqlalchemy import Integer, String, DateTime
+from sqlalchemy import (
+    Connection,
+    DateTime,
+    Index,
+    Integer,
+    String,
+    func,
+    inspect,
+    literal_column,
+    text,
+)
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 
+logger = logging.getLogger(__name__)
+
 
 class BaseORM(DeclarativeBase):
     pass
@@ -11,6 +27,13 @@ class BaseORM(DeclarativeBase):
 
 class AIModelORM(BaseORM):
     __tablename__ = "ai_model"
+    # Every ordering ends with ai_model_id so keyset pagination can use the index
+    __table_args__ = (
+        Index("ix_ai_model_name_id", "name", "ai_model_id"),
+        Index("ix_ai_model_pipeline_tag", "pipeline_tag"),
+        Index("ix_ai_model_created_at_id", "created_at", "ai_model_id"),
+        Index("ix_ai_model_updated_at_id", "updated_at", "ai_model_id"),
+    )
     ai_model_id: Mapped[int] = mapped_column(Integer, primary_key=True)
     name: Mapped[str] = mapped_column(String(30), nullable=False)
     pipeline_tag: Mapped[str] = mapped_column(String(30), nullable=False)
@@ -23,3 +46,105 @@ class AIModelORM(BaseORM):
     @hybrid_property
     def id(self) -> int:
         return self.ai_model_id
+
+
+# Full text indexes used by the name search of MySQL and Postgres
+Index("ix_ai_model_name_fulltext", AIModelORM.name, mysql_prefix="FULLTEXT").ddl_if(
+    dialect="mysql"
+)
+Index(
+    "ix_ai_model_name_tsvector",
+    func.to_tsvector(literal_column("'simple'"), AIModelORM.name),
+    postgresql_using="gin",
+).ddl_if(dialect="postgresql")
+
+# SQLite name search: a trigram FTS5 index over ai_model.name, kept in sync by triggers
+AI_MODEL_FTS_TABLE = "ai_model_fts"
+_SQLITE_FTS_TRIGGERS = [
+    f"{AI_MODEL_FTS_TABLE}_insert",
+    f"{AI_MODEL_FTS_TABLE}_delete",
+    f"{AI_MODEL_FTS_TABLE}_update",
+]
+# The trigram tokenizer needs SQLite 3.34 built with FTS5
+_FTS5_TRIGRAM_PROBE = "CREATE VIRTUAL TABLE probe USING fts5(name, tokenize='trigram')"
+_SQLITE_FTS_DDL = [
+    f"""CREATE TRIGGER IF NOT EXISTS {AI_MODEL_FTS_TABLE}_insert AFTER INSERT ON ai_model
+    BEGIN
+        INSERT INTO {AI_MODEL_FTS_TABLE}(rowid, name) VALUES (new.ai_model_id, new.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {AI_MODEL_FTS_TABLE}_delete AFTER DELETE ON ai_model
+    BEGIN
+        INSERT INTO {AI_MODEL_FTS_TABLE}({AI_MODEL_FTS_TABLE}, rowid, name)
+        VALUES ('delete', old.ai_model_id, old.name);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {AI_MODEL_FTS_TABLE}_update AFTER UPDATE OF name ON ai_model
+    BEGIN
+        INSERT INTO {AI_MODEL_FTS_TABLE}({AI_MODEL_FTS_TABLE}, rowid, name)
+        VALUES ('delete', old.ai_model_id, old.name);
+        INSERT INTO {AI_MODEL_FTS_TABLE}(rowid, name) VALUES (new.ai_model_id, new.name);
+    END""",
+]
+
+
+@functools.lru_cache(maxsize=None)
+def sqlite_has_fts5_trigram() -> bool:
+    """
+    Whether the SQLite linked into Python has the FTS5 trigram tokenizer, without
+    it model names are searched with LIKE
+    """
+    try:
+        with closing(sqlite3.connect(":memory:")) as probe:
+            probe.execute(_FTS5_TRIGRAM_PROBE)
+    except sqlite3.Error as e:
+        logger.warning(
+            "SQLite %s can not index model names (%s), searching them with LIKE",
+            sqlite3.sqlite_version,
+            e,
+        )
+        return False
+    return True
+
+
+def create_schema(conn: Connection) -> None:
+    """
+    Create the tables, and the indexes and search tables an older database is
+    missing, create_all only adds indexes together with a new table
+    """
+    BaseORM.metadata.create_all(conn)
+    inspector = inspect(conn)
+    for table in BaseORM.metadata.sorted_tables:
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn, checkfirst=True)
+
+    if conn.dialect.name != "sqlite":
+        return
+    if not sqlite_has_fts5_trigram():
+        # Triggers left by an SQLite with FTS5 would make every write fail
+        for name in _SQLITE_FTS_TRIGGERS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        return
+    triggers = set(
+        conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        ).scalars()
+    )
+    has_table = inspector.has_table(AI_MODEL_FTS_TABLE)
+    if not has_table:
+        conn.execute(
+            text(
+                f"CREATE VIRTUAL TABLE {AI_MODEL_FTS_TABLE} USING fts5(name, "
+                "content='ai_model', content_rowid='ai_model_id', tokenize='trigram')"
+            )
+        )
+    if not has_table or not triggers.issuperset(_SQLITE_FTS_TRIGGERS):
+        # Index the rows saved while the search table was missing or not kept in sync
+        conn.execute(
+            text(
+                f"INSERT INTO {AI_MODEL_FTS_TABLE}({AI_MODEL_FTS_TABLE}) "
+                "VALUES ('rebuild')"
+            )
+        )
+    for ddl in _SQLITE_FTS_DDL:
+        conn.execute(text(ddl))
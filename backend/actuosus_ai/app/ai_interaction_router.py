@@ -1,12 +1,10 @@
+import logging
 from typing import Tuple, List, Optional, Dict
-import gc
-import torch
 from fastapi import APIRouter, WebSocket, Depends, WebSocketDisconnect
 from pydantic import BaseModel
-from sympy.physics.units import temperature
 
 from actuosus_ai.ai_interaction.chat_websocket_orchestrator import (
-    ChatWebSocketOrchestrator, ResponseTypeId, ChatResponse, ModelInfo,
+    ChatWebSocketOrchestrator, ResponseTypeId, ChatResponse, ModelInfo, ChatProtocol,
 )
 from actuosus_ai.ai_interaction.text_generation_service import TextGenerationService
 from actuosus_ai.app.dependency import (
@@ -14,6 +12,9 @@ from actuosus_ai.app.dependency import (
     get_ai_chat_service,
     get_chat_websocket_orchestrator,
 )
+from actuosus_ai.common.actuosus_exception import InsufficientMemoryException
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -47,37 +48,45 @@ async def websocket_chat_endpoint(
     ai_model_id: int,
     quantization: Optional[str] = "float16",
     gguf_file_name: Optional[str] = None,
+    protocol: str = ChatProtocol.JSON.value,
     chat_websocket_orchestrator: ChatWebSocketOrchestrator = Depends(
         get_chat_websocket_orchestrator
     ),
 ) -> None:
     await websocket.accept()
-    # Receive onopen info about how to load the model
-    await chat_websocket_orchestrator.load(
-        chat_type=chat_type,
-        websocket=websocket,
-        ai_model_id=ai_model_id,
-        quantization=quantization,
-        gguf_file_name=gguf_file_name,
-    )
-    await websocket.send_json(
-        ChatResponse(
-            type_id=ResponseTypeId.MODEL_INFO,
-             payload=ModelInfo(
-                ai_model_name=chat_websocket_orchestrator.chat_service.ai_model_name,
-                estimated_ram=chat_websocket_orchestrator.chat_service.estimated_ram,
-                estimated_vram=chat_websocket_orchestrator.chat_service.estimated_vram,
-                max_length=chat_websocket_orchestrator.chat_service.max_length,
-                temperature=chat_websocket_orchestrator.temperature,
-                max_new_tokens=chat_websocket_orchestrator.max_new_tokens,
-             )
-        ).model_dump()
-    )
     try:
+        # Receive onopen info about how to load the model, progress is sent while loading
+        await chat_websocket_orchestrator.load(
+            chat_type=chat_type,
+            websocket=websocket,
+            ai_model_id=ai_model_id,
+            quantization=quantization,
+            gguf_file_name=gguf_file_name,
+            protocol=protocol,
+        )
+        await websocket.send_json(
+            ChatResponse(
+                type_id=ResponseTypeId.MODEL_INFO,
+                 payload=ModelInfo(
+                    ai_model_name=chat_websocket_orchestrator.chat_service.ai_model_name,
+                    estimated_ram=chat_websocket_orchestrator.chat_service.estimated_ram,
+                    estimated_vram=chat_websocket_orchestrator.chat_service.estimated_vram,
+                    max_length=chat_websocket_orchestrator.chat_service.max_length,
+                    temperature=chat_websocket_orchestrator.temperature,
+                    max_new_tokens=chat_websocket_orchestrator.max_new_tokens,
+                 )
+            ).model_dump()
+        )
+        if chat_websocket_orchestrator.protocol == ChatProtocol.BINARY:
+            # Binary token frames refer to the vocabulary by token id
+            await chat_websocket_orchestrator.send_vocabulary()
         await chat_websocket_orchestrator.run()
+    except InsufficientMemoryException as e:
+        # The client can try again once other sessions have released their models
+        await websocket.send_json(ChatResponse(type_id=ResponseTypeId.ERROR, payload=str(e)).model_dump())
+        await websocket.close(code=1013)
     except WebSocketDisconnect:
-        del chat_websocket_orchestrator.chat_service.text_generation_service.model
-        gc.collect()
-        if torch.cuda.is_available():
-            torch.cuda.empty_cache()
-        print(f"Client disconnected for item: {ai_model_id}")
+        logger.info("Client disconnected for item: %s", ai_model_id)
+    finally:
+        # However the session ends, the model stays in the registry for the next one
+        chat_websocket_orchestrator.text_generation_service.unload_model()
@@ -1,12 +1,31 @@
+import asyncio
 from datetime import datetime
-from typing import Optional, List
+from typing import AsyncIterator, Optional, List
 
 from fastapi import APIRouter, Depends
+from starlette.responses import Response, StreamingResponse
 
+from actuosus_ai.ai_interaction.inference_metrics import record_process_memory
+from actuosus_ai.ai_interaction.memory_estimator import (
+    MemoryEstimate,
+    estimate_model_memory,
+)
+from actuosus_ai.ai_interaction.model_memory import ProcessMemory, process_memory
+from actuosus_ai.ai_interaction.model_registry import (
+    LoadedModel,
+    ModelRegistry,
+    get_model_registry,
+)
 from actuosus_ai.ai_model_manager.ai_model_download_service import (
     AIModelDownloadService,
 )
 from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
+from actuosus_ai.ai_model_manager.download_manager import (
+    DownloadManager,
+    get_download_manager,
+)
+from actuosus_ai.ai_model_manager.download_progress import DownloadJob
+from actuosus_ai.ai_model_manager.dto import FileSelectionDTO, RemoteFileDTO
 from actuosus_ai.app.dependency import (
     get_ai_download_service,
     get_ai_model_storage_service,
@@ -14,6 +33,9 @@ from actuosus_ai.app.dependency import (
 from pydantic import BaseModel
 
 from actuosus_ai.common.actuosus_exception import NotFoundException
+from actuosus_ai.common.metrics import metrics_registry
+from actuosus_ai.common.settings import Settings, get_settings
+from actuosus_ai.common.utils import gpu_available
 
 router = APIRouter()
 
@@ -23,23 +45,123 @@ class StandardResponse(BaseModel):
     message: str
 
 
-class DownloadHFModelRequest(BaseModel):
+class DownloadHFModelRequest(FileSelectionDTO):
     hf_model_id: str
 
 
+class DownloadJobResponse(StandardResponse):
+    job: DownloadJob
+
+
 @router.post("/download/hf_lang_model/")
 async def download_ai_model(
     request: DownloadHFModelRequest,
-    download_ai_model_service: AIModelDownloadService = Depends(
-        get_ai_download_service
+    download_manager: DownloadManager = Depends(get_download_manager),
+) -> DownloadJobResponse:
+    """
+    Start downloading a Language Model based on it's name (id) in the background,
+    only the files matching include, exclude and files when given. Follow the
+    returned job at /download/jobs/{job_id}/
+    """
+    job = download_manager.start(
+        request.hf_model_id,
+        FileSelectionDTO(**request.model_dump(exclude={"hf_model_id"})),
+    )
+
+    return DownloadJobResponse(success=True, message="Model download started", job=job)
+
+
+class GetDownloadJobsResponse(BaseModel):
+    jobs: List[DownloadJob]
+
+
+@router.get("/download/jobs/")
+async def get_download_jobs(
+    download_manager: DownloadManager = Depends(get_download_manager),
+) -> GetDownloadJobsResponse:
+    """
+    Get the running and recently finished download jobs
+    """
+    return GetDownloadJobsResponse(jobs=download_manager.jobs())
+
+
+@router.get("/download/jobs/{job_id}/")
+async def get_download_job(
+    job_id: str,
+    download_manager: DownloadManager = Depends(get_download_manager),
+) -> DownloadJob:
+    """
+    Get the progress of a download job
+    """
+    job = download_manager.get(job_id)
+    if not job:
+        raise NotFoundException("Download job not found")
+    return job
+
+
+@router.post("/download/jobs/{job_id}/cancel/")
+async def cancel_download_job(
+    job_id: str,
+    download_manager: DownloadManager = Depends(get_download_manager),
+) -> DownloadJobResponse:
+    """
+    Cancel a queued or running download job and remove its partial files, the job
+    ends with the cancelled status
+    """
+    job = download_manager.cancel(job_id)
+    if not job:
+        raise NotFoundException("Download job not found")
+    return DownloadJobResponse(
+        success=True, message="Model download cancelled", job=job
+    )
+
+
+@router.get("/download/jobs/{job_id}/events/")
+async def stream_download_job(
+    job_id: str,
+    download_manager: DownloadManager = Depends(get_download_manager),
+) -> StreamingResponse:
+    """
+    Stream the progress of a download job as server-sent events until it finishes
+    """
+    if not download_manager.get(job_id):
+        raise NotFoundException("Download job not found")
+
+    async def events() -> AsyncIterator[str]:
+        async for job in download_manager.events(job_id):
+            yield f"data: {job.model_dump_json()}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+class AddModelFilesRequest(FileSelectionDTO):
+    # The repo to download from, the model's name when not set
+    hf_model_id: Optional[str] = None
+
+
+@router.post("/model/{ai_model_id}/files/")
+async def add_model_files(
+    ai_model_id: int,
+    request: AddModelFilesRequest,
+    ai_model_storage_service: AIModelStorageService = Depends(
+        get_ai_model_storage_service
     ),
-) -> StandardResponse:
+    download_manager: DownloadManager = Depends(get_download_manager),
+) -> DownloadJobResponse:
     """
-    Download a Language Model based on it's name (id)
+    Start downloading more files of a model's repo into the model in the background,
+    the files it already has are not downloaded again
     """
-    await download_ai_model_service.download_lm_from_hugging_face(request.hf_model_id)
+    dto = await ai_model_storage_service.get_model_by_id(ai_model_id)
+    if not dto:
+        raise NotFoundException("Model not found")
+    job = download_manager.start(
+        request.hf_model_id or dto.name,
+        FileSelectionDTO(**request.model_dump(exclude={"hf_model_id"})),
+        ai_model_id,
+    )
 
-    return StandardResponse(success=True, message="Model downloaded successfully")
+    return DownloadJobResponse(success=True, message="Model download started", job=job)
 
 
 class EditModelRequest(BaseModel):
@@ -73,14 +195,15 @@ async def edit_model(
 @router.post("/model/{ai_model_id}/copy/")
 async def copy_model(
     ai_model_id: int,
+    full_copy: bool = False,
     ai_model_storage_service: AIModelStorageService = Depends(
         get_ai_model_storage_service
     ),
 ) -> StandardResponse:
     """
-    Copy a model based on it's id
+    Copy a model based on it's id, the copy shares the weight files unless full_copy
     """
-    await ai_model_storage_service.copy_model_by_id(ai_model_id)
+    await ai_model_storage_service.copy_model_by_id(ai_model_id, full_copy)
 
     return StandardResponse(success=True, message="Model copied successfully")
 
@@ -106,10 +229,14 @@ class ModelDetails(BaseModel):
     pipeline_tag: str
     created_at: datetime
     updated_at: datetime
+    # Predicted memory of every way the model can be loaded, only when asked for
+    memory_estimates: Optional[List[MemoryEstimate]] = None
 
 
 class GetModelResponse(BaseModel):
     models: List[ModelDetails]
+    # Pass as cursor to get the next page, None on the last page
+    next_cursor: Optional[str] = None
 
 
 @router.get("/models/")
@@ -120,18 +247,89 @@ async def get_models(
     pipeline_tag: Optional[str] = None,
     order_by: Optional[str] = None,
     is_desc: Optional[bool] = True,
+    cursor: Optional[str] = None,
+    include_memory_estimates: bool = False,
     ai_model_storage_service: AIModelStorageService = Depends(
         get_ai_model_storage_service
     ),
+    settings: Settings = Depends(get_settings),
 ) -> GetModelResponse:
     """
-    Get models
+    Get models, page with limit and the next_cursor of the previous response. With
+    include_memory_estimates, each model comes with the predicted memory of its
+    quantizations and GGUF files, which reads the headers of every weight file.
     """
     dtos = await ai_model_storage_service.get_models(
-        limit, offset, name, pipeline_tag, order_by, is_desc
+        limit, offset, name, pipeline_tag, order_by, is_desc, cursor
+    )
+    next_cursor = None
+    if limit and len(dtos) == limit:
+        next_cursor = ai_model_storage_service.encode_cursor(dtos[-1], order_by)
+    if not include_memory_estimates:
+        return GetModelResponse(
+            models=[ModelDetails(**dto.model_dump()) for dto in dtos],
+            next_cursor=next_cursor,
+        )
+
+    gpu = await asyncio.to_thread(gpu_available)
+    # Only the headers of the weight files are read
+    estimates = await asyncio.gather(
+        *(
+            asyncio.to_thread(
+                estimate_model_memory,
+                dto.storage_path,
+                gpu,
+                settings.kv_cache_estimate_tokens,
+            )
+            for dto in dtos
+        )
+    )
+    return GetModelResponse(
+        models=[
+            ModelDetails(**dto.model_dump(), memory_estimates=memory_estimates)
+            for dto, memory_estimates in zip(dtos, estimates)
+        ],
+        next_cursor=next_cursor,
+    )
+
+
+class GetLoadedModelsResponse(BaseModel):
+    models: List[LoadedModel]
+    ram_budget_gb: Optional[float]
+    vram_budget_gb: Optional[float]
+    # Model states cached by the sessions, counted against the budgets
+    state_cache_ram_bytes: int
+    state_cache_vram_bytes: int
+    process: ProcessMemory
+
+
+@router.get("/models/loaded/")
+async def get_loaded_models(
+    model_registry: ModelRegistry = Depends(get_model_registry),
+) -> GetLoadedModelsResponse:
+    """
+    Get the models kept loaded in memory, least recently used first, with the
+    memory of the whole process
+    """
+    return GetLoadedModelsResponse(
+        models=model_registry.loaded_models(),
+        ram_budget_gb=model_registry.ram_budget_gb,
+        vram_budget_gb=model_registry.vram_budget_gb,
+        state_cache_ram_bytes=model_registry.state_budget.ram_bytes,
+        state_cache_vram_bytes=model_registry.state_budget.vram_bytes,
+        # Reading the proportional set size walks the process' memory maps
+        process=await asyncio.to_thread(process_memory),
     )
 
-    return GetModelResponse(models=[ModelDetails(**dto.model_dump()) for dto in dtos])
+
+@router.get("/metrics")
+async def get_metrics() -> Response:
+    """
+    Get the inference latency, session and loaded model metrics in the Prometheus
+    text format
+    """
+    record_process_memory(await asyncio.to_thread(process_memory))
+    return Response(metrics_registry.render(), media_type=metrics_registry.CONTENT_TYPE)
 
 
 class SearchHuggingFaceResponse(BaseModel):
@@ -154,6 +352,27 @@ async def search_hugging_face(
     return SearchHuggingFaceResponse(ai_model_names=ai_model_names)
 
 
+class HuggingFaceFilesResponse(BaseModel):
+    files: List[RemoteFileDTO]
+    total_size: int
+
+
+@router.get("/huggingface/files/{hf_model_id:path}/")
+async def get_hugging_face_files(
+    hf_model_id: str,
+    download_ai_model_service: AIModelDownloadService = Depends(
+        get_ai_download_service
+    ),
+) -> HuggingFaceFilesResponse:
+    """
+    Get the files of a Hugging Face model with their sizes, to pick before downloading
+    """
+    files = await download_ai_model_service.list_remote_files(hf_model_id)
+    return HuggingFaceFilesResponse(
+        files=files, total_size=sum(file.size or 0 for file in files)
+    )
+
+
 class GGUFFileNamesResponse(BaseModel):
     gguf_file_names: List[str]
 
@@ -5,11 +5,13 @@ from actuosus_ai.ai_interaction.ai_chat_service import AIChatService
 from actuosus_ai.ai_interaction.chat_websocket_orchestrator import (
     ChatWebSocketOrchestrator,
 )
+from actuosus_ai.ai_interaction.model_registry import ModelRegistry, get_model_registry
 from actuosus_ai.ai_interaction.text_generation_service import TextGenerationService
 from actuosus_ai.ai_model_manager.ai_model_download_service import (
     AIModelDownloadService,
 )
 from actuosus_ai.ai_model_manager.connection import get_async_db_session
+from actuosus_ai.ai_model_manager.hub_client import CachedHubClient, get_hub_client
 from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
 from actuosus_ai.common.settings import get_settings, Settings
 
@@ -26,16 +28,23 @@ def get_ai_download_service(
         get_ai_model_storage_service
     ),
     settings: Settings = Depends(get_settings),
+    hub_client: CachedHubClient = Depends(get_hub_client),
 ) -> AIModelDownloadService:
-    return AIModelDownloadService(ai_model_storage_service, settings=settings)
+    return AIModelDownloadService(
+        ai_model_storage_service, settings=settings, hub_client=hub_client
+    )
 
 
 def get_text_generation_service(
     ai_model_storage_service: AIModelStorageService = Depends(
         get_ai_model_storage_service
     ),
+    settings: Settings = Depends(get_settings),
+    model_registry: ModelRegistry = Depends(get_model_registry),
 ) -> TextGenerationService:
-    return TextGenerationService(ai_model_storage_service)
+    return TextGenerationService(
+        ai_model_storage_service, settings=settings, model_registry=model_registry
+    )
 
 
 def get_ai_chat_service(
@@ -1,3 +1,7 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 import uvicorn
 from starlette.middleware.cors import CORSMiddleware
@@ -5,8 +9,25 @@ from starlette.middleware.cors import CORSMiddleware
 from actuosus_ai.app.ai_router import router as ai_router
 from actuosus_ai.app.ai_interaction_router import router as ai_interaction_router
 from actuosus_ai.app.exception_handler import CustomExceptionMiddleware
+from actuosus_ai.ai_model_manager.connection import dispose_engines, init_db
+from actuosus_ai.ai_model_manager.hub_client import login_to_hub
+from actuosus_ai.common.settings import get_settings
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    settings = get_settings()
+    # The app serves requests while the hub login waits on the network,
+    # login_to_hub logs its own failure
+    app.state.hub_login = asyncio.get_running_loop().run_in_executor(
+        None, login_to_hub, settings.huggingface_token
+    )
+    await init_db(settings)
+    yield
+    await dispose_engines()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.include_router(ai_router)
 app.include_router(ai_interaction_router)
 
@@ -24,3 +24,11 @@ class InternalException(ActuosusException):
 
 class UnknownException(ActuosusException):
     pass
+
+
+class CancelledException(ActuosusException):
+    pass
+
+
+class InsufficientMemoryException(ActuosusException):
+    pass
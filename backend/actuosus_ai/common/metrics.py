@@ -0,0 +1,220 @@
+import bisect
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple, TypeVar
+
+# Seconds, from a fast token step to a slow model load
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+
+    def _labels_text(self, label_values: Tuple[str, ...], *extra: str) -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.label_names, label_values)
+        ]
+        pairs += list(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _check_labels(self, label_values: Tuple[str, ...]) -> Tuple[str, ...]:
+        if len(label_values) != len(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}")
+        return tuple(str(value) for value in label_values)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class _HistogramChild:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram(_Metric):
+    """Counts of observed values per bucket, with their sum"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], _HistogramChild] = {}
+
+    def labels(self, *label_values: str) -> _HistogramChild:
+        key = self._check_labels(label_values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, _HistogramChild(self.buckets))
+        return child
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            children = list(self._children.items())
+        for label_values, child in children:
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{self._labels_text(label_values, le)} {cumulative}"
+                )
+            labels = self._labels_text(label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class _GaugeChild:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.inc(-amount)
+
+
+class Gauge(_Metric):
+    """A value that goes up and down"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        super().__init__(name, documentation, label_names)
+        self._children: Dict[Tuple[str, ...], _GaugeChild] = {}
+
+    def labels(self, *label_values: str) -> _GaugeChild:
+        key = self._check_labels(label_values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, _GaugeChild())
+        return child
+
+    def remove(self, *label_values: str) -> None:
+        with self._lock:
+            self._children.pop(self._check_labels(label_values), None)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            children = list(self._children.items())
+        for label_values, child in children:
+            lines.append(
+                f"{self.name}{self._labels_text(label_values)} {_format_value(child.value)}"
+            )
+        return lines
+
+
+M = TypeVar("M", bound=_Metric)
+
+
+class MetricsRegistry:
+    """
+    Metrics exported in the Prometheus text format. Only what the app records is
+    implemented, so the server does not need prometheus_client.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def gauge(
+        self, name: str, documentation: str, label_names: Sequence[str] = ()
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def _register(self, metric: M) -> M:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
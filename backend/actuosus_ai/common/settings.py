@@ -1,7 +1,6 @@
 from typing import Optional
 
 from dotenv import load_dotenv
-from huggingface_hub import login
 from pydantic_settings import BaseSettings
 
 
@@ -10,6 +9,35 @@ class Settings(BaseSettings):
     base_file_storage_path: str
     debug_mode: bool
     huggingface_token: Optional[str] = None
+    # Memory budget for the model state (KV cache) snapshots of every session together
+    model_state_cache_mb: int = 512
+    # Loaded models are kept after their last session until these budgets (GB) are exceeded
+    model_registry_ram_budget_gb: Optional[float] = None
+    model_registry_vram_budget_gb: Optional[float] = None
+    # Loads estimated to go over the budgets wait this long for models in use to be
+    # released before being rejected
+    model_admission_timeout: float = 300.0
+    # Tokens of KV cache the memory estimate of HF models counts, since their cache
+    # grows with the conversation. 0 counts their whole context length, which is
+    # tens of GB for long context models. GGUF models always get their whole context.
+    kv_cache_estimate_tokens: int = 4096
+    # Database connection pool shared by every request
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    db_pool_recycle: int = 1800
+    # Model downloads running at once, and the parallel range requests of each file
+    max_concurrent_downloads: int = 2
+    download_parallel_chunks: int = 4
+    download_chunk_mb: int = 16
+    # Hugging Face search and model info results are cached for this many seconds
+    hub_cache_ttl: float = 300
+    hub_cache_size: int = 256
+    # Read the weight files once before a model load so that the load reads them
+    # from the page cache. Turn off where the files are on fast local storage.
+    read_ahead_weights: bool = True
+    # Chrome traces of profiled generations, under the file storage path by default
+    profile_trace_dir: Optional[str] = None
 
     class Config:
         env_file = ".env"
@@ -17,10 +45,6 @@ class Settings(BaseSettings):
 
 load_dotenv(override=True)
 settings = Settings()  # type: ignore
-try:
-    login(settings.huggingface_token)
-except ValueError:
-    pass
 
 
 def get_settings() -> Settings:
@@ -1,6 +1,7 @@
-from typing import List, Dict
+import os
+import threading
+from typing import List, Dict, Optional
 
-import psutil
 from jinja2 import Environment, BaseLoader, TemplateSyntaxError
 
 try:
@@ -12,37 +13,50 @@ except ImportError:
     pynvml_available = False
 
 
-def get_memory_footprint() -> tuple[float, float]:
-    # Initialize pynvml to interact with NVIDIA GPUs if available
-    if pynvml_available:
-        try:
-            pynvml.nvmlInit()
-            gpu_available = True
-        except pynvml.NVMLError:
-            gpu_available = False
-    else:
-        gpu_available = False
-
-    # Get system RAM usage
-    ram_info = psutil.virtual_memory()
-    used_ram_gb = ram_info.used / (1024**3)  # Convert bytes to GB
-
-    # Check for GPU availability
-    if gpu_available:
-        # Get VRAM usage for all detected GPUs
-        total_vram_used_gb = 0
-        device_count = pynvml.nvmlDeviceGetCount()
-
-        for i in range(device_count):
-            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
-            vram_info = pynvml.nvmlDeviceGetMemoryInfo(handle)
-            total_vram_used_gb += vram_info.used / (1024**3)  # Convert bytes to GB
-    else:
-        total_vram_used_gb = (
-            0  # Return 0 if no GPU is available or pynvml is not installed
-        )
-
-    return used_ram_gb, total_vram_used_gb
+_nvml_initialized: Optional[bool] = None
+_nvml_lock = threading.Lock()
+
+
+def init_nvml() -> bool:
+    """Initialize NVML once, returns whether NVIDIA GPUs can be queried"""
+    global _nvml_initialized
+    with _nvml_lock:
+        if _nvml_initialized is None:
+            _nvml_initialized = False
+            if pynvml_available:
+                try:
+                    pynvml.nvmlInit()
+                    _nvml_initialized = True
+                except pynvml.NVMLError:
+                    pass
+        return _nvml_initialized
+
+
+def gpu_available() -> bool:
+    """Whether NVML sees an NVIDIA GPU, without importing torch"""
+    if not init_nvml():
+        return False
+    try:
+        return bool(pynvml.nvmlDeviceGetCount())
+    except pynvml.NVMLError:
+        return False
+
+
+def process_vram_bytes() -> int:
+    """VRAM used by this process on every NVIDIA GPU, 0 without NVML"""
+    if not init_nvml():
+        return 0
+    pid = os.getpid()
+    used = 0
+    try:
+        for index in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+            for process in pynvml.nvmlDeviceGetComputeRunningProcesses(handle):
+                if process.pid == pid and process.usedGpuMemory:
+                    used += process.usedGpuMemory
+    except pynvml.NVMLError:
+        pass
+    return used
 
 
 eot_tokens = [
@@ -0,0 +1,342 @@
+"""
+Benchmark of the generation hot paths on CPU with tiny random models, offline: the
+top-k sampler, the HF and GGUF generation loops, the message trie and the chat
+orchestrator's websocket send path.
+
+Run from the backend directory with: python -m benchmarks.bench_hot_paths
+Save a baseline with --save benchmarks/baseline.json and check a later run against
+it with --compare benchmarks/baseline.json, the exit status is 1 when a metric got
+worse by more than --tolerance. Timings depend on the machine, so compare against a
+baseline taken on the same one.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List
+
+import torch
+
+from actuosus_ai.ai_interaction.chat_websocket_orchestrator import (
+    ChatProtocol,
+    ChatType,
+    ChatWebSocketOrchestrator,
+    TimedWebSocket,
+)
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer, TokenWordProbList
+from actuosus_ai.ai_interaction.inference_scheduler import InferenceScheduler
+from actuosus_ai.ai_interaction.model_registry import ModelRegistry
+from actuosus_ai.ai_interaction.sampling import sample_top_k
+from actuosus_ai.ai_interaction.text_generation_service import TextGenerationService
+from actuosus_ai.common.message_trie import Message, MessageTrie
+from actuosus_ai.common.settings import get_settings
+from benchmarks.fixtures import write_tiny_gguf, write_tiny_hf_model
+
+Results = Dict[str, Dict[str, float]]
+
+PROMPT = "the quick brown fox jumps over the lazy dog and keeps running "
+
+
+def lower_is_better(metric: str) -> bool:
+    """Rates are higher is better, latencies and sizes lower is better"""
+    return not metric.endswith("_per_s")
+
+
+def time_per_call(function: Callable[[], object], iterations: int) -> float:
+    for _ in range(3):
+        function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+
+def bench_sampler(iterations: int) -> Dict[str, float]:
+    torch.manual_seed(0)
+    # Peaked logits like a real model over GPT-2's vocabulary
+    logits = torch.randn(8, 50257) * 4
+    single = time_per_call(lambda: sample_top_k(logits[:1], 10, 1.0, 0.001), iterations)
+    batched = time_per_call(lambda: sample_top_k(logits, 10, 1.0, 0.001), iterations)
+    return {"calls_per_s": 1 / single, "batch_rows_per_s": len(logits) / batched}
+
+
+def _generation(service: TextGenerationService, max_new_tokens: int) -> Iterator[Any]:
+    return service.generate_tokens_with_probabilities(
+        PROMPT, max_new_tokens=max_new_tokens, k=10, min_prob=0.0
+    )
+
+
+def measure_generation(
+    service: TextGenerationService, runs: int, max_new_tokens: int
+) -> Dict[str, float]:
+    """Median time to first token and decode rate, without cached prompt states"""
+    ttfts, rates = [], []
+    for run in range(runs + 1):
+        service.state_cache.clear()
+        start = time.perf_counter()
+        first = last = 0.0
+        tokens = 0
+        for _ in _generation(service, max_new_tokens):
+            last = time.perf_counter()
+            first = first or last
+            tokens += 1
+        # The first run warms up
+        if run and tokens > 1:
+            ttfts.append(first - start)
+            rates.append((tokens - 1) / (last - first))
+    return {
+        "ttft_ms": statistics.median(ttfts) * 1000,
+        "tokens_per_s": statistics.median(rates),
+    }
+
+
+def _service(model: Any, tokenizer: Any, gguf: bool) -> TextGenerationService:
+    service = TextGenerationService(
+        None,  # type: ignore[arg-type]
+        get_settings(),
+        ModelRegistry(),
+    )
+    service.model = model
+    service.tokenizer = tokenizer
+    service.gguf = gguf
+    service.scheduler = InferenceScheduler(model, tokenizer, gguf)
+    service.detokenizer = service.scheduler.detokenizer
+    service.device = service.scheduler.device
+    service.metric_labels = ("tiny", "gguf" if gguf else "none")
+    return service
+
+
+def bench_hf_generation(
+    directory: str, runs: int, max_new_tokens: int
+) -> Dict[str, float]:
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    start = time.perf_counter()
+    model = AutoModelForCausalLM.from_pretrained(directory).eval()
+    tokenizer = AutoTokenizer.from_pretrained(directory)
+    service = _service(model, tokenizer, gguf=False)
+    load_ms = (time.perf_counter() - start) * 1000
+    # Random weights may sample the end of text token, generation must not stop on it
+    assert service.scheduler
+    service.scheduler.tokenizer = SimpleNamespace(eos_token_id=-1)
+    try:
+        return {
+            "load_ms": load_ms,
+            **measure_generation(service, runs, max_new_tokens),
+        }
+    finally:
+        assert service.scheduler
+        service.scheduler.close()
+
+
+def bench_gguf_generation(
+    path: str, runs: int, max_new_tokens: int
+) -> Dict[str, float]:
+    from llama_cpp import Llama
+
+    start = time.perf_counter()
+    model = Llama(model_path=path, n_ctx=0, verbose=False)
+    service = _service(model, model.tokenizer(), gguf=True)
+    load_ms = (time.perf_counter() - start) * 1000
+    # Random weights may sample the end of sequence token, generation must not stop on it
+    model.token_eos = lambda: -1  # type: ignore[method-assign]
+    try:
+        return {
+            "load_ms": load_ms,
+            **measure_generation(service, runs, max_new_tokens),
+        }
+    finally:
+        assert service.scheduler
+        service.scheduler.close()
+
+
+def conversations(count: int, length: int) -> List[List[Message]]:
+    """Branching chats, each shares a prompt and part of the reply with the previous"""
+    chats: List[List[Message]] = []
+    for chat in range(count):
+        reply: List[Any] = [
+            [(f"w{(chat // 2) * 7 + step}", 0.5)] + [(f"a{i}", 0.05) for i in range(9)]
+            for step in range(length)
+        ]
+        if chat % 2:
+            reply[length // 2] = [(f"branch{chat}", 0.4)]
+        chats.append(
+            [
+                {"content": [f"question {chat // 4}"], "source": "user"},
+                {"content": reply, "source": "ai"},
+            ]
+        )
+    return chats
+
+
+def bench_trie(count: int, length: int) -> Dict[str, float]:
+    chats = conversations(count, length)
+    # Look each chat up by its prompt and the start of its reply
+    queries: List[List[Message]] = [
+        [chat[0], {"content": chat[1]["content"][:4], "source": "ai"}] for chat in chats
+    ]
+
+    def insert() -> MessageTrie:
+        trie = MessageTrie()  # type: ignore[no-untyped-call]
+        for chat in chats:
+            trie.insert(chat)
+        return trie
+
+    trie = insert()
+    insert_time = time_per_call(insert, 5)
+    search_time = time_per_call(
+        lambda: [trie.search_and_return(query) for query in queries], 5
+    )
+    serialized = trie.serialize()
+    serialize_time = time_per_call(trie.serialize, 5)
+    return {
+        "insert_ops_per_s": count / insert_time,
+        "search_ops_per_s": count / search_time,
+        "serialize_ops_per_s": 1 / serialize_time,
+        "serialized_bytes": len(serialized.encode()),
+    }
+
+
+class CountingWebSocket:
+    """Stands in for the client socket, serializes frames like starlette"""
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self.bytes = 0
+
+    async def send_json(self, data: Any) -> None:
+        text = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+        self.frames += 1
+        self.bytes += len(text.encode())
+
+    async def send_bytes(self, data: bytes) -> None:
+        self.frames += 1
+        self.bytes += len(data)
+
+
+async def bench_send_path(tokens: int, runs: int) -> Dict[str, float]:
+    vocabulary = [f" word{token}" for token in range(32000)]
+    items = [
+        TokenWordProbList(
+            [(vocabulary[(step * 10 + i) % 32000], 0.5 - i / 20) for i in range(10)],
+            [(step * 10 + i) % 32000 for i in range(10)],
+        )
+        for step in range(tokens)
+    ]
+    generation = SimpleNamespace(
+        detokenizer=Detokenizer(vocabulary),
+        end_with_eos=False,
+        metric_labels=("bench", "none"),
+        generate_tokens_with_probabilities=lambda **kwargs: iter(items),
+    )
+
+    results = {}
+    for protocol in ChatProtocol:
+        rates, sizes = [], []
+        for _ in range(runs):
+            orchestrator = ChatWebSocketOrchestrator(
+                SimpleNamespace(text_generation_service=generation)  # type: ignore[arg-type]
+            )
+            socket = CountingWebSocket()
+            orchestrator.websocket = TimedWebSocket(socket, generation)  # type: ignore[arg-type]
+            orchestrator.protocol = protocol
+            orchestrator.chat_type = ChatType.TEXT_GENERATION
+            orchestrator.messages = [{"content": ["hello"], "source": "user"}]
+            start = time.perf_counter()
+            await orchestrator.generation(asyncio.Event())
+            rates.append(tokens / (time.perf_counter() - start))
+            sizes.append(socket.bytes / tokens)
+        results[f"{protocol.value}_tokens_per_s"] = statistics.median(rates)
+        results[f"{protocol.value}_bytes_per_token"] = statistics.median(sizes)
+    return results
+
+
+def run(args: argparse.Namespace) -> Results:
+    torch.set_num_threads(args.threads)
+    results: Results = {"sampler": bench_sampler(args.iterations)}
+    with tempfile.TemporaryDirectory() as directory:
+        results["hf_generation"] = bench_hf_generation(
+            write_tiny_hf_model(os.path.join(directory, "hf")),
+            args.runs,
+            args.tokens,
+        )
+        try:
+            gguf_path = write_tiny_gguf(os.path.join(directory, "tiny.gguf"))
+        except ImportError:
+            print("Skipping the GGUF loop, writing its model needs: pip install gguf")
+        else:
+            results["gguf_generation"] = bench_gguf_generation(
+                gguf_path, args.runs, args.tokens
+            )
+    results["trie"] = bench_trie(args.chats, args.tokens)
+    results["orchestrator_send"] = asyncio.run(
+        bench_send_path(args.tokens * 8, args.runs)
+    )
+    return results
+
+
+def compare(results: Results, baseline: Results, tolerance: float) -> List[str]:
+    """Print every metric next to its baseline, returns the regressed ones"""
+    regressions = []
+    print(f"{'metric':>40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for group, metrics in results.items():
+        for metric, value in metrics.items():
+            name = f"{group}.{metric}"
+            base = baseline.get(group, {}).get(metric)
+            if not base:
+                print(f"{name:>40} {'-':>12} {value:>12.2f}")
+                continue
+            change = (value - base) / base
+            worse = (
+                change > tolerance if lower_is_better(metric) else change < -tolerance
+            )
+            if worse:
+                regressions.append(name)
+            print(
+                f"{name:>40} {base:>12.2f} {value:>12.2f} {change:>+8.1%}"
+                f"{'  REGRESSION' if worse else ''}"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Baseline JSON file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(
+                f"Regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}"
+            )
+            sys.exit(1)
+    else:
+        for group, metrics in results.items():
+            for metric, value in metrics.items():
+                print(f"{group + '.' + metric:>40} {value:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
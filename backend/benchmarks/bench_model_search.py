@@ -0,0 +1,132 @@
+"""
+Benchmark of the /models/ queries against a catalog of SQLite rows: substring
+name search (LIKE scan vs the FTS5 trigram index) and deep pages (OFFSET vs cursor).
+
+Run from the backend directory with: python -m benchmarks.bench_model_search
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, List
+
+from sqlalchemy import desc, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
+from actuosus_ai.ai_model_manager.orm import AIModelORM, create_schema
+
+ORGS = [
+    "meta-llama",
+    "mistralai",
+    "Qwen",
+    "google",
+    "microsoft",
+    "TheBloke",
+    "bigscience",
+]
+FAMILIES = ["Llama", "Mistral", "Qwen", "gemma", "phi", "falcon", "bloom", "gpt2"]
+TAGS = ["text-generation", "token-classification", "fill-mask", "translation"]
+
+
+def catalog(rows: int) -> List[dict[str, Any]]:
+    random.seed(0)
+    start = datetime(2024, 1, 1)
+    return [
+        {
+            "name": f"{random.choice(ORGS)[:8]}/{random.choice(FAMILIES)}-{i}"[:30],
+            "pipeline_tag": random.choice(TAGS),
+            "storage_path": f"/models/{i}",
+            "created_at": start + timedelta(seconds=random.randrange(10**7)),
+            "updated_at": start,
+        }
+        for i in range(rows)
+    ]
+
+
+async def time_per_call(
+    function: Callable[[], Awaitable[Any]], iterations: int
+) -> float:
+    await function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await function()
+    return (time.perf_counter() - start) / iterations
+
+
+async def run(rows: int, iterations: int, page_size: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(
+            f"sqlite+aiosqlite:///{os.path.join(directory, 'bench.db')}"
+        )
+        async with engine.begin() as conn:
+            await conn.run_sync(create_schema)
+            await conn.execute(insert(AIModelORM), catalog(rows))
+
+        async with async_sessionmaker(engine, class_=AsyncSession)() as session:
+            service = AIModelStorageService(None, session)  # type: ignore
+            deep_offset = rows - rows // 10
+
+            async def legacy_search() -> Any:
+                query = select(AIModelORM).filter(AIModelORM.name.contains("gemma-12"))
+                return (await session.execute(query)).scalars().all()
+
+            async def fts_search() -> Any:
+                return await service.get_models(name="gemma-12")
+
+            async def offset_page() -> Any:
+                query = (
+                    select(AIModelORM)
+                    .order_by(desc(AIModelORM.created_at), desc(AIModelORM.ai_model_id))
+                    .limit(page_size)
+                    .offset(deep_offset)
+                )
+                return (await session.execute(query)).scalars().all()
+
+            # The cursor of the row just before the deep page
+            before = await service.get_models(
+                limit=1, offset=deep_offset - 1, order_by="created_at"
+            )
+            cursor = service.encode_cursor(before[0], "created_at")
+
+            async def cursor_page() -> Any:
+                return await service.get_models(
+                    limit=page_size, order_by="created_at", cursor=cursor
+                )
+
+            assert [m.ai_model_id for m in await cursor_page()] == [
+                m.ai_model_id for m in await offset_page()
+            ]
+            assert {m.ai_model_id for m in await fts_search()} == {
+                m.ai_model_id for m in await legacy_search()
+            }
+
+            print(f"{rows} rows, {iterations} iterations")
+            for label, slow, fast in [
+                ("name search (ms)", legacy_search, fts_search),
+                (f"page at offset {deep_offset} (ms)", offset_page, cursor_page),
+            ]:
+                before_ms = await time_per_call(slow, iterations) * 1000
+                after_ms = await time_per_call(fast, iterations) * 1000
+                print(
+                    f"{label:>34} {'legacy':>8} {before_ms:>9.3f} "
+                    f"{'new':>5} {after_ms:>9.3f}"
+                )
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.iterations, args.page_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of the top-k sampler against the previous per-element implementation.
+
+Run from the backend directory with: python -m benchmarks.bench_sampler
+"""
+
+import argparse
+import time
+from typing import Callable, List, Tuple
+
+import torch
+from torch import Tensor
+
+from actuosus_ai.ai_interaction.sampling import sample_top_k
+
+VOCAB_SIZES = [32000, 50257, 128256, 151936]
+
+
+def legacy_top_k_token_with_prob(
+    logits: Tensor, k: int, temperature: float, min_prob: float
+) -> List[Tuple[Tensor, float]]:
+    """The sampler as it was in TextGenerationService, kept as the baseline"""
+    scaled_logits = logits / temperature
+    probabilities = torch.nn.functional.softmax(scaled_logits, dim=-1)
+    probabilities = torch.where(
+        probabilities > min_prob, probabilities, torch.tensor(0.0)
+    )
+    samples = torch.multinomial(probabilities, num_samples=k)
+    selected_probabilities = [prob.item() for prob in probabilities[0, samples][0]]
+    first_element = samples[0][0], selected_probabilities[0]
+    remaining_elements = sorted(
+        zip(samples[0][1:], selected_probabilities[1:]),
+        key=lambda x: x[1],
+        reverse=True,
+    )
+    return [first_element] + remaining_elements
+
+
+def time_per_call(function: Callable[[], object], iterations: int) -> float:
+    for _ in range(3):
+        function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    print(
+        f"{'vocab':>8} {'legacy (ms)':>12} {'batch=1 (ms)':>13} "
+        f"{f'batch={args.batch} (ms/row)':>20}"
+    )
+    for vocab_size in VOCAB_SIZES:
+        # Peaked logits like a real model, so min_prob leaves more than k tokens
+        logits = torch.randn(args.batch, vocab_size, device=args.device) * 4
+        single = logits[:1]
+        legacy = time_per_call(
+            lambda: legacy_top_k_token_with_prob(single.cpu(), args.k, 1.0, 0.0),
+            args.iterations,
+        )
+        vectorized = time_per_call(
+            lambda: sample_top_k(single, args.k, 1.0, 0.001), args.iterations
+        )
+        batched = time_per_call(
+            lambda: sample_top_k(logits, args.k, 1.0, 0.001), args.iterations
+        )
+        print(
+            f"{vocab_size:>8} {legacy * 1000:>12.3f} {vectorized * 1000:>13.3f} "
+            f"{batched * 1000 / args.batch:>20.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
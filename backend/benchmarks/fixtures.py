@@ -0,0 +1,120 @@
+"""
+Tiny randomly initialized models written to disk, so benchmarks and load tests run
+offline on CPU. Both have a byte level vocabulary, any text can be encoded. Writing
+the GGUF model needs the gguf package (pip install gguf).
+"""
+
+import os
+import string
+
+import numpy as np
+
+# Keep the models small enough to be written in well under a second
+N_EMBD = 32
+N_LAYER = 2
+N_HEAD = 2
+N_CTX = 256
+EOS_TOKEN = "<|endoftext|>"
+
+
+def write_tiny_hf_model(directory: str, seed: int = 0) -> str:
+    """Save a random GPT-2 and a byte level BPE tokenizer without merges"""
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import GPT2Config, GPT2LMHeadModel, PreTrainedTokenizerFast
+
+    byte_level = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    alphabet = pre_tokenizers.ByteLevel.alphabet()
+    vocab = {piece: token_id for token_id, piece in enumerate(sorted(alphabet))}
+    vocab[EOS_TOKEN] = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = byte_level
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=backend,
+        eos_token=EOS_TOKEN,
+        bos_token=EOS_TOKEN,
+        model_max_length=N_CTX,
+    )
+
+    torch.manual_seed(seed)
+    model = GPT2LMHeadModel(
+        GPT2Config(
+            vocab_size=len(vocab),
+            n_positions=N_CTX,
+            n_embd=N_EMBD,
+            n_layer=N_LAYER,
+            n_head=N_HEAD,
+            bos_token_id=vocab[EOS_TOKEN],
+            eos_token_id=vocab[EOS_TOKEN],
+        )
+    ).eval()
+    os.makedirs(directory, exist_ok=True)
+    model.save_pretrained(directory)
+    tokenizer.save_pretrained(directory)
+    return directory
+
+
+def write_tiny_gguf(path: str, seed: int = 0) -> str:
+    """Write a random llama model with a SentencePiece style byte fallback vocabulary"""
+    import gguf
+
+    tokens = ["<unk>", "<s>", "</s>"] + [f"<0x{byte:02X}>" for byte in range(256)]
+    token_types = [
+        gguf.TokenType.UNKNOWN,
+        gguf.TokenType.CONTROL,
+        gguf.TokenType.CONTROL,
+    ] + [gguf.TokenType.BYTE] * 256
+    words = list(string.ascii_lowercase) + [
+        "▁" + letter for letter in string.ascii_lowercase
+    ]
+    tokens += words
+    token_types += [gguf.TokenType.NORMAL] * len(words)
+    n_vocab = len(tokens)
+    n_ff = N_EMBD * 2
+
+    writer = gguf.GGUFWriter(path, "llama")
+    writer.add_name("tiny")
+    writer.add_context_length(N_CTX)
+    writer.add_embedding_length(N_EMBD)
+    writer.add_block_count(N_LAYER)
+    writer.add_feed_forward_length(n_ff)
+    writer.add_head_count(N_HEAD)
+    writer.add_head_count_kv(N_HEAD)
+    writer.add_rope_dimension_count(N_EMBD // N_HEAD)
+    writer.add_layer_norm_rms_eps(1e-5)
+    writer.add_vocab_size(n_vocab)
+    writer.add_tokenizer_model("llama")
+    writer.add_token_list(tokens)
+    writer.add_token_scores([0.0] * n_vocab)
+    writer.add_token_types(token_types)
+    writer.add_bos_token_id(1)
+    writer.add_eos_token_id(2)
+    writer.add_unk_token_id(0)
+
+    rng = np.random.default_rng(seed)
+
+    def add_random(name: str, *shape: int) -> None:
+        writer.add_tensor(name, (rng.standard_normal(shape) * 0.1).astype(np.float32))
+
+    def add_ones(name: str) -> None:
+        writer.add_tensor(name, np.ones(N_EMBD, dtype=np.float32))
+
+    add_random("token_embd.weight", n_vocab, N_EMBD)
+    add_ones("output_norm.weight")
+    add_random("output.weight", n_vocab, N_EMBD)
+    for layer in range(N_LAYER):
+        prefix = f"blk.{layer}."
+        add_ones(prefix + "attn_norm.weight")
+        add_ones(prefix + "ffn_norm.weight")
+        for name in ("attn_q", "attn_k", "attn_v", "attn_output"):
+            add_random(f"{prefix}{name}.weight", N_EMBD, N_EMBD)
+        add_random(prefix + "ffn_gate.weight", n_ff, N_EMBD)
+        add_random(prefix + "ffn_up.weight", n_ff, N_EMBD)
+        add_random(prefix + "ffn_down.weight", N_EMBD, n_ff)
+
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+    return path
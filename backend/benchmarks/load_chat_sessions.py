@@ -0,0 +1,524 @@
+"""
+Load test of concurrent /ws/chat/ sessions. Every simulated user opens a session,
+then alternates think time with an action: a new message, a branch from an
+alternative word of an earlier reply, a word refresh or a generation stopped
+early. Reports generation throughput, time to first token and inter-token latency
+percentiles, and the error rate, for each number of users.
+
+Run from the backend directory against a running server with:
+    python -m benchmarks.load_chat_sessions --url ws://localhost:8000/ws/chat/ \
+        --ai-model-id 1 --quantization gguf --gguf-file-name model.gguf --users 1,4,16
+or offline, against a tiny random model served from this process (the GGUF model
+needs pip install gguf, the HF one accelerate):
+    python -m benchmarks.load_chat_sessions --serve-tiny gguf --users 1,4,16
+
+The server batches tokens into frames, each token of a frame gets its gap to the
+previous frame divided among them as inter-token latency. Send --config
+flush_items=1 for a frame per token.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import websockets
+
+from actuosus_ai.ai_interaction.binary_protocol import (
+    BinaryFrameType,
+    decode_tokens,
+    decode_vocabulary,
+    decode_word_refresh,
+)
+from actuosus_ai.ai_interaction.chat_websocket_orchestrator import (
+    ChangeConfigRequest,
+    ClearMessagesRequest,
+    NewMessageRequest,
+    RefreshWordRequest,
+    ResponseTypeId,
+    SelectWordRequest,
+    StopGenerationRequest,
+)
+
+PROMPTS = [
+    "What is the capital of France",
+    "Write a short poem about the sea",
+    "Explain how a hash map works",
+    "Give me three ideas for dinner",
+    "Why is the sky blue",
+    "Summarize the plot of Hamlet",
+    "How do I reverse a list in Python",
+    "Tell me a joke about computers",
+]
+
+# Kinds of frames, binary and JSON ones are read into the same kinds
+TOKENS = "tokens"
+REFRESH = "refresh"
+END = "end"
+MODEL_INFO = "model_info"
+VOCABULARY = "vocabulary"
+OTHER = "other"
+
+# Tokens added around each message by a chat template, roughly
+TEMPLATE_OVERHEAD = 32
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class LoadStats:
+    """Measurements of every user at one concurrency level"""
+
+    def __init__(self) -> None:
+        self.ttft: List[float] = []
+        self.inter_token: List[float] = []
+        self.refresh: List[float] = []
+        self.session_setup: List[float] = []
+        self.tokens = 0
+        self.generations = 0
+        self.operations = 0
+        self.errors: Counter[str] = Counter()
+
+    def error(self, e: BaseException) -> None:
+        self.errors[f"{type(e).__name__}: {e}"[:120]] += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest rank percentile, nan without values"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class ChatUser:
+    """One simulated user, reconnecting with a fresh session after an error"""
+
+    def __init__(self, args: argparse.Namespace, stats: LoadStats, seed: int):
+        self.args = args
+        self.stats = stats
+        self.rng = random.Random(seed)
+        self.websocket: Any = None
+        self.pieces: List[str] = []
+        # What the server holds for the session, generated words are WordProbLists
+        self.messages: List[Dict[str, Any]] = []
+        self.ai_source = "assistant" if args.chat_type == "chat" else "user"
+
+    def session_url(self) -> str:
+        query: Dict[str, Any] = {
+            "chat_type": self.args.chat_type,
+            "ai_model_id": self.args.ai_model_id,
+            "protocol": self.args.protocol,
+        }
+        if self.args.quantization:
+            query["quantization"] = self.args.quantization
+        if self.args.gguf_file_name:
+            query["gguf_file_name"] = self.args.gguf_file_name
+        return f"{self.args.url}?{urlencode(query)}"
+
+    async def send(self, request: Any) -> None:
+        await self.websocket.send(json.dumps(request.model_dump()))
+
+    async def receive(self, timeout: float) -> Tuple[str, Any]:
+        try:
+            data = await asyncio.wait_for(self.websocket.recv(), timeout)
+        except asyncio.TimeoutError:
+            raise RequestFailed("Timed out waiting for the server")
+        if isinstance(data, bytes):
+            if data[0] == BinaryFrameType.TOKENS:
+                return TOKENS, decode_tokens(data, self.pieces)[1]
+            if data[0] == BinaryFrameType.WORD_REFRESH:
+                return REFRESH, decode_word_refresh(data, self.pieces)[2]
+            return VOCABULARY, decode_vocabulary(data)
+        frame = json.loads(data)
+        type_id, payload = frame["type_id"], frame["payload"]
+        if type_id == ResponseTypeId.ERROR:
+            raise RequestFailed(payload)
+        if type_id == ResponseTypeId.NEW_MESSAGE_BATCH:
+            return TOKENS, payload["contents"]
+        # Text generation sessions answer a refresh with a NEW_MESSAGE frame
+        if type_id in (ResponseTypeId.REFRESH_WORD, ResponseTypeId.NEW_MESSAGE):
+            return REFRESH, payload["content"]
+        if type_id == ResponseTypeId.NEW_MESSAGE_END:
+            return END, payload
+        if type_id == ResponseTypeId.MODEL_INFO:
+            return MODEL_INFO, payload
+        return OTHER, payload
+
+    async def connect(self) -> None:
+        self.stats.operations += 1
+        start = time.perf_counter()
+        self.websocket = await websockets.connect(
+            self.session_url(), max_size=None, open_timeout=self.args.timeout
+        )
+        # Load progress frames come first, the model info once it is loaded
+        while (await self.receive(self.args.load_timeout))[0] != MODEL_INFO:
+            pass
+        if self.args.protocol == "binary":
+            kind, self.pieces = await self.receive(self.args.timeout)
+            if kind != VOCABULARY:
+                raise RequestFailed("Expected the vocabulary after the model info")
+        self.stats.session_setup.append(time.perf_counter() - start)
+        self.messages = []
+        for name, value in self.args.config:
+            await self.send(ChangeConfigRequest(config_name=name, config_value=value))
+
+    async def close(self) -> None:
+        if self.websocket is not None:
+            with contextlib.suppress(Exception):
+                await self.websocket.close()
+        self.websocket = None
+
+    async def generate(
+        self, request: Any, stop_after: Optional[int] = None
+    ) -> List[Any]:
+        """Send a generating request and read its tokens until the message ends"""
+        start = time.perf_counter()
+        await self.send(request)
+        items: List[Any] = []
+        last: Optional[float] = None
+        while True:
+            kind, value = await self.receive(self.args.timeout)
+            if kind == END:
+                break
+            if kind != TOKENS or not value:
+                continue
+            now = time.perf_counter()
+            if last is None:
+                self.stats.ttft.append(now - start)
+            else:
+                self.stats.inter_token += [(now - last) / len(value)] * len(value)
+            last = now
+            items += value
+            if stop_after is not None and len(items) >= stop_after:
+                await self.send(StopGenerationRequest())
+                stop_after = None
+        self.stats.generations += 1
+        self.stats.tokens += len(items)
+        return items
+
+    def context_size(self) -> int:
+        """Tokens of the session at most, a byte level tokenizer takes one per byte"""
+        return sum(
+            TEMPLATE_OVERHEAD
+            + sum(
+                len((word[0][0] if isinstance(word, list) else word).encode())
+                for word in message["content"]
+            )
+            for message in self.messages
+        )
+
+    def generated_words(self, alternatives: int) -> List[Tuple[int, int]]:
+        return [
+            (i, j)
+            for i, message in enumerate(self.messages)
+            for j, word in enumerate(message["content"])
+            if isinstance(word, list) and len(word) >= alternatives
+        ]
+
+    async def new_message(self, stop_after: Optional[int] = None) -> None:
+        prompt = self.rng.choice(PROMPTS)
+        items = await self.generate(
+            NewMessageRequest(content=prompt, source="user", i=-1, j=0), stop_after
+        )
+        if self.args.chat_type == "chat":
+            self.messages.append({"content": [prompt], "source": "user"})
+            self.messages.append({"content": items, "source": self.ai_source})
+        else:
+            self.messages.append({"content": [prompt, *items], "source": "user"})
+
+    async def branch(self, i: int, j: int) -> None:
+        """Pick an alternative word and let the model continue from it"""
+        new_word = self.rng.choice(self.messages[i]["content"][j][1:])[0]
+        items = await self.generate(SelectWordRequest(i=i, j=j, new_word=new_word))
+        self.messages = self.messages[: i + 1]
+        message = self.messages[i]
+        message["content"] = message["content"][:j] + [new_word, *items]
+
+    async def refresh(self, i: int, j: int) -> None:
+        start = time.perf_counter()
+        await self.send(RefreshWordRequest(i=i, j=j))
+        while (await self.receive(self.args.timeout))[0] != REFRESH:
+            pass
+        self.stats.refresh.append(time.perf_counter() - start)
+
+    async def act(self) -> None:
+        self.stats.operations += 1
+        if self.args.max_context and self.context_size() > self.args.max_context:
+            # The user starts over instead of overflowing the model's context
+            await self.send(ClearMessagesRequest())
+            self.messages = []
+        roll = self.rng.random()
+        branchable = self.generated_words(2)
+        if branchable and roll < self.args.branch_prob:
+            await self.branch(*self.rng.choice(branchable))
+            return
+        roll -= self.args.branch_prob
+        if branchable and roll < self.args.refresh_prob:
+            await self.refresh(*self.rng.choice(branchable))
+            return
+        roll -= self.args.refresh_prob
+        if roll < self.args.stop_prob:
+            await self.new_message(
+                stop_after=self.rng.randint(1, max(1, self.args.max_new_tokens // 2))
+            )
+            return
+        await self.new_message()
+
+    async def run(self, start_delay: float, deadline: float) -> None:
+        await asyncio.sleep(start_delay)
+        while time.perf_counter() < deadline:
+            try:
+                if self.websocket is None:
+                    await self.connect()
+                think_time = (
+                    self.rng.expovariate(1 / self.args.think_time)
+                    if self.args.think_time
+                    else 0
+                )
+                await asyncio.sleep(
+                    min(think_time, max(0.0, deadline - time.perf_counter()))
+                )
+                if time.perf_counter() >= deadline:
+                    break
+                await self.act()
+            except (RequestFailed, websockets.ConnectionClosed, OSError) as e:
+                self.stats.error(e)
+                await self.close()
+        await self.close()
+
+
+async def run_level(args: argparse.Namespace, users: int) -> Dict[str, Any]:
+    stats = LoadStats()
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(
+        *(
+            ChatUser(args, stats, args.seed * 1000 + user).run(
+                args.ramp_up * user / users, deadline
+            )
+            for user in range(users)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    errors = sum(stats.errors.values())
+    return {
+        "users": users,
+        "generations": stats.generations,
+        "tokens_per_s": stats.tokens / elapsed,
+        "generations_per_s": stats.generations / elapsed,
+        **{f"ttft_ms_p{q}": percentile(stats.ttft, q) * 1000 for q in (50, 90, 99)},
+        **{
+            f"inter_token_ms_p{q}": percentile(stats.inter_token, q) * 1000
+            for q in (50, 90, 99)
+        },
+        "refresh_ms_p50": percentile(stats.refresh, 50) * 1000,
+        "session_setup_ms_p50": percentile(stats.session_setup, 50) * 1000,
+        "error_rate": errors / max(1, stats.operations),
+        "errors": dict(stats.errors),
+    }
+
+
+class TinyModelStorage:
+    """Resolves every model id to the tiny model, so the server needs no database"""
+
+    def __init__(self, storage_path: str):
+        self.storage_path = storage_path
+
+    async def get_model_by_id(self, ai_model_id: int) -> Any:
+        from actuosus_ai.ai_model_manager.dto import AIModelDTO
+
+        now = datetime.now()
+        return AIModelDTO(
+            ai_model_id=ai_model_id,
+            name="tiny",
+            storage_path=self.storage_path,
+            pipeline_tag="text-generation",
+            created_at=now,
+            updated_at=now,
+        )
+
+
+@contextlib.contextmanager
+def serve_tiny_model(kind: str) -> Iterator[Dict[str, Any]]:
+    """Serve /ws/chat/ for a tiny random model on a free local port"""
+    import uvicorn
+    from fastapi import FastAPI
+
+    from actuosus_ai.app.ai_interaction_router import router
+    from actuosus_ai.app.dependency import get_ai_model_storage_service
+    from benchmarks.fixtures import write_tiny_gguf, write_tiny_hf_model
+
+    with tempfile.TemporaryDirectory() as directory:
+        target: Dict[str, Any]
+        if kind == "gguf":
+            write_tiny_gguf(os.path.join(directory, "tiny.gguf"))
+            target = {"quantization": "gguf", "gguf_file_name": "tiny.gguf"}
+        else:
+            write_tiny_hf_model(directory)
+            target = {"quantization": None, "gguf_file_name": None}
+
+        app = FastAPI()
+        app.include_router(router)
+        storage = TinyModelStorage(directory)
+        app.dependency_overrides[get_ai_model_storage_service] = lambda: storage
+
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        port = listener.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        # The server has its own event loop, away from the clients'
+        thread = threading.Thread(
+            target=server.run, kwargs={"sockets": [listener]}, daemon=True
+        )
+        thread.start()
+        while not server.started:
+            if not thread.is_alive():
+                raise RuntimeError("The tiny model server did not start")
+            time.sleep(0.05)
+        try:
+            yield {"url": f"ws://127.0.0.1:{port}/ws/chat/", "ai_model_id": 1, **target}
+        finally:
+            server.should_exit = True
+            thread.join()
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    columns = [
+        "users",
+        "generations",
+        "tokens_per_s",
+        "ttft_ms_p50",
+        "ttft_ms_p90",
+        "ttft_ms_p99",
+        "inter_token_ms_p50",
+        "inter_token_ms_p99",
+        "refresh_ms_p50",
+        "error_rate",
+    ]
+    print(" ".join(f"{column:>18}" for column in columns))
+    for result in results:
+        print(" ".join(f"{result[column]:>18.2f}" for column in columns))
+    for result in results:
+        for error, count in result["errors"].items():
+            print(f"{result['users']} users, {count}x {error}")
+
+
+def parse_config(value: str) -> Tuple[str, str]:
+    name, _, config_value = value.partition("=")
+    if not name or not config_value:
+        raise argparse.ArgumentTypeError("Expected name=value")
+    return name, config_value
+
+
+async def run(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    for users in args.users:
+        result = await run_level(args, users)
+        results.append(result)
+        print(
+            f"{users} users: {result['tokens_per_s']:.1f} tokens/s, "
+            f"TTFT p50 {result['ttft_ms_p50']:.0f} ms, errors {result['error_rate']:.1%}"
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--url", default="ws://localhost:8000/ws/chat/")
+    parser.add_argument("--ai-model-id", type=int, default=1)
+    parser.add_argument("--quantization")
+    parser.add_argument("--gguf-file-name")
+    parser.add_argument(
+        "--serve-tiny",
+        choices=["gguf", "hf"],
+        help="Serve a tiny random model from this process",
+    )
+    parser.add_argument(
+        "--chat-type", choices=["chat", "text_generation"], default="chat"
+    )
+    parser.add_argument("--protocol", choices=["json", "binary"], default="json")
+    parser.add_argument(
+        "--users",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[1, 2, 4, 8],
+        help="Comma separated user counts, run one after another",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30.0, help="Seconds per user count"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=2.0, help="Seconds over which the users join"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=2.0,
+        help="Mean seconds between a user's actions",
+    )
+    parser.add_argument("--branch-prob", type=float, default=0.25)
+    parser.add_argument("--refresh-prob", type=float, default=0.1)
+    parser.add_argument("--stop-prob", type=float, default=0.1)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument(
+        "--max-context",
+        type=int,
+        help="Tokens in a session before the user clears it, counted as UTF-8 bytes",
+    )
+    parser.add_argument(
+        "--config",
+        type=parse_config,
+        action="append",
+        default=[],
+        help="Extra session config as name=value",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=60.0, help="Seconds to wait for a frame"
+    )
+    parser.add_argument("--load-timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    args = parser.parse_args()
+    args.config = [("max_new_tokens", str(args.max_new_tokens)), *args.config]
+
+    with contextlib.ExitStack() as stack:
+        if args.serve_tiny:
+            from benchmarks.fixtures import N_CTX
+
+            target = stack.enter_context(serve_tiny_model(args.serve_tiny))
+            args.url = target["url"]
+            args.ai_model_id = target["ai_model_id"]
+            args.quantization = target["quantization"]
+            args.gguf_file_name = target["gguf_file_name"]
+            if args.max_context is None:
+                # Leave room for the next prompt and its reply
+                args.max_context = (
+                    N_CTX
+                    - args.max_new_tokens
+                    - 2 * TEMPLATE_OVERHEAD
+                    - max(len(prompt) for prompt in PROMPTS)
+                )
+        results = asyncio.run(run(args))
+
+    print_results(results)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,14 @@ from pathlib import Path
 import pytest_asyncio
 from huggingface_hub import model_info
 
+from httpx import ASGITransport, AsyncClient
+
 from actuosus_ai.ai_model_manager.connection import get_async_db_session
+from actuosus_ai.ai_model_manager.download_manager import (
+    DownloadManager,
+    get_download_manager,
+)
+from actuosus_ai.app.main import app
 
 import shutil
 
@@ -60,16 +67,25 @@ class TestIntegration:
     ):
         # Arrange
         payload = {"hf_model_id": MODEL_NAME_1}
-
-        # Act
-        response = client.post("/download/hf_lang_model/", json=payload)
+        download_manager = DownloadManager(get_test_settings())
+        app.dependency_overrides[get_download_manager] = lambda: download_manager
+
+        # Act, the download runs in the background on this event loop
+        async with AsyncClient(
+            transport=ASGITransport(app=app), base_url="http://test"
+        ) as async_client:
+            response = await async_client.post("/download/hf_lang_model/", json=payload)
+            job_id = response.json()["job"]["job_id"]
+            await download_manager.wait(job_id)
+            job = (await async_client.get(f"/download/jobs/{job_id}/")).json()
 
         # Assert
-        assert response.json() == {
-            "success": True,
-            "message": "Model downloaded successfully",
-        }
+        assert response.json()["success"]
+        assert response.json()["message"] == "Model download started"
         assert response.status_code == 200
+        assert job["status"] == "completed"
+        assert job["files_done"] == job["files_total"]
+        assert job["bytes_done"] == job["bytes_total"]
 
         # Check if the model info is saved in the database
         pipeline_tag = model_info(MODEL_NAME_1).pipeline_tag
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from actuosus_ai.ai_interaction.binary_protocol import (
+    decode_tokens,
+    decode_vocabulary,
+    decode_word_refresh,
+    encode_tokens,
+    encode_vocabulary,
+    encode_word_refresh,
+)
+from actuosus_ai.ai_interaction.detokenizer import TokenWordProbList
+
+
+class TestBinaryProtocol:
+    @pytest.fixture
+    def pieces(self):
+        return ["<s>", " hello", " world", "日", "�", ""]
+
+    def test_vocabulary_round_trip(self, pieces):
+        assert decode_vocabulary(encode_vocabulary(pieces)) == pieces
+
+    def test_tokens_round_trip(self, pieces):
+        items = [
+            TokenWordProbList([(" hello", 0.5), (" world", 0.25)], [1, 2]),
+            # The chosen text completes a character split over two tokens
+            TokenWordProbList([("日", 0.75), ("�", 0.125)], [4, 4]),
+        ]
+
+        source, decoded = decode_tokens(encode_tokens("ai", items, pieces), pieces)
+
+        assert source == "ai"
+        assert decoded == [list(item) for item in items]
+
+    def test_tokens_are_smaller_than_json(self, pieces):
+        item = TokenWordProbList(
+            [(pieces[n % 4], 0.0625) for n in range(10)], [n % 4 for n in range(10)]
+        )
+        frame = encode_tokens("ai", [item] * 8, pieces)
+
+        # One byte k, two bytes text length and six bytes per entry
+        assert len(frame) == 1 + 3 + 2 + 8 * (3 + 10 * 6)
+        assert len(frame) * 3 < len(json.dumps([item] * 8))
+
+    def test_word_refresh_round_trip(self, pieces):
+        item = TokenWordProbList([(" world", 0.5)], [2])
+
+        assert decode_word_refresh(encode_word_refresh(3, 7, item, pieces), pieces) == (
+            3,
+            7,
+            [(" world", 0.5)],
+        )
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from fastapi import WebSocketDisconnect
+
+from actuosus_ai.ai_interaction.binary_protocol import decode_tokens, decode_vocabulary
+from actuosus_ai.ai_interaction.chat_websocket_orchestrator import (
+    ChatProtocol,
+    ChatType,
+    ChatWebSocketOrchestrator,
+    MessageFrameBuffer,
+    ResponseTypeId,
+    TimedWebSocket,
+)
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer
+from actuosus_ai.ai_interaction.profiler import DISABLED_RECORDER
+from actuosus_ai.common.actuosus_exception import InternalException, ValidationException
+
+
+class TestChatWebSocketOrchestrator:
+    @pytest.fixture
+    def websocket(self, mocker):
+        websocket = mocker.AsyncMock(name="websocket")
+        websocket.incoming = asyncio.Queue()
+        websocket.receive.side_effect = websocket.incoming.get
+        return websocket
+
+    @pytest.fixture
+    def chat_service(self, mocker):
+        return mocker.MagicMock(name="chat_service")
+
+    @pytest.fixture
+    def orchestrator(self, chat_service):
+        orchestrator = ChatWebSocketOrchestrator(chat_service)
+        orchestrator.load_progress_interval = 0.01
+        return orchestrator
+
+    @pytest.mark.asyncio
+    async def test_load_sends_progress_frames(
+        self, orchestrator, chat_service, websocket
+    ):
+        async def load_model(ai_model_id, quantization, gguf_file_name, progress):
+            progress.update(stage="reading", files_total=1, bytes_total=10)
+            await asyncio.sleep(0.05)
+            progress.update(stage="placing", files_read=1, bytes_read=10)
+            await asyncio.sleep(0.05)
+
+        chat_service.load_model.side_effect = load_model
+        await orchestrator.load(websocket, "chat", 1)
+
+        frames = [call.args[0] for call in websocket.send_json.call_args_list]
+        assert all(frame["type_id"] == ResponseTypeId.LOAD_PROGRESS for frame in frames)
+        stages = [frame["payload"]["stage"] for frame in frames]
+        assert "reading" in stages and "placing" in stages
+
+    @pytest.mark.asyncio
+    async def test_disconnect_cancels_load(self, orchestrator, chat_service, websocket):
+        cancelled = asyncio.Event()
+
+        async def load_model(ai_model_id, quantization, gguf_file_name, progress):
+            while not progress.cancel_event.is_set():
+                await asyncio.sleep(0.01)
+            cancelled.set()
+            progress.check_cancelled()
+
+        chat_service.load_model.side_effect = load_model
+        await websocket.incoming.put({"type": "websocket.disconnect", "code": 1001})
+
+        with pytest.raises(WebSocketDisconnect):
+            await orchestrator.load(websocket, "chat", 1)
+        assert cancelled.is_set()
+
+    @pytest.mark.asyncio
+    async def test_messages_during_load_are_kept(
+        self, orchestrator, chat_service, websocket
+    ):
+        async def load_model(ai_model_id, quantization, gguf_file_name, progress):
+            await asyncio.sleep(0.05)
+
+        chat_service.load_model.side_effect = load_model
+        await websocket.incoming.put(
+            {"type": "websocket.receive", "text": json.dumps({"type_id": 4})}
+        )
+        await orchestrator.load(websocket, "chat", 1)
+
+        assert await orchestrator._receive_json() == {"type_id": 4}
+        websocket.receive_json.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_generation_runs_off_the_event_loop(
+        self, orchestrator, chat_service, websocket
+    ):
+        threads = []
+
+        def generate(**kwargs):
+            for word in ("a", "b", "c"):
+                threads.append(threading.current_thread())
+                time.sleep(0.02)
+                yield [(word, 1.0)]
+
+        chat_service.text_generation_service.generate_tokens_with_probabilities.side_effect = generate
+        chat_service.text_generation_service.end_with_eos = True
+        orchestrator.chat_type = ChatType.TEXT_GENERATION
+        orchestrator.websocket = websocket
+        orchestrator.messages = [{"content": ["hi"], "source": "user"}]
+
+        # The loop keeps ticking while the generator sleeps
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        ticker = asyncio.create_task(tick())
+        await orchestrator.generation(asyncio.Event())
+        ticker.cancel()
+
+        assert threading.main_thread() not in threads
+        assert ticks > 3
+        frames = [call.args[0] for call in websocket.send_json.call_args_list]
+        assert frames[-1]["type_id"] == ResponseTypeId.NEW_MESSAGE_END
+        assert all(
+            frame["type_id"] == ResponseTypeId.NEW_MESSAGE_BATCH
+            for frame in frames[:-1]
+        )
+        assert [
+            item for frame in frames[:-1] for item in frame["payload"]["contents"]
+        ] == [[("a", 1.0)], [("b", 1.0)], [("c", 1.0)]]
+        assert orchestrator.messages[-1]["content"][1:] == [
+            [("a", 1.0)],
+            [("b", 1.0)],
+            [("c", 1.0)],
+        ]
+
+    @pytest.mark.asyncio
+    async def test_stream_in_executor_closes_generator_when_consumer_stops(
+        self, orchestrator
+    ):
+        orchestrator.generation_queue_size = 1
+        closed = threading.Event()
+
+        def generate():
+            try:
+                while True:
+                    yield [("a", 1.0)]
+            finally:
+                closed.set()
+
+        stream = orchestrator.stream_in_executor(generate)
+        assert await stream.__anext__() == [("a", 1.0)]
+        await stream.aclose()
+
+        assert await asyncio.to_thread(closed.wait, 5)
+
+    @pytest.mark.asyncio
+    async def test_stream_in_executor_raises_generator_errors(self, orchestrator):
+        def generate():
+            yield [("a", 1.0)]
+            raise InternalException("boom")
+
+        stream = orchestrator.stream_in_executor(generate)
+        assert await stream.__anext__() == [("a", 1.0)]
+        with pytest.raises(InternalException):
+            await stream.__anext__()
+
+    @pytest.mark.asyncio
+    async def test_frame_buffer_flushes_first_item_and_by_count(self, websocket):
+        buffer = MessageFrameBuffer(websocket, "ai", flush_interval=60, flush_items=2)
+
+        await buffer.add([("a", 1.0)])
+        assert websocket.send_json.call_count == 1
+        await buffer.add([("b", 1.0)])
+        assert websocket.send_json.call_count == 1
+        await buffer.add([("c", 1.0)])
+        assert websocket.send_json.call_count == 2
+        buffer.cancel()
+
+        contents = [
+            call.args[0]["payload"]["contents"]
+            for call in websocket.send_json.call_args_list
+        ]
+        assert contents == [[[("a", 1.0)]], [[("b", 1.0)], [("c", 1.0)]]]
+
+    @pytest.mark.asyncio
+    async def test_frame_buffer_flushes_after_interval(self, websocket):
+        buffer = MessageFrameBuffer(
+            websocket, "ai", flush_interval=0.01, flush_items=100
+        )
+
+        await buffer.add([("a", 1.0)])
+        await buffer.add([("b", 1.0)])
+        await asyncio.sleep(0.05)
+
+        assert websocket.send_json.call_count == 2
+        await buffer.flush()
+        assert websocket.send_json.call_count == 2
+
+    @pytest.mark.asyncio
+    async def test_generation_flushes_before_message_end(
+        self, orchestrator, chat_service, websocket
+    ):
+        def generate(**kwargs):
+            for word in "abcde":
+                yield [(word, 1.0)]
+
+        chat_service.text_generation_service.generate_tokens_with_probabilities.side_effect = generate
+        orchestrator.flush_interval = 60
+        orchestrator.chat_type = ChatType.TEXT_GENERATION
+        orchestrator.websocket = websocket
+        orchestrator.messages = [{"content": ["hi"], "source": "user"}]
+
+        await orchestrator.generation(asyncio.Event())
+
+        frames = [call.args[0] for call in websocket.send_json.call_args_list]
+        # The first token alone, the rest in one frame, then the end
+        assert [frame["type_id"] for frame in frames] == [
+            ResponseTypeId.NEW_MESSAGE_BATCH,
+            ResponseTypeId.NEW_MESSAGE_BATCH,
+            ResponseTypeId.NEW_MESSAGE_END,
+        ]
+        assert len(frames[1]["payload"]["contents"]) == 4
+
+    @pytest.mark.asyncio
+    async def test_binary_protocol_sends_packed_frames(
+        self, orchestrator, chat_service, websocket
+    ):
+        pieces = ["a", "b", "c"]
+        detokenizer = Detokenizer(
+            pieces, piece_bytes=[piece.encode() for piece in pieces]
+        )
+
+        def generate(**kwargs):
+            stream = detokenizer.stream()
+            for token in (0, 1, 2):
+                yield stream.words([(token, 0.5), ((token + 1) % 3, 0.25)])
+
+        service = chat_service.text_generation_service
+        service.generate_tokens_with_probabilities.side_effect = generate
+        service.detokenizer = detokenizer
+        orchestrator.chat_type = ChatType.TEXT_GENERATION
+        orchestrator.protocol = ChatProtocol.BINARY
+        orchestrator.websocket = websocket
+        orchestrator.messages = [{"content": ["hi"], "source": "user"}]
+
+        await orchestrator.send_vocabulary()
+        await orchestrator.generation(asyncio.Event())
+
+        frames = [call.args[0] for call in websocket.send_bytes.call_args_list]
+        assert decode_vocabulary(frames[0]) == pieces
+        words = [
+            item for frame in frames[1:] for item in decode_tokens(frame, pieces)[1]
+        ]
+        assert words == [
+            [("a", 0.5), ("b", 0.25)],
+            [("b", 0.5), ("c", 0.25)],
+            [("c", 0.5), ("a", 0.25)],
+        ]
+        # Only the end of the message stays JSON
+        assert websocket.send_json.call_args.args[0]["type_id"] == (
+            ResponseTypeId.NEW_MESSAGE_END
+        )
+
+    @pytest.mark.asyncio
+    async def test_vocabulary_requires_binary_protocol(self, orchestrator, websocket):
+        orchestrator.websocket = websocket
+
+        with pytest.raises(ValidationException):
+            await orchestrator.send_vocabulary()
+
+    @pytest.mark.asyncio
+    async def test_profiled_generation_sends_breakdown_and_trace(
+        self, orchestrator, chat_service, websocket, tmp_path
+    ):
+        service = chat_service.text_generation_service
+
+        def generate(**kwargs):
+            for word in "abc":
+                now = time.perf_counter()
+                service.profiler.add("forward", now, now)
+                yield [(word, 1.0)]
+
+        service.generate_tokens_with_probabilities.side_effect = generate
+        service.metric_labels = ("tiny", "none")
+        service.settings.profile_trace_dir = str(tmp_path)
+        orchestrator.chat_type = ChatType.TEXT_GENERATION
+        orchestrator.websocket = TimedWebSocket(websocket, service)
+        orchestrator.messages = [{"content": ["hi"], "source": "user"}]
+
+        orchestrator.profiling = True
+        orchestrator.profiling_chrome_trace = True
+        await orchestrator.generation(asyncio.Event())
+
+        frame = websocket.send_json.call_args.args[0]
+        assert frame["type_id"] == ResponseTypeId.PROFILE
+        phases = frame["payload"]["phases"]
+        assert phases["forward"]["count"] == 3
+        # The message frames and the end of the message
+        assert phases["send"]["count"] >= 2
+        trace = json.loads((tmp_path / frame["payload"]["trace_file"]).read_text())
+        assert {event["name"] for event in trace["traceEvents"]} >= {"forward", "send"}
+        # Profiling only lasts for the generation
+        assert service.profiler is DISABLED_RECORDER
@@ -0,0 +1,115 @@
+import pytest
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+from transformers import PreTrainedTokenizerFast
+
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer
+
+TRAINING_TEXT = ["hello world café naïve hello there world"] * 20
+
+
+class TestDetokenizer:
+    @pytest.fixture
+    def byte_level_tokenizer(self):
+        # Byte level BPE without merges for CJK, so "日" is split over three tokens
+        tokenizer = Tokenizer(models.BPE())
+        tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tokenizer.decoder = decoders.ByteLevel()
+        tokenizer.train_from_iterator(
+            TRAINING_TEXT,
+            trainers.BpeTrainer(
+                vocab_size=256,
+                initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),
+                show_progress=False,
+            ),
+        )
+        return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+    @pytest.fixture
+    def sentencepiece_tokenizer(self):
+        # SentencePiece style: "▁" marks a leading space and unknown characters fall back to bytes
+        tokenizer = Tokenizer(models.BPE(byte_fallback=True, unk_token="<unk>"))
+        tokenizer.pre_tokenizer = pre_tokenizers.Metaspace()
+        tokenizer.decoder = decoders.Sequence(
+            [decoders.ByteFallback(), decoders.Metaspace()]
+        )
+        tokenizer.train_from_iterator(
+            TRAINING_TEXT,
+            trainers.BpeTrainer(
+                vocab_size=300,
+                special_tokens=["<unk>"] + [f"<0x{i:02X}>" for i in range(256)],
+                show_progress=False,
+            ),
+        )
+        return PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+    @staticmethod
+    def _stream_text(tokenizer, text):
+        detokenizer = Detokenizer.from_hf(tokenizer)
+        stream = detokenizer.stream(tokenizer.encode("say", add_special_tokens=False))
+        return [
+            stream.push(token)
+            for token in tokenizer.encode(text, add_special_tokens=False)
+        ]
+
+    def test_stream_holds_back_partial_characters(self, byte_level_tokenizer):
+        pieces = self._stream_text(byte_level_tokenizer, "hello 日本 world")
+
+        assert "".join(pieces) == "hello 日本 world"
+        # The first two bytes of each character produce no text
+        assert pieces[6:12] == ["", "", "日", "", "", "本"]
+
+    def test_stream_keeps_sentencepiece_leading_space(self, sentencepiece_tokenizer):
+        pieces = self._stream_text(sentencepiece_tokenizer, "hello 日本 world")
+
+        assert "".join(pieces) == " hello 日本 world"
+        assert pieces[-1] == " world"
+
+    def test_pieces_keep_sentencepiece_leading_space(self, sentencepiece_tokenizer):
+        detokenizer = Detokenizer.from_hf(sentencepiece_tokenizer)
+        world = sentencepiece_tokenizer.convert_tokens_to_ids("▁world")
+
+        # Decoding the token alone drops the space
+        assert sentencepiece_tokenizer.decode([world]) == "world"
+        assert detokenizer.pieces[world] == " world"
+        assert len(detokenizer) == len(sentencepiece_tokenizer)
+
+    def test_padded_vocabulary_ids_have_empty_pieces(self, byte_level_tokenizer):
+        # Models often pad their embeddings past the tokenizer's vocabulary
+        vocab_size = len(byte_level_tokenizer) + 8
+        detokenizer = Detokenizer.from_hf(byte_level_tokenizer, vocab_size)
+        stream = detokenizer.stream()
+        hello = byte_level_tokenizer.encode("hello", add_special_tokens=False)
+
+        words = stream.words([(hello[0], 0.5), (vocab_size - 1, 0.1)])
+
+        assert len(detokenizer) == vocab_size
+        assert words == [("h", 0.5), ("", 0.1)]
+        assert stream.push(vocab_size - 1) == ""
+
+    def test_words_look_up_alternatives_without_the_tokenizer(
+        self, mocker, byte_level_tokenizer
+    ):
+        detokenizer = Detokenizer.from_hf(byte_level_tokenizer)
+        stream = detokenizer.stream()
+        hello = byte_level_tokenizer.encode("hello", add_special_tokens=False)
+        batch_decode = mocker.spy(byte_level_tokenizer, "batch_decode")
+        decode = mocker.spy(byte_level_tokenizer, "decode")
+
+        words = stream.words([(hello[0], 0.5), (hello[1], 0.3), (hello[2], 0.2)])
+
+        assert words == [("h", 0.5), ("e", 0.3), ("l", 0.2)]
+        batch_decode.assert_not_called()
+        # Only the chosen token goes through the incremental decode
+        assert decode.call_count == 2
+
+    def test_llama_stream_decodes_utf8_across_tokens(self, mocker):
+        vocab = [b"a", b" b", "日".encode()[:2], "日".encode()[2:]]
+        model = mocker.MagicMock(name="llama")
+        model.n_vocab.return_value = len(vocab)
+        model.detokenize.side_effect = lambda tokens, special: vocab[tokens[0]]
+
+        detokenizer = Detokenizer.from_llama(model)
+        stream = detokenizer.stream()
+
+        assert detokenizer.pieces[1] == " b"
+        assert [stream.push(token) for token in (0, 2, 3, 1)] == ["a", "", "日", " b"]
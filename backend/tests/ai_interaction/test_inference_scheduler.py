@@ -0,0 +1,199 @@
+import threading
+
+import pytest
+import torch
+from transformers import DynamicCache
+
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer
+from actuosus_ai.ai_interaction.inference_metrics import INTER_TOKEN_LATENCY
+from actuosus_ai.ai_interaction.inference_scheduler import InferenceScheduler
+from actuosus_ai.ai_interaction.model_state_cache import ModelStateCache
+from actuosus_ai.ai_interaction.profiler import SpanRecorder
+
+
+class TestInferenceScheduler:
+    @pytest.fixture
+    def tiny_hf_model(self):
+        from transformers import GPT2Config, GPT2LMHeadModel
+
+        torch.manual_seed(0)
+        return GPT2LMHeadModel(
+            GPT2Config(vocab_size=64, n_positions=64, n_embd=32, n_layer=2, n_head=2)
+        ).eval()
+
+    @pytest.fixture
+    def tokenizer(self, mocker):
+        tokenizer = mocker.MagicMock(name="tokenizer")
+        tokenizer.decode.side_effect = lambda token: str(int(token))
+        tokenizer.eos_token_id = -1
+        return tokenizer
+
+    @staticmethod
+    def _detokenizer(vocab_size):
+        # Every token decodes to its id
+        pieces = [str(token) for token in range(vocab_size)]
+        return Detokenizer(pieces, piece_bytes=[piece.encode() for piece in pieces])
+
+    @pytest.fixture
+    def scheduler(self, tiny_hf_model, tokenizer):
+        scheduler = InferenceScheduler(
+            tiny_hf_model, tokenizer, gguf=False, detokenizer=self._detokenizer(64)
+        )
+        yield scheduler
+        scheduler.close()
+
+    @staticmethod
+    def _assert_matches_full_recompute(model, prompt, steps):
+        sequence = list(prompt)
+        for step in steps:
+            with torch.no_grad():
+                expected = torch.softmax(
+                    model(torch.tensor([sequence])).logits[0, -1, :], dim=-1
+                )
+            for word, prob in step:
+                assert prob == pytest.approx(expected[int(word)].item(), abs=1e-5)
+            sequence.append(int(step[0][0]))
+
+    def test_batched_sequences_match_single_sequence_decoding(
+        self, mocker, scheduler, tiny_hf_model
+    ):
+        forward = mocker.spy(tiny_hf_model, "forward")
+        first_prompt, second_prompt = [1, 2, 3], [4, 5, 6, 7, 8, 9]
+
+        # Submit both before the worker wakes up so they share the batch
+        with scheduler._condition:
+            first = scheduler.submit(
+                first_prompt, 5, k=3, temperature=1.0, min_prob=0.0
+            )
+            second = scheduler.submit(
+                second_prompt, 5, k=3, temperature=1.0, min_prob=0.0
+            )
+        first_steps = list(first.stream())
+        second_steps = list(second.stream())
+
+        assert len(first_steps) == len(second_steps) == 5
+        assert any(call.args[0].shape[0] == 2 for call in forward.call_args_list)
+        self._assert_matches_full_recompute(tiny_hf_model, first_prompt, first_steps)
+        self._assert_matches_full_recompute(tiny_hf_model, second_prompt, second_steps)
+
+    def test_batch_is_rebuilt_only_when_sequences_join_or_leave(
+        self, mocker, scheduler, tiny_hf_model
+    ):
+        forward = mocker.spy(tiny_hf_model, "forward")
+        rebuild = mocker.spy(scheduler, "_rebuild_batch")
+
+        sequence = scheduler.submit([1, 2, 3], 5, k=3, temperature=1.0, min_prob=0.0)
+        steps = list(sequence.stream())
+
+        # One prefill, then four decode steps over the same batch
+        rebuild.assert_called_once()
+        decode_calls = forward.call_args_list[1:]
+        assert len(decode_calls) == 4
+        for call in decode_calls:
+            assert isinstance(call.kwargs["past_key_values"], DynamicCache)
+            assert call.kwargs["attention_mask"] is None
+        self._assert_matches_full_recompute(tiny_hf_model, [1, 2, 3], steps)
+
+    def test_cache_aware_model_matches_full_recompute(self, tokenizer):
+        from transformers import LlamaConfig, LlamaForCausalLM
+
+        torch.manual_seed(0)
+        model = LlamaForCausalLM(
+            LlamaConfig(
+                vocab_size=64,
+                hidden_size=32,
+                intermediate_size=64,
+                num_hidden_layers=2,
+                num_attention_heads=2,
+                max_position_embeddings=64,
+            )
+        ).eval()
+        scheduler = InferenceScheduler(
+            model, tokenizer, gguf=False, detokenizer=self._detokenizer(64)
+        )
+        first_prompt, second_prompt = [1, 2, 3], [4, 5, 6, 7, 8, 9]
+
+        try:
+            with scheduler._condition:
+                first = scheduler.submit(
+                    first_prompt, 3, k=3, temperature=1.0, min_prob=0.0
+                )
+                second = scheduler.submit(
+                    second_prompt, 5, k=3, temperature=1.0, min_prob=0.0
+                )
+            first_steps = list(first.stream())
+            second_steps = list(second.stream())
+        finally:
+            scheduler.close()
+
+        self._assert_matches_full_recompute(model, first_prompt, first_steps)
+        self._assert_matches_full_recompute(model, second_prompt, second_steps)
+
+    def test_checkpoint_does_not_keep_the_batch_alive(self, scheduler):
+        state_cache = ModelStateCache(budget_bytes=10**9)
+
+        with scheduler._condition:
+            first = scheduler.submit(
+                [1, 2, 3],
+                3,
+                k=3,
+                temperature=1.0,
+                min_prob=0.0,
+                state_cache=state_cache,
+            )
+            second = scheduler.submit(
+                [4, 5, 6, 7], 6, k=3, temperature=1.0, min_prob=0.0
+            )
+        list(first.stream())
+        list(second.stream())
+
+        _, past, _ = state_cache.longest_prefix(first.tokens)
+        for layer in past:
+            for tensor in layer:
+                assert tensor.untyped_storage().nbytes() == (
+                    tensor.numel() * tensor.element_size()
+                )
+
+    def test_sequence_leaves_batch_on_stop(self, mocker, scheduler):
+        # Stopped once the first token is out, whatever the thread timing
+        stop_event = mocker.MagicMock(spec=threading.Event)
+        stop_event.is_set.side_effect = [False, True]
+        state_cache = ModelStateCache(budget_bytes=10**9)
+        sequence = scheduler.submit(
+            [1, 2, 3],
+            50,
+            k=3,
+            temperature=1.0,
+            min_prob=0.0,
+            stop_event=stop_event,
+            state_cache=state_cache,
+        )
+
+        assert len(list(sequence.stream())) == 1
+        # The state is checkpointed when the sequence leaves
+        assert len(state_cache) == 1
+
+    def test_serial_source_runs_on_worker(self, scheduler):
+        scheduler.labels = ("serial-test", "gguf")
+
+        sequence = scheduler.submit_serial(iter([[("a", 1.0)], [("b", 1.0)]]))
+
+        assert list(sequence.stream()) == [[("a", 1.0)], [("b", 1.0)]]
+        # Timed on the worker, between the two tokens
+        latencies = INTER_TOKEN_LATENCY.labels("serial-test", "gguf").snapshot()[0]
+        assert sum(latencies) == 1
+
+    def test_profiled_sequence_records_its_phases(self, scheduler):
+        profiler = SpanRecorder()
+
+        sequence = scheduler.submit(
+            [1, 2, 3], 3, k=3, temperature=1.0, min_prob=0.0, profiler=profiler
+        )
+        list(sequence.stream())
+
+        phases = profiler.breakdown(1.0).phases
+        assert phases["prefill"].count == 1
+        assert phases["sampling"].count == 3
+        assert phases["decoding"].count == 3
+        # The last sampled token is not fed back
+        assert phases["forward"].count == 2
@@ -0,0 +1,56 @@
+import pytest
+
+from actuosus_ai.ai_interaction.load_progress import LoadProgressTracker
+from actuosus_ai.common.actuosus_exception import CancelledException
+
+
+class TestLoadProgressTracker:
+    @pytest.fixture
+    def weight_files(self, tmp_path):
+        paths = []
+        for i, size in enumerate((100, 250)):
+            path = tmp_path / f"model-{i}.safetensors"
+            path.write_bytes(b"\0" * size)
+            paths.append(str(path))
+        return paths
+
+    def test_read_files_reports_files_and_bytes(self, weight_files):
+        tracker = LoadProgressTracker()
+        tracker.CHUNK_SIZE = 64
+
+        tracker.read_files(weight_files)
+
+        progress = tracker.snapshot()
+        assert progress.stage == "reading"
+        assert (progress.files_read, progress.files_total) == (2, 2)
+        assert (progress.bytes_read, progress.bytes_total) == (350, 350)
+
+    def test_read_files_without_read_ahead_reports_totals_only(
+        self, mocker, weight_files
+    ):
+        tracker = LoadProgressTracker()
+        open_file = mocker.patch("builtins.open")
+
+        tracker.read_files(weight_files, read_ahead=False)
+
+        open_file.assert_not_called()
+        progress = tracker.snapshot()
+        assert (progress.files_read, progress.files_total) == (0, 2)
+        assert (progress.bytes_read, progress.bytes_total) == (0, 350)
+
+    def test_read_files_stops_when_cancelled(self, weight_files):
+        tracker = LoadProgressTracker()
+        tracker.CHUNK_SIZE = 64
+        update = tracker.update
+
+        def cancel_after_first_chunk(**changes):
+            update(**changes)
+            if changes.get("bytes_read"):
+                tracker.cancel_event.set()
+
+        tracker.update = cancel_after_first_chunk
+
+        with pytest.raises(CancelledException):
+            tracker.read_files(weight_files)
+        assert tracker.snapshot().bytes_read == 64
+        assert tracker.snapshot().files_read == 0
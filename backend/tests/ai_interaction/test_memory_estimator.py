@@ -0,0 +1,142 @@
+import json
+import os
+import struct
+
+import torch
+from safetensors.torch import save_file
+
+from actuosus_ai.ai_interaction.memory_estimator import (
+    estimate_memory,
+    estimate_model_memory,
+)
+from actuosus_ai.common.settings import Settings
+
+
+def _gguf_string(value):
+    data = value.encode()
+    return struct.pack("<Q", len(data)) + data
+
+
+def _write_gguf(path, tensor_bytes):
+    """GGUF file of a llama model with a 4 token vocabulary and one tensor"""
+    metadata = [
+        (_gguf_string("general.architecture"), 8, _gguf_string("llama")),
+        (_gguf_string("llama.context_length"), 4, struct.pack("<I", 64)),
+        (_gguf_string("llama.block_count"), 4, struct.pack("<I", 2)),
+        (_gguf_string("llama.embedding_length"), 4, struct.pack("<I", 32)),
+        (_gguf_string("llama.attention.head_count"), 4, struct.pack("<I", 4)),
+        (_gguf_string("llama.attention.head_count_kv"), 4, struct.pack("<I", 2)),
+        (
+            _gguf_string("tokenizer.ggml.tokens"),
+            9,
+            struct.pack("<IQ", 8, 4) + b"".join(_gguf_string(t) for t in "abcd"),
+        ),
+    ]
+    header = b"GGUF" + struct.pack("<IQQ", 3, 1, len(metadata))
+    for key, value_type, value in metadata:
+        header += key + struct.pack("<I", value_type) + value
+    # One float32 tensor at offset 0
+    header += _gguf_string("weight") + struct.pack("<IQIQ", 1, tensor_bytes // 4, 0, 0)
+    header += b"\0" * (-len(header) % 32)
+    with open(path, "wb") as file:
+        file.write(header + b"\0" * tensor_bytes)
+
+
+class TestMemoryEstimator:
+    def test_estimate_gguf(self, tmp_path):
+        # Arrange
+        _write_gguf(tmp_path / "model.gguf", 4096)
+
+        # Act
+        cpu = estimate_memory(str(tmp_path), "gguf", "model.gguf", gpu=False)
+        gpu = estimate_memory(str(tmp_path), "gguf", "model.gguf", gpu=True)
+
+        # Assert
+        # float16 keys and values of 64 tokens, 2 layers, 2 heads of 8
+        kv_cache = 64 * 2 * (16 + 16) * 2
+        # Logits of a 512 token batch and the context's token ids
+        host_buffers = 512 * 4 * 4 + 64 * 4
+        assert cpu.parameter_bytes == 4096
+        assert cpu.context_bytes == kv_cache + host_buffers
+        assert cpu.ram_bytes == 4096 + kv_cache + host_buffers
+        assert cpu.vram_bytes == 0
+        assert gpu.ram_bytes == host_buffers
+        assert gpu.vram_bytes == 4096 + kv_cache
+
+    def test_estimate_hf_quantizations(self, tmp_path):
+        # Arrange
+        save_file(
+            {
+                "model.embed_tokens.weight": torch.zeros(100, 8),
+                "model.layers.0.mlp.weight": torch.zeros(64, 8),
+                "model.norm.bias": torch.zeros(8),
+            },
+            os.path.join(tmp_path, "model.safetensors"),
+        )
+        config = {
+            "num_hidden_layers": 1,
+            "hidden_size": 8,
+            "num_attention_heads": 2,
+            "max_position_embeddings": 16,
+        }
+        (tmp_path / "config.json").write_text(json.dumps(config))
+
+        # Act
+        float32 = estimate_memory(str(tmp_path), None, None, gpu=False)
+        int8 = estimate_memory(str(tmp_path), "int8", None, gpu=True)
+        shorter = estimate_memory(str(tmp_path), None, None, False, context_tokens=4)
+
+        # Assert
+        assert float32.parameter_bytes == (800 + 512 + 8) * 4
+        assert float32.context_bytes == 2 * 16 * 8 * 4
+        assert float32.vram_bytes == 0
+        # Only the linear layer is quantized, the rest is float16
+        assert int8.parameter_bytes == 512 + (800 + 8) * 2
+        assert int8.vram_bytes == int8.parameter_bytes + 2 * 16 * 8 * 2
+        assert int8.ram_bytes == 0
+        assert shorter.context_bytes == 2 * 4 * 8 * 4
+
+    def test_long_context_is_opt_in(self, tmp_path):
+        # Arrange
+        save_file({"weight": torch.zeros(4, 4)}, tmp_path / "model.safetensors")
+        config = {
+            "num_hidden_layers": 1,
+            "hidden_size": 8,
+            "num_attention_heads": 2,
+            "max_position_embeddings": 131072,
+        }
+        (tmp_path / "config.json").write_text(json.dumps(config))
+        tokens = Settings().kv_cache_estimate_tokens
+
+        # Act
+        default = estimate_memory(str(tmp_path), None, None, False, tokens)
+        whole = estimate_memory(str(tmp_path), None, None, False, context_tokens=0)
+
+        # Assert
+        assert default.context_bytes == 2 * 4096 * 8 * 4
+        assert whole.context_bytes == 2 * 131072 * 8 * 4
+
+    def test_estimate_model_memory_lists_every_choice(self, tmp_path):
+        # Arrange
+        _write_gguf(tmp_path / "model.Q4_0.gguf", 64)
+        save_file({"weight": torch.zeros(4, 4)}, tmp_path / "model.safetensors")
+
+        # Act
+        estimates = estimate_model_memory(str(tmp_path), gpu=False)
+
+        # Assert
+        assert [(e.quantization, e.gguf_file_name) for e in estimates] == [
+            ("gguf", "model.Q4_0.gguf"),
+            (None, None),
+            ("bfloat16", None),
+        ]
+
+    def test_unknown_models_have_no_estimate(self, tmp_path):
+        # Arrange
+        (tmp_path / "pytorch_model.bin").write_bytes(b"weights")
+        (tmp_path / "broken.gguf").write_bytes(b"not a gguf file")
+
+        # Act & Assert
+        assert estimate_memory(str(tmp_path), None, None, gpu=False) is None
+        assert estimate_memory(str(tmp_path), "gguf", "broken.gguf", False) is None
+        assert estimate_model_memory(str(tmp_path / "missing"), gpu=False) == []
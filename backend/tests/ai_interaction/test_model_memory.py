@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import torch
+
+from actuosus_ai.ai_interaction.model_memory import (
+    hf_model_memory,
+    llama_model_memory,
+    process_memory,
+)
+
+
+class TestModelMemory:
+    @pytest.fixture
+    def llama(self, mocker):
+        mocker.patch("llama_cpp.llama_model_size", return_value=1000)
+        mocker.patch("llama_cpp.llama_model_n_layer", return_value=4)
+        mocker.patch("llama_cpp.llama_model_n_embd", return_value=64)
+        mocker.patch("llama_cpp.llama_model_n_head", return_value=8)
+        mocker.patch("llama_cpp.llama_model_n_head_kv", return_value=2)
+        model = mocker.MagicMock()
+        model.n_ctx.return_value = 128
+        # F16 keys and values, kept with the layers
+        model.context_params.type_k = 1
+        model.context_params.type_v = 1
+        model.context_params.offload_kqv = True
+        model.scores = np.zeros((8, 10), dtype=np.single)
+        model.input_ids = np.zeros(128, dtype=np.intc)
+        return model
+
+    def test_hf_model_memory_counts_parameters_and_buffers(self):
+        # Arrange
+        from transformers import GPT2Config, GPT2LMHeadModel
+
+        model = GPT2LMHeadModel(
+            GPT2Config(vocab_size=64, n_positions=64, n_embd=32, n_layer=2, n_head=2)
+        ).to(torch.bfloat16)
+
+        # Act
+        memory = hf_model_memory(model)
+
+        # Assert
+        assert memory.parameter_bytes == model.num_parameters() * 2
+        assert memory.buffer_bytes == sum(
+            buffer.numel() * buffer.element_size() for buffer in model.buffers()
+        )
+        assert memory.ram_bytes == memory.parameter_bytes + memory.buffer_bytes
+        assert memory.vram_bytes == 0
+
+    def test_llama_model_memory_on_cpu(self, mocker, llama):
+        # Arrange
+        mocker.patch("llama_cpp.llama_supports_gpu_offload", return_value=False)
+        llama.model_params.n_gpu_layers = -1
+
+        # Act
+        memory = llama_model_memory(llama)
+
+        # Assert
+        # Keys and values of 128 tokens over 4 layers, 16 wide with grouped heads
+        kv_cache = 2 * 128 * 4 * 16 * 2
+        host_buffers = 8 * 10 * 4 + 128 * 4
+        assert memory.parameter_bytes == 1000
+        assert memory.context_bytes == kv_cache + host_buffers
+        assert memory.ram_bytes == 1000 + kv_cache + host_buffers
+        assert memory.vram_bytes == 0
+
+    def test_llama_model_memory_splits_offloaded_layers(self, mocker, llama):
+        # Arrange
+        mocker.patch("llama_cpp.llama_supports_gpu_offload", return_value=True)
+        llama.model_params.n_gpu_layers = 2
+
+        # Act
+        memory = llama_model_memory(llama)
+
+        # Assert
+        kv_cache = 2 * 128 * 4 * 16 * 2
+        host_buffers = 8 * 10 * 4 + 128 * 4
+        assert memory.vram_bytes == 500 + kv_cache // 2
+        assert memory.ram_bytes == 500 + kv_cache // 2 + host_buffers
+
+    def test_process_memory(self, mocker):
+        # Arrange
+        mocker.patch(
+            "actuosus_ai.ai_interaction.model_memory.process_vram_bytes",
+            return_value=0,
+        )
+
+        # Act
+        memory = process_memory()
+
+        # Assert
+        assert memory.rss_bytes > 0
+        assert memory.pss_bytes > 0
+        assert memory.vram_bytes == 0
@@ -0,0 +1,231 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from actuosus_ai.ai_interaction.model_memory import ModelMemory
+from actuosus_ai.ai_interaction.model_registry import ModelRegistry
+from actuosus_ai.ai_interaction.model_state_cache import ModelStateCache
+from actuosus_ai.common.actuosus_exception import (
+    CancelledException,
+    InsufficientMemoryException,
+)
+
+
+class TestModelRegistry:
+    @pytest.fixture
+    def make_scheduler(self, mocker):
+        def make(estimated_ram=1.0, estimated_vram=0.0):
+            return mocker.MagicMock(
+                estimated_ram=estimated_ram,
+                estimated_vram=estimated_vram,
+                memory=ModelMemory(
+                    ram_bytes=int(estimated_ram * 1024**3),
+                    vram_bytes=int(estimated_vram * 1024**3),
+                ),
+                active_sequences=0,
+            )
+
+        return make
+
+    def test_acquire_shares_loaded_model(self, mocker, make_scheduler):
+        registry = ModelRegistry()
+        scheduler = make_scheduler()
+        load = mocker.MagicMock(return_value=scheduler)
+
+        assert registry.acquire((1, None, None), load) is scheduler
+        assert registry.acquire((1, None, None), load) is scheduler
+        load.assert_called_once()
+        assert registry.loaded_models()[0].users == 2
+
+    def test_release_keeps_model_warm(self, mocker, make_scheduler):
+        registry = ModelRegistry()
+        scheduler = make_scheduler()
+        load = mocker.MagicMock(return_value=scheduler)
+
+        registry.acquire((1, None, None), load)
+        registry.release((1, None, None))
+        assert registry.acquire((1, None, None), load) is scheduler
+
+        load.assert_called_once()
+        scheduler.close.assert_not_called()
+
+    def test_evicts_least_recently_used_idle_model(self, make_scheduler):
+        registry = ModelRegistry(ram_budget_gb=2.5)
+        first, second, third = make_scheduler(), make_scheduler(), make_scheduler()
+
+        registry.acquire((1, None, None), lambda: first)
+        registry.acquire((2, None, None), lambda: second)
+        registry.release((1, None, None))
+        registry.release((2, None, None))
+        # Using the first model again makes the second the least recently used
+        registry.acquire((1, None, None), lambda: first)
+        registry.acquire((3, None, None), lambda: third)
+
+        second.close.assert_called_once()
+        first.close.assert_not_called()
+        assert [model.ai_model_id for model in registry.loaded_models()] == [1, 3]
+
+    def test_models_in_use_are_not_evicted(self, make_scheduler):
+        registry = ModelRegistry(vram_budget_gb=1.0)
+        first = make_scheduler(estimated_vram=1.0)
+        second = make_scheduler(estimated_vram=1.0)
+
+        registry.acquire((1, "float16", None), lambda: first)
+        registry.acquire((2, "float16", None), lambda: second)
+        first.close.assert_not_called()
+
+        # Over budget, so the model is unloaded as soon as it is released
+        registry.release((1, "float16", None))
+        first.close.assert_called_once()
+        assert [model.ai_model_id for model in registry.loaded_models()] == [2]
+
+    def test_concurrent_acquire_waits_for_the_load(self, make_scheduler):
+        registry = ModelRegistry()
+        scheduler = make_scheduler()
+        loading = threading.Event()
+        finish = threading.Event()
+
+        def slow_load():
+            loading.set()
+            finish.wait()
+            return scheduler
+
+        first = threading.Thread(
+            target=registry.acquire, args=((1, None, None), slow_load)
+        )
+        first.start()
+        loading.wait()
+        second_load = mock.MagicMock()
+        waiting = threading.Thread(
+            target=registry.acquire, args=((1, None, None), second_load)
+        )
+        waiting.start()
+        finish.set()
+        first.join()
+        waiting.join()
+
+        second_load.assert_not_called()
+        assert registry.loaded_models()[0].users == 2
+
+    def test_cancel_while_waiting_for_another_load(self, make_scheduler):
+        registry = ModelRegistry()
+        loading = threading.Event()
+        finish = threading.Event()
+
+        def slow_load():
+            loading.set()
+            finish.wait()
+            return make_scheduler()
+
+        first = threading.Thread(
+            target=registry.acquire, args=((1, None, None), slow_load)
+        )
+        first.start()
+        loading.wait()
+        cancel_event = threading.Event()
+        cancel_event.set()
+
+        with pytest.raises(CancelledException):
+            registry.acquire((1, None, None), mock.MagicMock(), cancel_event)
+        finish.set()
+        first.join()
+        assert registry.loaded_models()[0].users == 1
+
+    def test_failed_load_is_not_registered(self, make_scheduler):
+        registry = ModelRegistry()
+
+        with pytest.raises(OSError):
+            registry.acquire((1, None, None), mock.MagicMock(side_effect=OSError))
+        scheduler = make_scheduler()
+        assert registry.acquire((1, None, None), lambda: scheduler) is scheduler
+
+    def test_evict_skips_models_in_use(self, make_scheduler):
+        registry = ModelRegistry()
+        scheduler = make_scheduler()
+        registry.acquire((1, "gguf", "model.gguf"), lambda: scheduler)
+
+        assert not registry.evict((1, "gguf", "model.gguf"))
+        registry.release((1, "gguf", "model.gguf"))
+        assert registry.evict((1, "gguf", "model.gguf"))
+        scheduler.close.assert_called_once()
+        assert registry.loaded_models() == []
+
+    def test_admission_evicts_idle_models_before_loading(self, make_scheduler):
+        registry = ModelRegistry(ram_budget_gb=2.0)
+        first = make_scheduler(estimated_ram=1.5)
+        registry.acquire((1, None, None), lambda: first)
+        registry.release((1, None, None))
+
+        def load():
+            # Unloaded before the new model takes its memory
+            first.close.assert_called_once()
+            return make_scheduler(estimated_ram=1.5)
+
+        registry.acquire((2, None, None), load, estimate=ModelMemory(ram_bytes=1024**3))
+
+        assert [model.ai_model_id for model in registry.loaded_models()] == [2]
+
+    def test_cached_states_are_dropped_before_idle_models(self, make_scheduler):
+        registry = ModelRegistry(ram_budget_gb=2.0, state_cache_bytes=1024**3)
+        cache = ModelStateCache(budget=registry.state_budget)
+        cache.put([1, 2], "state", 512 * 1024**2)
+        first = make_scheduler(estimated_ram=1.0)
+        registry.acquire((1, None, None), lambda: first)
+        registry.release((1, None, None))
+
+        registry.acquire(
+            (2, None, None),
+            lambda: make_scheduler(estimated_ram=0.75),
+            estimate=ModelMemory(ram_bytes=768 * 1024**2),
+        )
+
+        # The cached state made room, the idle model stays loaded
+        assert len(cache) == 0
+        first.close.assert_not_called()
+        assert len(registry.loaded_models()) == 2
+
+    def test_admission_rejects_model_over_budget(self):
+        registry = ModelRegistry(vram_budget_gb=1.0)
+        load = mock.MagicMock()
+
+        with pytest.raises(InsufficientMemoryException):
+            registry.acquire(
+                (1, "float16", None), load, estimate=ModelMemory(vram_bytes=2 * 1024**3)
+            )
+        load.assert_not_called()
+
+    def test_admission_queues_until_model_is_released(self, make_scheduler):
+        registry = ModelRegistry(ram_budget_gb=2.0)
+        registry.acquire((1, None, None), lambda: make_scheduler(estimated_ram=1.5))
+        queued = threading.Event()
+        second = make_scheduler(estimated_ram=1.5)
+        waiting = threading.Thread(
+            target=registry.acquire,
+            args=((2, None, None), lambda: second),
+            kwargs={
+                "estimate": ModelMemory(ram_bytes=1024**3),
+                "on_queued": queued.set,
+            },
+        )
+        waiting.start()
+        queued.wait()
+
+        registry.release((1, None, None))
+        waiting.join()
+
+        assert [model.ai_model_id for model in registry.loaded_models()] == [2]
+
+    def test_admission_times_out(self, make_scheduler):
+        registry = ModelRegistry(ram_budget_gb=2.0, admission_timeout=0.2)
+        registry.acquire((1, None, None), lambda: make_scheduler(estimated_ram=1.5))
+        on_queued = mock.MagicMock()
+
+        with pytest.raises(InsufficientMemoryException):
+            registry.acquire(
+                (2, None, None),
+                mock.MagicMock(),
+                estimate=ModelMemory(ram_bytes=1024**3),
+                on_queued=on_queued,
+            )
+        on_queued.assert_called_once()
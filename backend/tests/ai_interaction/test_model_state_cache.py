@@ -0,0 +1,72 @@
+import pytest
+
+from actuosus_ai.ai_interaction.model_state_cache import (
+    ModelStateCache,
+    StateCacheBudget,
+)
+
+
+class TestModelStateCache:
+    @pytest.fixture
+    def cache(self):
+        return ModelStateCache(budget_bytes=100)
+
+    def test_longest_prefix_empty(self, cache):
+        assert cache.longest_prefix([1, 2, 3]) == (0, None, ())
+
+    def test_longest_prefix_picks_best_match(self, cache):
+        cache.put([1, 2, 3, 4], "a", 10)
+        cache.put([1, 5, 6], "b", 10)
+
+        assert cache.longest_prefix([1, 2, 3, 9]) == (3, "a", (1, 2, 3, 4))
+        assert cache.longest_prefix([1, 5]) == (2, "b", (1, 5, 6))
+
+    def test_put_replaces_covered_prefixes(self, cache):
+        cache.put([1, 2], "short", 10)
+        cache.put([1, 2, 3], "long", 20)
+
+        assert len(cache) == 1
+        assert cache.used_bytes == 20
+
+        # A prefix of a stored sequence adds nothing
+        cache.put([1], "shorter", 5)
+        assert len(cache) == 1
+        assert cache.longest_prefix([1, 2, 3])[1] == "long"
+
+    def test_put_evicts_least_recently_used(self, cache):
+        cache.put([1], "a", 40)
+        cache.put([2], "b", 40)
+        cache.longest_prefix([1])
+        cache.put([3], "c", 40)
+
+        assert cache.longest_prefix([2]) == (0, None, ())
+        assert cache.longest_prefix([1])[1] == "a"
+        assert cache.used_bytes == 80
+
+    def test_put_skips_states_over_budget(self, cache):
+        cache.put([1], "huge", 1000)
+        assert len(cache) == 0
+
+    def test_clear(self, cache):
+        cache.put([1], "a", 10)
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.used_bytes == 0
+
+    def test_sessions_share_the_budget(self):
+        budget = StateCacheBudget(100)
+        first = ModelStateCache(budget=budget)
+        second = ModelStateCache(budget=budget)
+
+        first.put([1], "a", 40)
+        second.put([2], "b", 40, on_gpu=True)
+        first.longest_prefix([1])
+        second.put([3], "c", 40)
+
+        # The least recently used state of any session is dropped
+        assert len(first) == 1
+        assert second.longest_prefix([2]) == (0, None, ())
+        assert (budget.ram_bytes, budget.vram_bytes) == (80, 0)
+
+        first.clear()
+        assert budget.used_bytes == second.used_bytes == 40
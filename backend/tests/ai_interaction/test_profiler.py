@@ -0,0 +1,66 @@
+import json
+import threading
+
+import pytest
+
+from actuosus_ai.ai_interaction.profiler import DISABLED_RECORDER, SpanRecorder
+
+
+class TestSpanRecorder:
+    def test_disabled_recorder_keeps_nothing(self):
+        # Act
+        with DISABLED_RECORDER.span("sampling"):
+            pass
+        DISABLED_RECORDER.add("forward", 0.0, 1.0)
+
+        # Assert
+        assert DISABLED_RECORDER.spans == []
+        assert DISABLED_RECORDER.span("a") is DISABLED_RECORDER.span("b")
+
+    def test_breakdown_sums_each_phase(self):
+        # Arrange
+        recorder = SpanRecorder()
+
+        # Act
+        recorder.add("forward", 1.0, 1.25)
+        recorder.add("forward", 2.0, 2.5)
+        with recorder.span("sampling"):
+            pass
+        breakdown = recorder.breakdown(2.0)
+
+        # Assert
+        assert breakdown.total_ms == 2000
+        assert list(breakdown.phases) == ["forward", "sampling"]
+        assert breakdown.phases["forward"].count == 2
+        assert breakdown.phases["forward"].total_ms == pytest.approx(750)
+        assert breakdown.phases["sampling"].count == 1
+
+    def test_chrome_trace_has_a_track_per_thread(self, tmp_path):
+        # Arrange
+        recorder = SpanRecorder()
+        recorder.add("send", recorder.origin, recorder.origin + 0.001)
+        worker = threading.Thread(
+            target=lambda: recorder.add(
+                "forward", recorder.origin + 0.002, recorder.origin + 0.005
+            ),
+            name="inference-scheduler",
+        )
+        worker.start()
+        worker.join()
+        path = tmp_path / "traces" / "trace.json"
+
+        # Act
+        recorder.dump_chrome_trace(str(path))
+
+        # Assert
+        events = json.loads(path.read_text())["traceEvents"]
+        spans = [event for event in events if event["ph"] == "X"]
+        threads = {
+            event["args"]["name"]: event["tid"]
+            for event in events
+            if event["ph"] == "M"
+        }
+        assert [span["name"] for span in spans] == ["send", "forward"]
+        assert spans[1]["ts"] == pytest.approx(2000)
+        assert spans[1]["dur"] == pytest.approx(3000)
+        assert spans[1]["tid"] == threads["inference-scheduler"] != spans[0]["tid"]
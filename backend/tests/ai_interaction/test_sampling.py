@@ -0,0 +1,64 @@
+import pytest
+import torch
+
+from actuosus_ai.ai_interaction.sampling import sample_top_k, sample_top_k_single
+from actuosus_ai.common.actuosus_exception import InternalException
+
+
+class TestSampling:
+    def test_sample_top_k_returns_k_distinct_tokens_per_row(self):
+        logits = torch.randn(4, 100)
+
+        rows = sample_top_k(logits, k=10)
+
+        assert len(rows) == 4
+        for row, row_logits in zip(rows, logits):
+            tokens = [token for token, _ in row]
+            assert len(set(tokens)) == 10
+            expected = torch.softmax(row_logits, dim=-1)
+            for token, prob in row:
+                assert prob == pytest.approx(expected[token].item(), rel=1e-5)
+
+    def test_sample_top_k_sorts_alternatives_by_probability(self):
+        rows = sample_top_k(torch.randn(2, 50), k=8)
+
+        for row in rows:
+            probs = [prob for _, prob in row[1:]]
+            assert probs == sorted(probs, reverse=True)
+
+    def test_sample_top_k_skips_tokens_below_min_prob(self):
+        logits = torch.tensor([[10.0, 10.0, -10.0, -10.0, -10.0]])
+
+        row = sample_top_k(logits, k=4, min_prob=0.01)[0]
+
+        assert sorted(token for token, _ in row) == [0, 1]
+
+    def test_sample_top_k_per_row_settings(self):
+        logits = torch.tensor([[2.0, 1.0, 0.0], [2.0, 1.0, 0.0]])
+
+        rows = sample_top_k(
+            logits,
+            k=3,
+            temperature=[1.0, 0.5],
+            min_prob=[0.0, 0.5],
+        )
+
+        assert len(rows[0]) == 3
+        assert rows[1] == [
+            (0, pytest.approx(torch.softmax(logits[1] / 0.5, -1)[0].item()))
+        ]
+
+    def test_sample_top_k_first_token_follows_distribution(self):
+        torch.manual_seed(0)
+        logits = torch.log(torch.tensor([[0.7, 0.2, 0.1]]))
+
+        counts = [0, 0, 0]
+        for _ in range(2000):
+            counts[sample_top_k(logits, k=3)[0][0][0]] += 1
+
+        assert counts[0] / 2000 == pytest.approx(0.7, abs=0.05)
+        assert counts[2] / 2000 == pytest.approx(0.1, abs=0.05)
+
+    def test_sample_top_k_single_raises_when_all_below_min_prob(self):
+        with pytest.raises(InternalException):
+            sample_top_k_single(torch.zeros(1, 10), k=3, temperature=1.0, min_prob=0.5)
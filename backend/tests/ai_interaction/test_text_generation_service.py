@@ -1,7 +1,16 @@
-from unittest.mock import patch
 import pytest
 import torch
 
+from actuosus_ai.ai_interaction.detokenizer import Detokenizer
+from actuosus_ai.ai_interaction.inference_metrics import (
+    DECODE_STEP_SECONDS,
+    INTER_TOKEN_LATENCY,
+    PREFILL_SECONDS,
+    TIME_TO_FIRST_TOKEN,
+    TOKENS_PER_SECOND,
+)
+from actuosus_ai.ai_interaction.inference_scheduler import InferenceScheduler
+from actuosus_ai.ai_interaction.sampling import sample_top_k
 from actuosus_ai.ai_interaction.text_generation_service import TextGenerationService
 
 
@@ -50,54 +59,191 @@ class TestTextGenerationService:
     #         assert isinstance(token, torch.Tensor)
     #         assert isinstance(prob, float)
 
-    @pytest.mark.asyncio
-    @patch("actuosus_ai.ai_interaction.text_generation_service.AutoTokenizer")
-    @patch("actuosus_ai.ai_interaction.text_generation_service.AutoModelForCausalLM")
-    async def test_generate_with_alt(
-        self,
-        mocked_auto_model,
-        mocked_auto_tokenizer,
-        mocker,
-        mocked_ai_model_storage_service,
-    ):
-        # Mock the tokenizer and model
-        mocked_model = mocker.MagicMock(name="mocked_model")
-        mocked_auto_model.from_pretrained.return_value = mocked_model
-        model_on_device = mocker.MagicMock(name="model_on_device")
-        mocked_model.to.return_value = model_on_device
-        mocked_dto = mocker.MagicMock(storage_path="dummy_path")
-        mocked_ai_model_storage_service.get_model_by_id.return_value = mocked_dto
-        original_prompt = "Hello"
-
-        # Mock the tokenizer output
-        mocked_tokenizer = mocker.MagicMock(name="mocked_tokenizer")
-        mocked_auto_tokenizer.from_pretrained.return_value = mocked_tokenizer
-        mocked_tokenizer.encode.return_value = torch.tensor([[50256]])
-        mocked_tokenizer.decode.side_effect = lambda x: {
-            50256: "Hello",
-            50257: "world",
-            50258: "!",
-        }.get(x, "unknown")
-
-        # Mock the model output
-        mock_output = mocker.MagicMock(
-            logits=torch.randn(1, 10, 50259), name="mock_output"
+    @pytest.fixture
+    def tiny_hf_model(self):
+        from transformers import GPT2Config, GPT2LMHeadModel
+
+        # Tiny randomly initialized model so the tests run offline on CPU
+        torch.manual_seed(0)
+        return GPT2LMHeadModel(
+            GPT2Config(vocab_size=64, n_positions=64, n_embd=32, n_layer=2, n_head=2)
+        ).eval()
+
+    @staticmethod
+    def _detokenizer(vocab_size):
+        # Every token decodes to its id
+        pieces = [str(token) for token in range(vocab_size)]
+        return Detokenizer(pieces, piece_bytes=[piece.encode() for piece in pieces])
+
+    @pytest.fixture
+    def hf_service(self, mocker, mocked_ai_model_storage_service, tiny_hf_model):
+        tokenizer = mocker.MagicMock(name="tokenizer")
+        tokenizer.decode.side_effect = lambda token: str(int(token))
+        tokenizer.eos_token_id = -1
+
+        # Record the logits handed to the sampler at each step
+        step_logits = []
+
+        def recording_sampler(logits, k, temperature, min_prob):
+            step_logits.append(logits.clone())
+            return sample_top_k(logits, k, temperature, min_prob)
+
+        mocker.patch(
+            "actuosus_ai.ai_interaction.inference_scheduler.sample_top_k",
+            side_effect=recording_sampler,
         )
-        model_on_device.return_value = mock_output
 
-        # Create a TextGenerationService instance
         service = TextGenerationService(mocked_ai_model_storage_service)
-        await service.load_model(ai_model_id=1)
+        service.model = tiny_hf_model
+        service.tokenizer = tokenizer
+        service.device = tiny_hf_model.device
+        service.scheduler = InferenceScheduler(
+            tiny_hf_model, tokenizer, gguf=False, detokenizer=self._detokenizer(64)
+        )
+        service.step_logits = step_logits
+        yield service
+        service.scheduler.close()
+
+    @staticmethod
+    def _generate_hf(service, tokens, max_new_tokens):
+        service.tokenizer.encode.return_value = torch.tensor([tokens])
+        return list(
+            service.generate_tokens_with_probabilities_hf(
+                prompt="",
+                max_length=None,
+                max_new_tokens=max_new_tokens,
+                k=3,
+                temperature=1.0,
+                min_prob=0.0,
+            )
+        )
+
+    def test_generate_hf_cached_matches_full_recompute(self, hf_service, tiny_hf_model):
+        generated = self._generate_hf(hf_service, [1, 2, 3, 4, 5], 8)
+        chosen = [int(step[0][0]) for step in generated]
+
+        # Recompute every step over the full sequence without a cache
+        sequence = [1, 2, 3, 4, 5]
+        for step, logits in enumerate(hf_service.step_logits):
+            with torch.no_grad():
+                expected = tiny_hf_model(torch.tensor([sequence])).logits[:, -1, :]
+            assert torch.allclose(
+                torch.softmax(logits, dim=-1),
+                torch.softmax(expected, dim=-1),
+                atol=1e-5,
+            )
+            if step < len(chosen):
+                sequence.append(chosen[step])
+
+    def test_generate_hf_branch_reuses_cached_prefix(
+        self, mocker, hf_service, tiny_hf_model
+    ):
+        first = self._generate_hf(hf_service, [1, 2, 3, 4, 5], 6)
+        assert len(hf_service.state_cache) == 1
+
+        # Branch off after the third generated token with a different word
+        branch = [1, 2, 3, 4, 5] + [int(step[0][0]) for step in first[:3]] + [7]
+        forward = mocker.spy(tiny_hf_model, "forward")
+        hf_service.step_logits.clear()
+        self._generate_hf(hf_service, branch, 1)
+
+        # Only the diverging token is prefilled
+        assert forward.call_args_list[0].args[0].shape == (1, 1)
+        with torch.no_grad():
+            expected = tiny_hf_model(torch.tensor([branch])).logits[:, -1, :]
+        assert torch.allclose(
+            torch.softmax(hf_service.step_logits[0], dim=-1),
+            torch.softmax(expected, dim=-1),
+            atol=1e-5,
+        )
+
+    def test_generate_records_latency_metrics(self, hf_service):
+        # Arrange
+        labels = ("metrics-test", "none")
+        hf_service.metric_labels = labels
+        hf_service.scheduler.labels = labels
+        hf_service.tokenizer.encode.return_value = torch.tensor([[1, 2, 3]])
+
+        # Act
+        generated = list(
+            hf_service.generate_tokens_with_probabilities(
+                "", max_new_tokens=4, k=3, min_prob=0.0
+            )
+        )
+
+        # Assert, the four tokens take one prefill and three decode steps
+        def count(histogram):
+            return sum(histogram.labels(*labels).snapshot()[0])
+
+        assert len(generated) == 4
+        assert count(TIME_TO_FIRST_TOKEN) == 1
+        assert count(INTER_TOKEN_LATENCY) == 3
+        assert count(TOKENS_PER_SECOND) == 1
+        assert count(PREFILL_SECONDS) == 1
+        assert count(DECODE_STEP_SECONDS) == 3
+
+    def test_generate_gguf_keeps_live_context_prefix(
+        self, mocker, mocked_ai_model_storage_service
+    ):
+        import ctypes
+
+        import numpy as np
 
-        # Mock the generate_top_k_token_with_prob method
-        mocker.patch.object(
-            service,
-            "generate_top_k_token_with_prob",
-            return_value=[(torch.tensor(50257), 0.9), (torch.tensor(50258), 0.8)],
+        # The service imports llama_cpp when it runs
+        module = "llama_cpp"
+        # Only tokens 0, 1 and 2 are above min_prob
+        logits = (ctypes.c_float * 8)(5.0, 5.0, 5.0, -100, -100, -100, -100, -100)
+        mocker.patch(
+            f"{module}.llama_get_logits",
+            return_value=ctypes.cast(logits, ctypes.POINTER(ctypes.c_float)),
         )
+        mocker.patch(f"{module}.llama_state_seq_get_size", return_value=0)
+        mocker.patch(f"{module}.llama_state_seq_get_data")
+
+        model = mocker.MagicMock(name="llama")
+        model.input_ids = np.zeros(64, dtype=np.intc)
+        model.n_tokens = 0
+        model.n_vocab.return_value = 8
+        model.token_eos.return_value = -1
+
+        def fake_eval(tokens):
+            model.input_ids[model.n_tokens : model.n_tokens + len(tokens)] = tokens
+            model.n_tokens += len(tokens)
+
+        def fake_reset():
+            model.n_tokens = 0
+
+        model.eval.side_effect = fake_eval
+        model.reset.side_effect = fake_reset
+
+        tokenizer = mocker.MagicMock(name="tokenizer")
+
+        service = TextGenerationService(mocked_ai_model_storage_service)
+        service.model = model
+        service.tokenizer = tokenizer
+        service.detokenizer = self._detokenizer(8)
+        service.gguf = True
+
+        def generate(tokens):
+            tokenizer.encode.return_value = tokens
+            return list(
+                service.generate_tokens_with_probabilities_gguf(
+                    prompt="",
+                    max_length=None,
+                    max_new_tokens=2,
+                    k=3,
+                    temperature=1.0,
+                    min_prob=0.01,
+                )
+            )
+
+        generate([1, 2, 3])
+        assert model.eval.call_args_list[0].args[0] == [1, 2, 3]
 
-        # Call the method
-        result = service.generate_with_alt(original_prompt)
+        model.eval.reset_mock()
+        generate([1, 2, 3, 5, 6])
 
-        # Check the output
-        assert result is not None
+        # The shared prefix stays in the context, only the suffix is evaluated
+        model.reset.assert_called_once()
+        assert model.eval.call_args_list[0].args[0] == [5, 6]
+        assert model.input_ids[:4].tolist() == [1, 2, 3, 5]
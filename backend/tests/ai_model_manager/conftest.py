@@ -0,0 +1,73 @@
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class HubStandIn:
+    """Serves files at /{repo}/resolve/{revision}/{name} like the hub, with Range"""
+
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.support_ranges = True
+        # Range starts that fail once with a 500
+        self.fail_once = set()
+        self._lock = threading.Lock()
+
+    def add(self, repo, revision, name, data):
+        self.files[f"/{repo}/resolve/{revision}/{name}"] = data
+
+    def handle(self, handler):
+        data = self.files.get(handler.path)
+        range_header = handler.headers.get("Range")
+        with self._lock:
+            self.requests.append((handler.command, handler.path, range_header))
+        if data is None:
+            handler.send_response(404)
+            handler.end_headers()
+            return
+
+        status, body = 200, data
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", range_header or "")
+        if match and self.support_ranges:
+            start, end = int(match[1]), int(match[2])
+            with self._lock:
+                if start in self.fail_once:
+                    self.fail_once.discard(start)
+                    handler.send_response(500)
+                    handler.end_headers()
+                    return
+            status, body = 206, data[start : end + 1]
+            handler.send_response(status)
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            handler.send_response(status)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        if handler.command == "GET":
+            handler.wfile.write(body)
+
+
+@pytest.fixture
+def hub_server():
+    hub = HubStandIn()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hub.handle(self)
+
+        def do_HEAD(self):
+            hub.handle(self)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    hub.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield hub
+    server.shutdown()
+    server.server_close()
@@ -1,12 +1,26 @@
+import hashlib
+import os
 from unittest.mock import patch
 
 import pytest
 from huggingface_hub import HfApi
 
 from actuosus_ai.ai_model_manager.ai_model_download_service import (
+    DOWNLOAD_DIR_NAME,
     AIModelDownloadService,
 )
-from actuosus_ai.common.actuosus_exception import InternalException
+from actuosus_ai.ai_model_manager.download_progress import (
+    DownloadJob,
+    DownloadProgressTracker,
+)
+from actuosus_ai.ai_model_manager.dto import FileSelectionDTO, RemoteFileDTO
+from actuosus_ai.common.actuosus_exception import (
+    CancelledException,
+    InternalException,
+    ValidationException,
+)
+
+WEIGHTS = bytes(range(256)) * 10000
 
 
 class TestAIModelDownloadService:
@@ -15,67 +29,332 @@ class TestAIModelDownloadService:
         return mocker.AsyncMock()
 
     @pytest.fixture
-    def mocked_settings(self, mocker):
-        return mocker.MagicMock(base_storage_path="some path")
+    def settings(self, mocker, tmp_path):
+        return mocker.MagicMock(
+            base_file_storage_path=str(tmp_path),
+            huggingface_token=None,
+            download_chunk_mb=1,
+            download_parallel_chunks=3,
+        )
+
+    @pytest.fixture
+    def model_info(self, mocker, hub_server):
+        # A small config and a weight file split over three 1 MB chunks
+        files = {
+            "config.json": b"{}",
+            "model.safetensors": WEIGHTS,
+        }
+        for name, data in files.items():
+            hub_server.add("org/model", "abc123", name, data)
+        return mocker.MagicMock(
+            pipeline_tag="text-generation",
+            sha="abc123",
+            siblings=[
+                mocker.MagicMock(rfilename="config.json", size=2, lfs=None),
+                mocker.MagicMock(
+                    rfilename="model.safetensors",
+                    size=len(WEIGHTS),
+                    lfs=mocker.MagicMock(sha256=hashlib.sha256(WEIGHTS).hexdigest()),
+                ),
+            ],
+        )
+
+    @pytest.fixture
+    def service(self, mocked_ai_model_storage_service, settings, hub_server):
+        return AIModelDownloadService(
+            mocked_ai_model_storage_service, settings, endpoint=hub_server.url
+        )
 
     @pytest.mark.asyncio
     @patch.object(HfApi, "model_info")
-    @patch("actuosus_ai.ai_model_manager.ai_model_download_service.snapshot_download")
     async def test_download_hugging_face_lm_success(
         self,
-        mocked_snapshot_download,
         mocked_model_info,
-        mocker,
+        tmp_path,
+        hub_server,
+        model_info,
+        service,
         mocked_ai_model_storage_service,
-        mocked_settings,
     ):
         # Arrange
-        model_name = "some_model_name"
-        mocked_model_info.return_value = mocker.MagicMock(
-            pipeline_tag="some pipeline value"
+        mocked_model_info.return_value = model_info
+        progress = DownloadProgressTracker(DownloadJob(hf_model_id="org/model"))
+
+        # Act
+        await service.download_lm_from_hugging_face("org/model", progress)
+
+        # Assert
+        storage_path = tmp_path / "org/model"
+        assert (storage_path / "config.json").read_bytes() == b"{}"
+        assert (storage_path / "model.safetensors").read_bytes() == WEIGHTS
+        job = progress.snapshot()
+        assert (job.files_done, job.files_total) == (2, 2)
+        assert job.bytes_done == job.bytes_total == len(WEIGHTS) + 2
+        ranges = [request[2] for request in hub_server.requests if request[2]]
+        assert len(ranges) == 3
+        # Nothing is left behind in the staging directory
+        assert not (tmp_path / DOWNLOAD_DIR_NAME).exists()
+        mocked_ai_model_storage_service.add_new_model.assert_called_once()
+        new_model = mocked_ai_model_storage_service.add_new_model.call_args.args[0]
+        assert new_model.storage_path == str(storage_path)
+        assert new_model.pipeline_tag == "text-generation"
+
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_failed_download_resumes(
+        self,
+        mocked_model_info,
+        tmp_path,
+        hub_server,
+        model_info,
+        service,
+        mocked_ai_model_storage_service,
+    ):
+        # Arrange
+        mocked_model_info.return_value = model_info
+        hub_server.fail_once.add(1024**2)
+
+        # Act
+        with pytest.raises(InternalException):
+            await service.download_lm_from_hugging_face("org/model")
+        hub_server.requests.clear()
+        await service.download_lm_from_hugging_face("org/model")
+
+        # Assert, only the failed chunk is downloaded again
+        assert hub_server.requests == [
+            (
+                "GET",
+                "/org/model/resolve/abc123/model.safetensors",
+                f"bytes={1024**2}-{2 * 1024**2 - 1}",
+            )
+        ]
+        assert (tmp_path / "org/model/model.safetensors").read_bytes() == WEIGHTS
+        mocked_ai_model_storage_service.add_new_model.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_cancelled_download_removes_its_files(
+        self,
+        mocked_model_info,
+        tmp_path,
+        model_info,
+        service,
+        mocked_ai_model_storage_service,
+    ):
+        # Arrange
+        mocked_model_info.return_value = model_info
+        progress = DownloadProgressTracker(DownloadJob(hf_model_id="org/model"))
+        progress.cancel_event.set()
+
+        # Act
+        with pytest.raises(CancelledException):
+            await service.download_lm_from_hugging_face("org/model", progress)
+
+        # Assert
+        assert not (tmp_path / DOWNLOAD_DIR_NAME).exists()
+        assert not (tmp_path / "org").exists()
+        mocked_ai_model_storage_service.add_new_model.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_download_links_files_already_in_blob_store(
+        self,
+        mocked_model_info,
+        tmp_path,
+        hub_server,
+        model_info,
+        service,
+    ):
+        # Arrange
+        mocked_model_info.return_value = model_info
+        existing = tmp_path / "other_model"
+        existing.mkdir()
+        (existing / "model.safetensors").write_bytes(WEIGHTS)
+        digest = service.blob_store.ingest_tree(str(existing))["model.safetensors"]
+
+        # Act
+        await service.download_lm_from_hugging_face("org/model")
+
+        # Assert
+        assert [request[1] for request in hub_server.requests] == [
+            "/org/model/resolve/abc123/config.json"
+        ]
+        assert service.blob_store.refcount(digest) == 2
+        assert os.path.samefile(
+            existing / "model.safetensors", tmp_path / "org/model/model.safetensors"
         )
-        mocked_ai_model_storage_service.add_new_model.return_value = None
-        service = AIModelDownloadService(
-            mocked_ai_model_storage_service, mocked_settings
+
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_download_rejects_corrupted_files(
+        self,
+        mocked_model_info,
+        model_info,
+        service,
+        mocked_ai_model_storage_service,
+    ):
+        # Arrange
+        model_info.siblings[1].lfs.sha256 = "0" * 64
+        mocked_model_info.return_value = model_info
+
+        # Act & Assert
+        with pytest.raises(InternalException, match="Checksum mismatch"):
+            await service.download_lm_from_hugging_face("org/model")
+        mocked_ai_model_storage_service.add_new_model.assert_not_called()
+
+    @pytest.fixture
+    def gguf_info(self, mocker, hub_server):
+        # A GGUF repo with one file per quantization
+        files = {
+            "README.md": b"# model",
+            "model.Q4_K_M.gguf": b"q4" * 100,
+            "model.Q8_0.gguf": b"q8" * 200,
+            "model.F16.gguf": b"f16" * 300,
+        }
+        for name, data in files.items():
+            hub_server.add("org/model-GGUF", "def456", name, data)
+        return mocker.MagicMock(
+            pipeline_tag="text-generation",
+            sha="def456",
+            siblings=[
+                mocker.MagicMock(rfilename=name, size=len(data), lfs=None)
+                for name, data in files.items()
+            ],
         )
 
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_download_only_selected_files(
+        self,
+        mocked_model_info,
+        tmp_path,
+        hub_server,
+        gguf_info,
+        service,
+        mocked_ai_model_storage_service,
+    ):
+        # Arrange
+        mocked_model_info.return_value = gguf_info
+        selection = FileSelectionDTO(files=["README.md"], include=["*Q4_K_M*"])
+        progress = DownloadProgressTracker(DownloadJob(hf_model_id="org/model-GGUF"))
+
         # Act
-        await service.download_lm_from_hugging_face(model_name)
+        await service.download_lm_from_hugging_face(
+            "org/model-GGUF", progress, selection
+        )
 
         # Assert
-        mocked_snapshot_download.assert_called_once()
+        assert sorted(os.listdir(tmp_path / "org/model-GGUF")) == [
+            "README.md",
+            "model.Q4_K_M.gguf",
+        ]
+        assert sorted(request[1] for request in hub_server.requests) == [
+            "/org/model-GGUF/resolve/def456/README.md",
+            "/org/model-GGUF/resolve/def456/model.Q4_K_M.gguf",
+        ]
+        assert progress.snapshot().bytes_total == 7 + 200
         mocked_ai_model_storage_service.add_new_model.assert_called_once()
 
     @pytest.mark.asyncio
-    @patch("actuosus_ai.ai_model_manager.ai_model_download_service.HfApi")
-    async def test_get_model_info(self, mock_hf_api, mocker):
+    @patch.object(HfApi, "model_info")
+    async def test_add_files_to_registered_model(
+        self,
+        mocked_model_info,
+        mocker,
+        tmp_path,
+        hub_server,
+        gguf_info,
+        service,
+        mocked_ai_model_storage_service,
+    ):
         # Arrange
-        mock_hf_api.return_value.list_models.return_value = [
-            mocker.MagicMock(id="model1")
+        mocked_model_info.return_value = gguf_info
+        storage_path = tmp_path / "org/model-GGUF"
+        storage_path.mkdir(parents=True)
+        (storage_path / "model.Q4_K_M.gguf").write_bytes(b"q4" * 100)
+        mocked_ai_model_storage_service.get_model_by_id.return_value = mocker.MagicMock(
+            storage_path=str(storage_path)
+        )
+        selection = FileSelectionDTO(include=["*.gguf"], exclude=["*F16*"])
+
+        # Act
+        await service.download_lm_from_hugging_face(
+            "org/model-GGUF", selection=selection, ai_model_id=1
+        )
+
+        # Assert, only the missing quantization is downloaded
+        assert [request[1] for request in hub_server.requests] == [
+            "/org/model-GGUF/resolve/def456/model.Q8_0.gguf"
         ]
-        model_name = "test_model"
+        assert sorted(os.listdir(storage_path)) == [
+            "model.Q4_K_M.gguf",
+            "model.Q8_0.gguf",
+        ]
+        assert not (tmp_path / DOWNLOAD_DIR_NAME).exists()
+        mocked_ai_model_storage_service.add_new_model.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_download_rejects_unknown_files(
+        self, mocked_model_info, gguf_info, service, mocked_ai_model_storage_service
+    ):
+        # Arrange
+        mocked_model_info.return_value = gguf_info
+
+        # Act & Assert
+        with pytest.raises(ValidationException, match="model.Q2_K.gguf"):
+            await service.download_lm_from_hugging_face(
+                "org/model-GGUF", selection=FileSelectionDTO(files=["model.Q2_K.gguf"])
+            )
+        with pytest.raises(ValidationException, match="No files"):
+            await service.download_lm_from_hugging_face(
+                "org/model-GGUF", selection=FileSelectionDTO(include=["*.safetensors"])
+            )
+        mocked_ai_model_storage_service.add_new_model.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch.object(HfApi, "model_info")
+    async def test_list_remote_files(self, mocked_model_info, gguf_info, service):
+        # Arrange
+        mocked_model_info.return_value = gguf_info
 
         # Act
-        result = await AIModelDownloadService.search_hub_with_name(model_name, 10)
+        files = await service.list_remote_files("org/model-GGUF")
 
         # Assert
-        assert result == ["model1"]
-        mock_hf_api.return_value.list_models.assert_called_once_with(
-            search=model_name, limit=10
+        assert files[1] == RemoteFileDTO(name="model.Q4_K_M.gguf", size=200)
+        assert len(files) == 4
+        mocked_model_info.assert_called_once_with("org/model-GGUF", files_metadata=True)
+
+    @pytest.mark.asyncio
+    async def test_search_hub_with_name(self, mocker, settings):
+        # Arrange
+        hub_client = mocker.AsyncMock()
+        hub_client.search.return_value = ["model1"]
+        service = AIModelDownloadService(
+            mocker.AsyncMock(), settings, hub_client=hub_client
         )
 
+        # Act
+        result = await service.search_hub_with_name("test_model", 10)
+
+        # Assert
+        assert result == ["model1"]
+        hub_client.search.assert_called_once_with("test_model", 10)
+
     @pytest.mark.asyncio
-    @patch("actuosus_ai.ai_model_manager.ai_model_download_service.HfApi")
-    async def test_get_model_info_raises_internal_exception(self, mock_hf_api):
+    async def test_search_hub_with_name_raises_internal_exception(
+        self, mocker, settings
+    ):
         # Arrange
-        mock_hf_api.return_value.list_models.side_effect = Exception("Test exception")
-        model_name = "test_model"
+        hub_client = mocker.AsyncMock()
+        hub_client.search.side_effect = Exception("Test exception")
+        service = AIModelDownloadService(
+            mocker.AsyncMock(), settings, hub_client=hub_client
+        )
 
         # Act & Assert
         with pytest.raises(InternalException) as exc_info:
-            await AIModelDownloadService.search_hub_with_name(model_name, 10)
+            await service.search_hub_with_name("test_model", 10)
 
         assert str(exc_info.value) == "Test exception"
-        mock_hf_api.return_value.list_models.assert_called_once_with(
-            search=model_name, limit=10
-        )
@@ -1,12 +1,19 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest.mock import patch
 
 import pytest
+import pytest_asyncio
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from actuosus_ai.ai_model_manager.dto import AIModelDTO, CreateNewAIModelDTO
+from actuosus_ai.ai_model_manager import orm
 from actuosus_ai.ai_model_manager.ai_model_storage_service import AIModelStorageService
-from actuosus_ai.ai_model_manager.orm import AIModelORM
-from actuosus_ai.common.actuosus_exception import InternalException
+from actuosus_ai.ai_model_manager.orm import AIModelORM, create_schema
+from actuosus_ai.common.actuosus_exception import (
+    InternalException,
+    ValidationException,
+)
 
 
 class TestAIModelStorageService:
@@ -20,6 +27,30 @@ class TestAIModelStorageService:
     def mocked_async_session(self, mocker):
         return mocker.AsyncMock()
 
+    @pytest_asyncio.fixture
+    async def sqlite_session(self):
+        async_engine = create_async_engine("sqlite+aiosqlite://")
+        async with async_engine.begin() as conn:
+            await conn.run_sync(create_schema)
+        start = datetime(2024, 1, 1)
+        async with async_sessionmaker(async_engine)() as session:
+            session.add_all(
+                AIModelORM(
+                    name=name,
+                    pipeline_tag="text-generation",
+                    storage_path=name,
+                    # Two models per timestamp to exercise the ai_model_id tiebreak
+                    created_at=start + timedelta(days=i // 2),
+                    updated_at=start,
+                )
+                for i, name in enumerate(
+                    ["gpt2", "Llama-3-8B", "llama-2", "TinyLlama", "qwen", "phi-2"]
+                )
+            )
+            await session.commit()
+            yield session
+        await async_engine.dispose()
+
     @pytest.fixture
     def mocked_model(self, mocker):
         return mocker.MagicMock()
@@ -67,6 +98,7 @@ class TestAIModelStorageService:
     @pytest.mark.asyncio
     async def test_update_model_success(
         self,
+        tmp_path,
         mocked_settings,
         mocked_async_session,
         mocked_model,
@@ -74,6 +106,7 @@ class TestAIModelStorageService:
         example_dto,
     ):
         # Arrange
+        example_dto.storage_path = str(tmp_path)
         service = AIModelStorageService(mocked_settings, mocked_async_session)
 
         # Act
@@ -259,7 +292,9 @@ class TestAIModelStorageService:
             return_value=example_dto
         )
 
-        with patch("shutil.copytree") as mock_copytree, patch(
+        with patch(
+            "actuosus_ai.ai_model_manager.ai_model_storage_service.copy_model_tree"
+        ) as mock_copy_model_tree, patch(
             "uuid.uuid4", return_value="new_uuid"
         ), patch.object(service, "get_model_by_id", return_value=example_dto):
             # Act
@@ -268,6 +303,124 @@ class TestAIModelStorageService:
             # Assert
             mocked_async_session.add.assert_called_once()
             mocked_async_session.commit.assert_called_once()
-            mock_copytree.assert_called_once_with(
-                example_dto.storage_path, new_model_storage_path
+            mock_copy_model_tree.assert_called_once_with(
+                example_dto.storage_path, new_model_storage_path, False
             )
+
+    @pytest.mark.asyncio
+    async def test_get_models_searches_names_with_fts(
+        self, mocked_settings, sqlite_session
+    ):
+        # Arrange
+        service = AIModelStorageService(mocked_settings, sqlite_session)
+
+        # Act
+        models = await service.get_models(name="llama")
+        short = await service.get_models(name="i-")
+
+        # Assert
+        assert [model.name for model in models] == [
+            "Llama-3-8B",
+            "llama-2",
+            "TinyLlama",
+        ]
+        # Too short for the trigram index, falls back to contains
+        assert [model.name for model in short] == ["phi-2"]
+
+    @pytest.mark.asyncio
+    async def test_get_models_searches_names_without_fts(
+        self, mocker, caplog, mocked_settings
+    ):
+        # Arrange, an SQLite without the trigram tokenizer
+        mocker.patch.object(
+            orm, "_FTS5_TRIGRAM_PROBE", "CREATE VIRTUAL TABLE probe USING missing(name)"
+        )
+        orm.sqlite_has_fts5_trigram.cache_clear()
+        async_engine = create_async_engine("sqlite+aiosqlite://")
+        try:
+            async with async_engine.begin() as conn:
+                await conn.run_sync(create_schema)
+                tables = await conn.run_sync(
+                    lambda sync: inspect(sync).get_table_names()
+                )
+            async with async_sessionmaker(async_engine)() as session:
+                session.add(
+                    AIModelORM(
+                        name="TinyLlama",
+                        pipeline_tag="text-generation",
+                        storage_path="a",
+                    )
+                )
+                await session.commit()
+                service = AIModelStorageService(mocked_settings, session)
+
+                # Act
+                models = await service.get_models(name="llama")
+        finally:
+            await async_engine.dispose()
+            orm.sqlite_has_fts5_trigram.cache_clear()
+
+        # Assert
+        assert orm.AI_MODEL_FTS_TABLE not in tables
+        assert [model.name for model in models] == ["TinyLlama"]
+        assert "searching them with LIKE" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_get_models_search_follows_renames(
+        self, mocked_settings, sqlite_session
+    ):
+        # Arrange
+        service = AIModelStorageService(mocked_settings, sqlite_session)
+        model = await sqlite_session.get(AIModelORM, 1)
+        model.name = "mistral"
+        await sqlite_session.commit()
+
+        # Act
+        old = await service.get_models(name="gpt2")
+        new = await service.get_models(name="stral")
+
+        # Assert
+        assert old == []
+        assert [model.ai_model_id for model in new] == [1]
+
+    @pytest.mark.asyncio
+    async def test_get_models_cursor_pages_through_every_model(
+        self, mocked_settings, sqlite_session
+    ):
+        # Arrange
+        service = AIModelStorageService(mocked_settings, sqlite_session)
+        expected = await service.get_models(order_by="created_at", is_desc=True)
+
+        # Act
+        pages = []
+        cursor = None
+        while True:
+            page = await service.get_models(
+                limit=4, order_by="created_at", is_desc=True, cursor=cursor
+            )
+            pages.append(page)
+            if len(page) < 4:
+                break
+            cursor = service.encode_cursor(page[-1], "created_at")
+
+        # Assert
+        assert [len(page) for page in pages] == [4, 2]
+        assert [model for page in pages for model in page] == expected
+        assert [model.ai_model_id for model in expected] == [6, 5, 4, 3, 2, 1]
+
+    @pytest.mark.asyncio
+    async def test_get_models_rejects_invalid_cursor(
+        self, mocked_settings, mocked_async_session, example_dto
+    ):
+        # Arrange
+        service = AIModelStorageService(mocked_settings, mocked_async_session)
+        cursor = service.encode_cursor(example_dto)
+
+        # Act & Assert
+        with pytest.raises(ValidationException):
+            await service.get_models(cursor="not a cursor")
+        with pytest.raises(ValidationException):
+            # A cursor of another order
+            await service.get_models(order_by="created_at", cursor=cursor)
+        with pytest.raises(ValidationException):
+            await service.get_models(order_by="storage_paths")
@@ -0,0 +1,91 @@
+import hashlib
+import os
+
+import pytest
+
+from actuosus_ai.ai_model_manager.blob_store import BlobStore
+from actuosus_ai.ai_model_manager.model_files import copy_model_tree
+
+
+class TestBlobStore:
+    @pytest.fixture
+    def store(self, tmp_path):
+        return BlobStore(str(tmp_path / ".blobs"))
+
+    @staticmethod
+    def _model(directory, weights=b"weights"):
+        directory.mkdir(parents=True)
+        (directory / "model.safetensors").write_bytes(weights)
+        (directory / "config.json").write_text("{}")
+        return directory
+
+    def test_ingest_tree_stores_weight_files(self, tmp_path, store):
+        # Arrange
+        model = self._model(tmp_path / "a")
+        digest = hashlib.sha256(b"weights").hexdigest()
+
+        # Act
+        manifest = store.ingest_tree(str(model))
+
+        # Assert
+        assert manifest == {"model.safetensors": digest}
+        assert os.path.samefile(store.blob_path(digest), model / "model.safetensors")
+        assert store.refcount(digest) == 1
+        # Config files stay private to the model
+        assert (model / "config.json").stat().st_nlink == 1
+
+    def test_identical_files_are_stored_once(self, tmp_path, store):
+        # Arrange
+        first = self._model(tmp_path / "a")
+        second = self._model(tmp_path / "b")
+        digest = hashlib.sha256(b"weights").hexdigest()
+
+        # Act
+        store.ingest_tree(str(first))
+        store.ingest_tree(str(second))
+
+        # Assert
+        assert os.path.samefile(
+            first / "model.safetensors", second / "model.safetensors"
+        )
+        assert store.refcount(digest) == 2
+
+    def test_link_places_a_stored_blob(self, tmp_path, store):
+        # Arrange
+        store.ingest_tree(str(self._model(tmp_path / "a")))
+        digest = hashlib.sha256(b"weights").hexdigest()
+
+        # Act
+        linked = store.link(digest, str(tmp_path / "b" / "model.safetensors"))
+        missing = store.link("0" * 64, str(tmp_path / "b" / "other.safetensors"))
+
+        # Assert
+        assert linked
+        assert not missing
+        assert (tmp_path / "b" / "model.safetensors").read_bytes() == b"weights"
+        assert store.refcount(digest) == 2
+
+    def test_collect_garbage_keeps_referenced_blobs(self, mocker, tmp_path, store):
+        # Arrange
+        mocker.patch(
+            "actuosus_ai.ai_model_manager.model_files.reflink", return_value=False
+        )
+        first = self._model(tmp_path / "a")
+        other = self._model(tmp_path / "c", weights=b"other weights")
+        store.ingest_tree(str(first))
+        store.ingest_tree(str(other))
+        copy_model_tree(str(first), str(tmp_path / "b"))
+        digest = hashlib.sha256(b"weights").hexdigest()
+        other_digest = hashlib.sha256(b"other weights").hexdigest()
+
+        # Act
+        os.unlink(first / "model.safetensors")
+        freed_while_copied = store.collect_garbage()
+        os.unlink(tmp_path / "b" / "model.safetensors")
+        freed = store.collect_garbage()
+
+        # Assert
+        assert freed_while_copied == 0
+        assert freed == len(b"weights")
+        assert not store.has(digest)
+        assert store.has(other_digest)
@@ -0,0 +1,81 @@
+import json
+import os
+
+import httpx
+import pytest
+
+from actuosus_ai.ai_model_manager.chunked_transfer import ChunkedTransfer
+
+DATA = bytes(range(256)) * 40
+
+
+class TestChunkedTransfer:
+    @pytest.fixture
+    def client(self):
+        with httpx.Client() as client:
+            yield client
+
+    @pytest.fixture
+    def url(self, hub_server):
+        hub_server.add("org/model", "main", "model.gguf", DATA)
+        return f"{hub_server.url}/org/model/resolve/main/model.gguf"
+
+    def test_download_in_parallel_chunks(self, tmp_path, hub_server, client, url):
+        # Arrange
+        transfer = ChunkedTransfer(client, chunk_size=4096, max_workers=3)
+        progress = []
+
+        # Act
+        transfer.download(url, str(tmp_path / "model.gguf"), len(DATA), progress.append)
+
+        # Assert
+        assert (tmp_path / "model.gguf").read_bytes() == DATA
+        assert sum(progress) == len(DATA)
+        ranges = sorted(request[2] for request in hub_server.requests)
+        assert ranges == ["bytes=0-4095", "bytes=4096-8191", "bytes=8192-10239"]
+        assert os.listdir(tmp_path) == ["model.gguf"]
+
+    def test_download_resumes_after_a_failed_chunk(
+        self, tmp_path, hub_server, client, url
+    ):
+        # Arrange
+        transfer = ChunkedTransfer(client, chunk_size=4096, max_workers=3)
+        hub_server.fail_once.add(4096)
+        path = str(tmp_path / "model.gguf")
+
+        # Act
+        with pytest.raises(httpx.HTTPStatusError):
+            transfer.download(url, path, len(DATA))
+        state = json.loads((tmp_path / "model.gguf.incomplete.json").read_text())
+        hub_server.requests.clear()
+        progress = []
+        transfer.download(url, path, len(DATA), progress.append)
+
+        # Assert
+        assert state["done"] == [0, 2]
+        assert hub_server.requests == [
+            ("GET", "/org/model/resolve/main/model.gguf", "bytes=4096-8191")
+        ]
+        assert sum(progress) == len(DATA)
+        assert (tmp_path / "model.gguf").read_bytes() == DATA
+
+    def test_falls_back_to_one_request_without_ranges(
+        self, tmp_path, hub_server, client, url
+    ):
+        # Arrange
+        hub_server.support_ranges = False
+        transfer = ChunkedTransfer(client, chunk_size=4096, max_workers=1)
+        progress = []
+
+        # Act, the size comes from a HEAD request
+        transfer.download(url, str(tmp_path / "model.gguf"), None, progress.append)
+
+        # Assert
+        assert (tmp_path / "model.gguf").read_bytes() == DATA
+        assert sum(progress) == len(DATA)
+        assert hub_server.requests[0][0] == "HEAD"
+        assert hub_server.requests[-1] == (
+            "GET",
+            "/org/model/resolve/main/model.gguf",
+            None,
+        )
@@ -0,0 +1,70 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import inspect
+
+from actuosus_ai.ai_model_manager import connection
+from actuosus_ai.ai_model_manager.connection import (
+    dispose_engines,
+    get_async_db_session,
+    get_async_engine,
+)
+from actuosus_ai.ai_model_manager.orm import BaseORM
+from actuosus_ai.common.settings import Settings
+
+
+class TestConnection:
+    @pytest.fixture
+    def settings(self, tmp_path):
+        return Settings(
+            database_url=f"sqlite+aiosqlite:///{tmp_path / 'test.db'}",
+            base_file_storage_path=str(tmp_path / "models"),
+            debug_mode=False,
+            db_pool_size=2,
+            db_max_overflow=1,
+        )
+
+    @pytest_asyncio.fixture(autouse=True)
+    async def dispose(self):
+        yield
+        await dispose_engines()
+
+    @staticmethod
+    async def _use_session(settings):
+        async for session in get_async_db_session(settings):
+            return session
+
+    def test_engine_is_shared_and_sized_from_settings(self, settings):
+        engine = get_async_engine(settings)
+
+        assert get_async_engine(settings) is engine
+        assert engine.pool.size() == 2
+        assert engine.pool._max_overflow == 1
+
+    def test_in_memory_sqlite_has_no_pool_options(self, settings):
+        settings.database_url = "sqlite+aiosqlite://"
+
+        assert connection._pool_options(settings) == {}
+
+    @pytest.mark.asyncio
+    async def test_schema_is_created_once(self, mocker, settings):
+        create_all = mocker.spy(BaseORM.metadata, "create_all")
+
+        first = await self._use_session(settings)
+        second = await self._use_session(settings)
+
+        assert create_all.call_count == 1
+        assert first is not second
+        assert first.bind is second.bind
+        async with get_async_engine(settings).connect() as conn:
+            tables = await conn.run_sync(
+                lambda sync_conn: inspect(sync_conn).get_table_names()
+            )
+        assert "ai_model" in tables
+
+    @pytest.mark.asyncio
+    async def test_dispose_engines_forgets_engines(self, settings):
+        engine = get_async_engine(settings)
+
+        await dispose_engines()
+
+        assert get_async_engine(settings) is not engine
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from actuosus_ai.ai_model_manager.download_manager import DownloadManager
+from actuosus_ai.ai_model_manager.dto import FileSelectionDTO
+from actuosus_ai.common.actuosus_exception import (
+    CancelledException,
+    ValidationException,
+)
+
+
+class TestDownloadManager:
+    @pytest.fixture
+    def downloads(self):
+        # Each repo's download finishes when its event is set
+        return {}
+
+    @pytest.fixture
+    def manager(self, mocker, downloads):
+        manager = DownloadManager(mocker.MagicMock(), max_concurrent=1)
+
+        async def download(job, tracker):
+            tracker.update(files_total=1)
+            await downloads.setdefault(job.hf_model_id, asyncio.Event()).wait()
+            if tracker.cancel_event.is_set():
+                raise CancelledException("Download was cancelled")
+            if job.hf_model_id == "broken":
+                raise Exception("Model not found on Hugging Face")
+            tracker.add_bytes(10)
+            tracker.file_done()
+
+        mocker.patch.object(manager, "_download", side_effect=download)
+        return manager
+
+    @pytest.mark.asyncio
+    async def test_same_repo_joins_the_running_job(self, manager, downloads):
+        # Act
+        first = manager.start("gpt2")
+        second = manager.start("gpt2")
+        await asyncio.sleep(0)
+        downloads["gpt2"].set()
+        finished = await manager.wait(first.job_id)
+
+        # Assert
+        assert second.job_id == first.job_id
+        assert manager._download.call_count == 1
+        assert finished.status == "completed"
+        assert (finished.files_done, finished.bytes_done) == (1, 10)
+        # A finished repo can be downloaded again
+        assert manager.start("gpt2").job_id != first.job_id
+
+    @pytest.mark.asyncio
+    async def test_downloads_wait_for_a_free_slot(self, manager, downloads):
+        # Act
+        first = manager.start("gpt2")
+        second = manager.start("llama")
+        await asyncio.sleep(0.01)
+        statuses = [manager.get(first.job_id).status, manager.get(second.job_id).status]
+        downloads["gpt2"].set()
+        await manager.wait(first.job_id)
+        await asyncio.sleep(0.01)
+        downloads["llama"].set()
+        await manager.wait(second.job_id)
+
+        # Assert
+        assert statuses == ["downloading", "queued"]
+        assert [job.status for job in manager.jobs()] == ["completed", "completed"]
+
+    @pytest.mark.asyncio
+    async def test_other_files_of_a_repo_wait_for_the_running_job(
+        self, mocker, downloads
+    ):
+        # Arrange
+        manager = DownloadManager(mocker.MagicMock(), max_concurrent=2)
+
+        async def download(job, tracker):
+            await downloads[job.job_id].wait()
+
+        mocker.patch.object(manager, "_download", side_effect=download)
+        q4 = manager.start("org/model-GGUF", FileSelectionDTO(include=["*Q4*"]))
+        q8 = manager.start("org/model-GGUF", FileSelectionDTO(include=["*Q8*"]))
+        downloads[q4.job_id], downloads[q8.job_id] = asyncio.Event(), asyncio.Event()
+
+        # Act
+        await asyncio.sleep(0.01)
+        statuses = [manager.get(q4.job_id).status, manager.get(q8.job_id).status]
+        downloads[q4.job_id].set()
+        downloads[q8.job_id].set()
+        await manager.wait(q8.job_id)
+
+        # Assert
+        assert q8.job_id != q4.job_id
+        assert "org/model-GGUF" not in manager._repo_locks
+        assert manager.start("org/model-GGUF").job_id not in (q4.job_id, q8.job_id)
+        assert statuses == ["downloading", "queued"]
+        assert manager.get(q8.job_id).selection.include == ["*Q8*"]
+
+    @pytest.mark.asyncio
+    async def test_failed_download_reports_the_error(self, manager, downloads):
+        # Arrange
+        job = manager.start("broken")
+        downloads.setdefault("broken", asyncio.Event()).set()
+
+        # Act
+        events = [event async for event in manager.events(job.job_id, interval=0.01)]
+
+        # Assert
+        assert events[-1].status == "failed"
+        assert events[-1].error == "Model not found on Hugging Face"
+        assert manager.get("unknown") is None
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_and_running_jobs(self, manager, downloads):
+        # Arrange
+        running = manager.start("gpt2")
+        queued = manager.start("llama")
+        await asyncio.sleep(0.01)
+
+        # Act
+        manager.cancel(queued.job_id)
+        manager.cancel(running.job_id)
+        # The transfer stops when it next checks the cancel
+        downloads["gpt2"].set()
+        await manager.wait(running.job_id)
+        await manager.wait(queued.job_id)
+
+        # Assert
+        assert [job.status for job in manager.jobs()] == ["cancelled", "cancelled"]
+        assert manager._download.call_count == 1
+        assert manager.cancel("unknown") is None
+        with pytest.raises(ValidationException):
+            manager.cancel(running.job_id)
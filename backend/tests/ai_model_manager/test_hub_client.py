@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+import pytest
+
+from actuosus_ai.ai_model_manager.hub_client import (
+    CachedHubClient,
+    HubClient,
+    login_to_hub,
+)
+
+
+class FakeHubClient(HubClient):
+    """Answers from memory, a search blocks until release is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.threads = set()
+        self.release = threading.Event()
+        self.release.set()
+
+    def search(self, ai_model_name, limit):
+        self.calls.append(("search", ai_model_name, limit))
+        self.threads.add(threading.get_ident())
+        self.release.wait(5)
+        if ai_model_name == "broken":
+            raise Exception("Hub unavailable")
+        return [f"{ai_model_name}-{i}" for i in range(limit)]
+
+    def model_info(self, model_name):
+        self.calls.append(("model_info", model_name))
+        return {"id": model_name}
+
+
+class TestCachedHubClient:
+    @pytest.fixture
+    def fake(self):
+        return FakeHubClient()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_searches_share_one_call_off_the_loop(self, fake):
+        # Arrange
+        client = CachedHubClient(fake)
+        fake.release.clear()
+
+        # Act
+        searches = [asyncio.ensure_future(client.search("gpt", 2)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        # The event loop keeps running while the hub call blocks
+        fake.release.set()
+        results = await asyncio.gather(*searches)
+        again = await client.search("gpt", 2)
+
+        # Assert
+        assert results == [["gpt-0", "gpt-1"]] * 5
+        assert again == ["gpt-0", "gpt-1"]
+        assert fake.calls == [("search", "gpt", 2)]
+        assert threading.get_ident() not in fake.threads
+
+    @pytest.mark.asyncio
+    async def test_results_expire_after_the_ttl(self, fake, mocker):
+        # Arrange
+        client = CachedHubClient(fake, ttl=10)
+        clock = mocker.patch(
+            "actuosus_ai.ai_model_manager.hub_client.time.monotonic", return_value=0
+        )
+
+        # Act
+        await client.model_info("gpt2")
+        clock.return_value = 5
+        await client.model_info("gpt2")
+        clock.return_value = 11
+        await client.model_info("gpt2")
+
+        # Assert
+        assert fake.calls == [("model_info", "gpt2")] * 2
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_results_are_dropped(self, fake):
+        # Arrange
+        client = CachedHubClient(fake, max_entries=2)
+
+        # Act
+        await client.model_info("a")
+        await client.model_info("b")
+        await client.model_info("a")
+        await client.model_info("c")
+        fake.calls.clear()
+        await client.model_info("a")
+        await client.model_info("b")
+
+        # Assert
+        assert fake.calls == [("model_info", "b")]
+
+    @pytest.mark.asyncio
+    async def test_failures_are_not_cached(self, fake):
+        # Arrange
+        client = CachedHubClient(fake)
+
+        # Act & Assert
+        for _ in range(2):
+            with pytest.raises(Exception, match="Hub unavailable"):
+                await client.search("broken", 1)
+        assert len(fake.calls) == 2
+
+
+class TestLoginToHub:
+    def test_failure_is_logged(self, mocker, caplog):
+        # Arrange
+        mocker.patch(
+            "actuosus_ai.ai_model_manager.hub_client.login",
+            side_effect=ValueError("Invalid token"),
+        )
+
+        # Act
+        login_to_hub("hf_token")
+
+        # Assert
+        assert "Hugging Face login failed: Invalid token" in caplog.text
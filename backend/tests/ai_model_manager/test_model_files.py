@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from actuosus_ai.ai_model_manager import model_files
+from actuosus_ai.ai_model_manager.model_files import (
+    copy_model_tree,
+    link_or_copy_file,
+    save_replacing_files,
+)
+
+
+class TestModelFiles:
+    @pytest.fixture
+    def model_dir(self, tmp_path):
+        model_dir = tmp_path / "model"
+        (model_dir / "sub").mkdir(parents=True)
+        (model_dir / "model.safetensors").write_bytes(b"weights")
+        (model_dir / "sub" / "model.gguf").write_bytes(b"gguf")
+        (model_dir / "config.json").write_text("{}")
+        (model_dir / "tokenizer.json").write_text("{}")
+        return model_dir
+
+    @pytest.fixture
+    def no_reflink(self, mocker):
+        return mocker.patch.object(model_files, "reflink", return_value=False)
+
+    def test_copy_hardlinks_weights_and_copies_the_rest(
+        self, tmp_path, model_dir, no_reflink
+    ):
+        # Act
+        copy_model_tree(str(model_dir), str(tmp_path / "copy"))
+
+        # Assert
+        copy = tmp_path / "copy"
+        assert os.path.samefile(
+            model_dir / "model.safetensors", copy / "model.safetensors"
+        )
+        assert os.path.samefile(
+            model_dir / "sub" / "model.gguf", copy / "sub" / "model.gguf"
+        )
+        assert not os.path.samefile(model_dir / "config.json", copy / "config.json")
+        assert (copy / "tokenizer.json").read_text() == "{}"
+
+    def test_full_copy_links_nothing(self, tmp_path, model_dir):
+        # Act
+        copy_model_tree(str(model_dir), str(tmp_path / "copy"), full_copy=True)
+
+        # Assert
+        assert (model_dir / "model.safetensors").stat().st_nlink == 1
+        assert (tmp_path / "copy" / "model.safetensors").read_bytes() == b"weights"
+
+    def test_reflink_is_preferred(self, mocker, tmp_path, model_dir):
+        # Arrange
+        def fake_reflink(src, dst):
+            with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+                dst_file.write(src_file.read())
+            return True
+
+        mocker.patch.object(model_files, "reflink", side_effect=fake_reflink)
+        link = mocker.spy(os, "link")
+
+        # Act
+        kind = link_or_copy_file(
+            str(model_dir / "model.safetensors"), str(tmp_path / "clone")
+        )
+
+        # Assert
+        assert kind == "reflink"
+        link.assert_not_called()
+
+    def test_reflink_falls_back_when_unsupported(self, tmp_path, model_dir):
+        # Act
+        kind = link_or_copy_file(
+            str(model_dir / "model.safetensors"), str(tmp_path / "clone")
+        )
+
+        # Assert, tmpfs and ext4 can't clone files, btrfs and xfs can
+        assert kind in ("reflink", "hardlink")
+        assert (tmp_path / "clone").read_bytes() == b"weights"
+
+    def test_save_protects_the_original(self, tmp_path, model_dir, no_reflink):
+        # Arrange
+        copy = tmp_path / "copy"
+        copy_model_tree(str(model_dir), str(copy))
+
+        def save(directory):
+            with open(os.path.join(directory, "model.safetensors"), "wb") as file:
+                file.write(b"fine-tuned")
+
+        # Act
+        save_replacing_files(save, str(copy))
+
+        # Assert
+        assert (copy / "model.safetensors").read_bytes() == b"fine-tuned"
+        assert (model_dir / "model.safetensors").read_bytes() == b"weights"
+        assert (model_dir / "model.safetensors").stat().st_nlink == 1
+        # Files the save did not write stay shared
+        assert os.path.samefile(
+            model_dir / "sub" / "model.gguf", copy / "sub" / "model.gguf"
+        )
+        assert sorted(os.listdir(copy)) == sorted(os.listdir(model_dir))
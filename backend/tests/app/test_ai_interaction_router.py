@@ -0,0 +1,47 @@
+import pytest
+from starlette.testclient import TestClient
+
+from actuosus_ai.app.dependency import get_chat_websocket_orchestrator
+from actuosus_ai.app.main import app
+from actuosus_ai.common.actuosus_exception import CancelledException
+
+
+class TestAIInteractionRouter:
+    @pytest.fixture
+    def orchestrator(self, mocker):
+        orchestrator = mocker.AsyncMock()
+        orchestrator.chat_service.ai_model_name = "tiny"
+        orchestrator.chat_service.estimated_ram = 0.0
+        orchestrator.chat_service.estimated_vram = 0.0
+        orchestrator.chat_service.max_length = 64
+        orchestrator.temperature = 1.0
+        orchestrator.max_new_tokens = 10
+        orchestrator.text_generation_service.unload_model = mocker.MagicMock()
+        app.dependency_overrides[get_chat_websocket_orchestrator] = lambda: orchestrator
+        yield orchestrator
+        app.dependency_overrides.clear()
+
+    @staticmethod
+    def _connect():
+        url = "/ws/chat/?chat_type=text_generation&ai_model_id=1"
+        with TestClient(app).websocket_connect(url) as websocket:
+            websocket.receive_json()
+
+    def test_model_released_when_session_ends(self, orchestrator):
+        # Act
+        self._connect()
+
+        # Assert
+        orchestrator.run.assert_awaited_once()
+        orchestrator.text_generation_service.unload_model.assert_called_once()
+
+    def test_model_released_when_load_fails(self, orchestrator):
+        # Arrange
+        orchestrator.load.side_effect = CancelledException("cancelled")
+
+        # Act
+        with pytest.raises(CancelledException):
+            self._connect()
+
+        # Assert
+        orchestrator.text_generation_service.unload_model.assert_called_once()
@@ -3,12 +3,22 @@ from datetime import datetime
 import pytest
 from starlette.testclient import TestClient
 
-from actuosus_ai.ai_model_manager.dto import AIModelDTO
+from actuosus_ai.ai_interaction.memory_estimator import MemoryEstimate
+from actuosus_ai.ai_interaction.model_memory import ModelMemory
+from actuosus_ai.ai_interaction.model_registry import ModelRegistry, get_model_registry
+from actuosus_ai.ai_model_manager.download_manager import get_download_manager
+from actuosus_ai.ai_model_manager.download_progress import DownloadJob
+from actuosus_ai.ai_model_manager.dto import (
+    AIModelDTO,
+    FileSelectionDTO,
+    RemoteFileDTO,
+)
 from actuosus_ai.app.dependency import (
     get_ai_download_service,
     get_ai_model_storage_service,
 )
 from actuosus_ai.app.main import app
+from actuosus_ai.common.metrics import metrics_registry
 
 
 class TestAIRouter:
@@ -28,9 +38,10 @@ class TestAIRouter:
         )
 
     def test_download_lm_from_hugging_face(self, mocker, client):
-        mock_service = mocker.AsyncMock()
-        mock_service.download_lm_from_hugging_face.return_value = None
-        app.dependency_overrides[get_ai_download_service] = lambda: mock_service
+        job = DownloadJob(hf_model_id="gpt2")
+        mock_manager = mocker.MagicMock()
+        mock_manager.start.return_value = job
+        app.dependency_overrides[get_download_manager] = lambda: mock_manager
         response = client.post(
             "/download/hf_lang_model/",
             json={"hf_model_id": "gpt2"},
@@ -38,21 +49,102 @@ class TestAIRouter:
         assert response.status_code == 200
         assert response.json() == {
             "success": True,
-            "message": "Model downloaded successfully",
+            "message": "Model download started",
+            "job": job.model_dump(),
         }
+        mock_manager.start.assert_called_once_with("gpt2", FileSelectionDTO())
 
-    def test_download_lm_from_hugging_face_invalid_model(self, mocker, client):
-        mock_service = mocker.AsyncMock()
-        mock_service.download_lm_from_hugging_face.side_effect = Exception(
-            "Invalid model"
-        )
-        app.dependency_overrides[get_ai_download_service] = lambda: mock_service
+    def test_download_selected_files(self, mocker, client):
+        mock_manager = mocker.MagicMock()
+        mock_manager.start.return_value = DownloadJob(hf_model_id="org/model-GGUF")
+        app.dependency_overrides[get_download_manager] = lambda: mock_manager
         response = client.post(
             "/download/hf_lang_model/",
-            json={"hf_model_id": "invalid_model"},
+            json={
+                "hf_model_id": "org/model-GGUF",
+                "include": ["*Q4_K_M*"],
+                "files": ["README.md"],
+            },
+        )
+        assert response.status_code == 200
+        mock_manager.start.assert_called_once_with(
+            "org/model-GGUF",
+            FileSelectionDTO(include=["*Q4_K_M*"], files=["README.md"]),
+        )
+
+    def test_add_model_files(self, mocker, client, example_dto):
+        mock_service = mocker.AsyncMock()
+        mock_service.get_model_by_id.side_effect = (
+            lambda ai_model_id: example_dto if ai_model_id == 1 else None
+        )
+        app.dependency_overrides[get_ai_model_storage_service] = lambda: mock_service
+        mock_manager = mocker.MagicMock()
+        mock_manager.start.return_value = DownloadJob(hf_model_id=example_dto.name)
+        app.dependency_overrides[get_download_manager] = lambda: mock_manager
+
+        response = client.post("/model/1/files/", json={"include": ["*Q8_0*"]})
+        missing = client.post("/model/2/files/", json={})
+
+        assert response.status_code == 200
+        assert response.json()["message"] == "Model download started"
+        mock_manager.start.assert_called_once_with(
+            example_dto.name, FileSelectionDTO(include=["*Q8_0*"]), 1
+        )
+        assert missing.status_code == 404
+
+    def test_get_download_job(self, mocker, client):
+        job = DownloadJob(
+            hf_model_id="invalid_model", status="failed", error="Invalid model"
+        )
+        mock_manager = mocker.MagicMock()
+        mock_manager.get.side_effect = (
+            lambda job_id: job if job_id == job.job_id else None
+        )
+        app.dependency_overrides[get_download_manager] = lambda: mock_manager
+
+        response = client.get(f"/download/jobs/{job.job_id}/")
+        missing = client.get("/download/jobs/unknown/")
+
+        assert response.status_code == 200
+        assert response.json()["status"] == "failed"
+        assert response.json()["error"] == "Invalid model"
+        assert missing.status_code == 404
+
+    def test_cancel_download_job(self, mocker, client):
+        job = DownloadJob(hf_model_id="gpt2", status="downloading")
+        mock_manager = mocker.MagicMock()
+        mock_manager.cancel.side_effect = lambda job_id: (
+            job if job_id == job.job_id else None
+        )
+        app.dependency_overrides[get_download_manager] = lambda: mock_manager
+
+        response = client.post(f"/download/jobs/{job.job_id}/cancel/")
+        missing = client.post("/download/jobs/unknown/cancel/")
+
+        assert response.status_code == 200
+        assert response.json()["message"] == "Model download cancelled"
+        assert response.json()["job"]["job_id"] == job.job_id
+        assert missing.status_code == 404
+
+    def test_stream_download_job(self, mocker, client):
+        job = DownloadJob(hf_model_id="gpt2", status="downloading", bytes_total=10)
+        done = job.model_copy(update={"status": "completed", "bytes_done": 10})
+
+        async def events(job_id):
+            yield job
+            yield done
+
+        mock_manager = mocker.MagicMock(events=events)
+        mock_manager.get.return_value = job
+        app.dependency_overrides[get_download_manager] = lambda: mock_manager
+
+        response = client.get(f"/download/jobs/{job.job_id}/events/")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.text == (
+            f"data: {job.model_dump_json()}\n\ndata: {done.model_dump_json()}\n\n"
         )
-        assert response.status_code == 500
-        assert response.json() == {"message": "Invalid model", "success": False}
 
     def test_download_lm_from_hugging_face_no_payload(self, mocker, client):
         response = client.post(
@@ -129,13 +221,35 @@ class TestAIRouter:
                     "pipeline_tag": "some pipeline tag 1",
                     "created_at": example_dto.created_at.isoformat(),
                     "updated_at": example_dto.updated_at.isoformat(),
+                    "memory_estimates": None,
                 }
-            ]
+            ],
+            "next_cursor": None,
         }
 
+    def test_get_models_with_memory_estimates(self, mocker, client, example_dto):
+        mock_service = mocker.AsyncMock()
+        mock_service.get_models.return_value = [example_dto]
+        app.dependency_overrides[get_ai_model_storage_service] = lambda: mock_service
+        mocker.patch("actuosus_ai.app.ai_router.gpu_available", return_value=False)
+        estimate = MemoryEstimate(
+            quantization=None, memory=ModelMemory(parameter_bytes=8, ram_bytes=8)
+        )
+        mock_estimate = mocker.patch(
+            "actuosus_ai.app.ai_router.estimate_model_memory", return_value=[estimate]
+        )
+
+        response = client.get("/models/?include_memory_estimates=true")
+
+        assert response.status_code == 200
+        memory_estimates = response.json()["models"][0]["memory_estimates"]
+        assert memory_estimates == [estimate.model_dump()]
+        mock_estimate.assert_called_once()
+
     def test_get_models(self, mocker, client, example_dto):
         mock_service = mocker.AsyncMock()
         mock_service.get_models.return_value = [example_dto]
+        mock_service.encode_cursor = mocker.MagicMock(return_value="next page")
         app.dependency_overrides[get_ai_model_storage_service] = lambda: mock_service
         response = client.get(
             "/models/?limit=1&offset=0&name=some name 1&pipeline_tag=some pipeline tag 1&order_by=created_at&is_desc=True",
@@ -149,9 +263,38 @@ class TestAIRouter:
                     "pipeline_tag": "some pipeline tag 1",
                     "created_at": example_dto.created_at.isoformat(),
                     "updated_at": example_dto.updated_at.isoformat(),
+                    "memory_estimates": None,
                 }
-            ]
+            ],
+            "next_cursor": "next page",
         }
+        mock_service.encode_cursor.assert_called_once_with(example_dto, "created_at")
+
+    def test_get_loaded_models(self, mocker, client):
+        registry = ModelRegistry(ram_budget_gb=8.0)
+        scheduler = mocker.MagicMock(
+            estimated_ram=1.5,
+            estimated_vram=0.0,
+            memory=ModelMemory(parameter_bytes=1024, ram_bytes=1024),
+            active_sequences=1,
+        )
+        registry.acquire((1, "gguf", "model.gguf"), lambda: scheduler)
+        app.dependency_overrides[get_model_registry] = lambda: registry
+
+        response = client.get("/models/loaded/")
+
+        assert response.status_code == 200
+        body = response.json()
+        assert body["ram_budget_gb"] == 8.0
+        assert body["vram_budget_gb"] is None
+        assert len(body["models"]) == 1
+        assert body["models"][0]["ai_model_id"] == 1
+        assert body["models"][0]["gguf_file_name"] == "model.gguf"
+        assert body["models"][0]["users"] == 1
+        assert body["models"][0]["estimated_ram"] == 1.5
+        assert body["models"][0]["memory"]["parameter_bytes"] == 1024
+        assert body["state_cache_ram_bytes"] == 0
+        assert body["process"]["rss_bytes"] > 0
 
     @pytest.mark.asyncio
     async def test_search_hugging_face(self, mocker, client):
@@ -166,3 +309,42 @@ class TestAIRouter:
         # Assert
         assert response.status_code == 200
         assert response.json()["model_names"] == ["model1", "model2"]
+
+    def test_get_metrics(self, client):
+        # Arrange
+        sessions = "actuosus_active_sessions"
+        metrics_registry.get(sessions).labels("gpt2", "int8").set(1)
+
+        # Act
+        response = client.get("/metrics")
+
+        # Assert
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert f'{sessions}{{model="gpt2",quantization="int8"}} 1.0' in response.text
+        assert "# TYPE actuosus_time_to_first_token_seconds histogram" in response.text
+        assert "actuosus_process_rss_bytes " in response.text
+        metrics_registry.get(sessions).remove("gpt2", "int8")
+
+    def test_get_hugging_face_files(self, mocker, client):
+        # Arrange
+        mock_service = mocker.AsyncMock()
+        mock_service.list_remote_files.return_value = [
+            RemoteFileDTO(name="README.md", size=7),
+            RemoteFileDTO(name="model.Q4_K_M.gguf", size=200),
+        ]
+        app.dependency_overrides[get_ai_download_service] = lambda: mock_service
+
+        # Act
+        response = client.get("/huggingface/files/org/model-GGUF/")
+
+        # Assert
+        assert response.status_code == 200
+        assert response.json() == {
+            "files": [
+                {"name": "README.md", "size": 7},
+                {"name": "model.Q4_K_M.gguf", "size": 200},
+            ],
+            "total_size": 207,
+        }
+        mock_service.list_remote_files.assert_called_once_with("org/model-GGUF")
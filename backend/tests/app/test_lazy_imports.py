@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+HEAVY_MODULES = ["torch", "transformers", "llama_cpp", "sympy"]
+
+
+class TestLazyImports:
+    def test_app_import_does_not_load_ml_stacks(self):
+        # Arrange
+        # A fresh interpreter, the test session has already imported torch
+        code = (
+            "import json, sys\n"
+            "import actuosus_ai.app.main\n"
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+        )
+
+        # Act
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+
+        # Assert
+        assert result.returncode == 0, result.stderr
+        assert json.loads(result.stdout.splitlines()[-1]) == []
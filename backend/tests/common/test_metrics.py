@@ -0,0 +1,56 @@
+import pytest
+
+from actuosus_ai.common.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry:
+    @pytest.fixture
+    def registry(self):
+        return MetricsRegistry()
+
+    def test_histogram_renders_cumulative_buckets(self, registry):
+        # Arrange
+        histogram = registry.histogram(
+            "latency_seconds", "Latency", ("model",), buckets=(0.1, 1.0)
+        )
+
+        # Act
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.labels("gpt2").observe(value)
+
+        # Assert
+        assert registry.render().splitlines() == [
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{model="gpt2",le="0.1"} 2',
+            'latency_seconds_bucket{model="gpt2",le="1.0"} 3',
+            'latency_seconds_bucket{model="gpt2",le="+Inf"} 4',
+            'latency_seconds_sum{model="gpt2"} 3.65',
+            'latency_seconds_count{model="gpt2"} 4',
+        ]
+
+    def test_gauge_set_inc_dec_and_remove(self, registry):
+        # Arrange
+        gauge = registry.gauge("sessions", "Sessions", ("model", "quantization"))
+
+        # Act
+        gauge.labels("gpt2", "none").set(2)
+        gauge.labels("gpt2", "none").inc()
+        gauge.labels("gpt2", "none").dec(2)
+        gauge.labels('say "hi"', "int8").inc()
+        gauge.remove("gpt2", "none")
+
+        # Assert
+        assert registry.render().splitlines()[2:] == [
+            'sessions{model="say \\"hi\\"",quantization="int8"} 1.0'
+        ]
+
+    def test_rejects_wrong_labels_and_duplicate_names(self, registry):
+        # Arrange
+        gauge = registry.gauge("sessions", "Sessions", ("model",))
+
+        # Act & Assert
+        with pytest.raises(ValueError):
+            gauge.labels("gpt2", "int8")
+        with pytest.raises(ValueError):
+            registry.histogram("sessions", "Sessions")
@@ -1,7 +1,8 @@
-export default function Loader() {
+export default function Loader({ message }: { message?: string }) {
   return (
-    <div className="flex justify-center items-center h-screen w-screen">
+    <div className="flex flex-col justify-center items-center h-screen w-screen">
       <div className="animate-spin rounded-full h-32 w-32 border-b-2 border-primary-900"></div>
+      {message && <p className="mt-8">{message}</p>}
     </div>
   );
 }
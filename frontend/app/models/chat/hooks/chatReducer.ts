@@ -11,6 +11,15 @@ export type Message = {
   source: string;
 };
 
+export type LoadProgress = {
+  stage: string;
+  files_read: number;
+  files_total: number;
+  bytes_read: number;
+  bytes_total: number;
+  layers_total: number;
+};
+
 export type baseChatState = {
   messages: Message[];
   inputMessage: string;
@@ -27,6 +36,7 @@ export type baseChatState = {
   showContinueGenerate: boolean;
   showHeatMap: boolean;
   isGenerating: boolean;
+  loadProgress: LoadProgress | null;
 };
 
 const initialState: baseChatState = {
@@ -45,6 +55,7 @@ const initialState: baseChatState = {
   showContinueGenerate: false,
   showHeatMap: false,
   isGenerating: false,
+  loadProgress: null,
 };
 
 export type baseChatAction =
@@ -104,6 +115,10 @@ export type baseChatAction =
         estimated_vram: number;
       };
     }
+  | {
+      type: 'SET_LOAD_PROGRESS';
+      payload: LoadProgress;
+    }
   | {
       type: 'SET_TEMPERATURE';
       temperature: number;
@@ -220,6 +235,11 @@ const reducer = (
         maxNewTokens: action.payload.max_new_tokens,
         temperature: action.payload.temperature,
       };
+    case 'SET_LOAD_PROGRESS':
+      return {
+        ...state,
+        loadProgress: action.payload,
+      };
     case 'SET_TEMPERATURE':
       return {
         ...state,
@@ -3,7 +3,10 @@ import React, { Suspense, useMemo, useRef, useEffect } from 'react';
 import { useWebsocket } from '@/app/hooks/useWebsocket';
 import Loader from '@/app/components/Loader';
 import { useSearchParams } from 'next/navigation';
-import useChatReducer, { Message } from '@/app/models/chat/hooks/chatReducer';
+import useChatReducer, {
+  LoadProgress,
+  Message,
+} from '@/app/models/chat/hooks/chatReducer';
 import ChatSidePanel from '@/app/models/chat/components/ChatSidePanel';
 import MessagesDisplay from '@/app/models/chat/components/MessageDisplay';
 import { error_toast, useDebounce } from '@/app/utils/utils';
@@ -59,8 +62,26 @@ enum responseTypeId {
   NEW_MESSAGE = 1,
   NEW_MESSAGE_END = 2,
   REFRESH_WORD = 3,
+  LOAD_PROGRESS = 4,
+  NEW_MESSAGE_BATCH = 5,
 }
 
+const loadMessage = (progress: LoadProgress | null) => {
+  if (!progress) {
+    return undefined;
+  }
+  const gb = (bytes: number) => (bytes / 1024 ** 3).toFixed(2);
+  if (progress.stage === 'reading') {
+    return `Reading files ${progress.files_read}/${progress.files_total} (${gb(progress.bytes_read)}/${gb(progress.bytes_total)} GB)`;
+  }
+  if (progress.stage === 'placing') {
+    return progress.layers_total
+      ? `Placing ${progress.layers_total} layers`
+      : 'Placing layers';
+  }
+  return undefined;
+};
+
 const Page = () => {
   return (
     <Suspense fallback={<Loader />}>
@@ -109,6 +130,14 @@ const WebSocketComponent = () => {
               payload: data.payload,
             });
             break;
+          case responseTypeId.NEW_MESSAGE_BATCH:
+            for (const content of data.payload.contents) {
+              dispatch({
+                type: 'APPEND_TO_LAST_MESSAGE',
+                payload: { source: data.payload.source, content: content },
+              });
+            }
+            break;
           case responseTypeId.NEW_MESSAGE_END:
             dispatch({
               type: 'MESSAGE_END',
@@ -121,6 +150,12 @@ const WebSocketComponent = () => {
               payload: data.payload,
             });
             break;
+          case responseTypeId.LOAD_PROGRESS:
+            dispatch({
+              type: 'SET_LOAD_PROGRESS',
+              payload: data.payload,
+            });
+            break;
         }
       },
     }),
@@ -224,7 +259,7 @@ const WebSocketComponent = () => {
 
   return (
     <>
-      {loading && <Loader />}
+      {loading && <Loader message={loadMessage(state.loadProgress)} />}
       {!loading && (
         <div className="flex flex-row h-screen w-full">
           <ChatSidePanel
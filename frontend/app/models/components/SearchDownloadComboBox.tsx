@@ -8,6 +8,7 @@ import clsx from 'clsx';
 import CloseIcon from '@/app/public/icon/close.svg';
 import LoaderIcon from '@/app/public/icon/loader.svg';
 import React from 'react';
+import { DownloadJob } from '@/app/models/hooks/customHooks';
 
 export type SearchDownloadComboBoxProps = {
   selectedSearchName: string;
@@ -16,6 +17,7 @@ export type SearchDownloadComboBoxProps = {
   onInputChange: (e: React.ChangeEvent<HTMLInputElement>) => void;
   onDownloadModelClick: (e: React.FormEvent) => void;
   downloadModelLoading: boolean;
+  downloadJob?: DownloadJob | null;
 };
 export default function SearchDownloadComboBox({
   selectedSearchName,
@@ -24,7 +26,12 @@ export default function SearchDownloadComboBox({
   onInputChange,
   onDownloadModelClick,
   downloadModelLoading,
+  downloadJob,
 }: SearchDownloadComboBoxProps) {
+  const percent =
+    downloadJob && downloadJob.bytes_total > 0
+      ? Math.floor((100 * downloadJob.bytes_done) / downloadJob.bytes_total)
+      : null;
   return (
     <div className="mx-auto h-12 w-96 pt-5 flex flex-col justify-center">
       <Combobox
@@ -87,7 +94,9 @@ export default function SearchDownloadComboBox({
         {downloadModelLoading ? (
           <>
             <LoaderIcon className="h-4 w-4 animate-spin my-2 mr-2 fill-current text-primary-100" />
-            Downloading...{' '}
+            {downloadJob?.status === 'queued'
+              ? 'Queued...'
+              : `Downloading${percent === null ? '' : ` ${percent}%`}...`}
           </>
         ) : (
           <>Download</>
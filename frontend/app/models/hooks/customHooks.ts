@@ -1,4 +1,4 @@
-import { useCallback } from 'react';
+import { useCallback, useEffect, useState } from 'react';
 import useFetch from '@/app/hooks/useFetch';
 import { baseURL } from '@/app/utils/constants';
 
@@ -102,9 +102,20 @@ export const useSubmitEditName = () => {
   };
 };
 
+export type DownloadJob = {
+  job_id: string;
+  hf_model_id: string;
+  status: 'queued' | 'downloading' | 'completed' | 'failed' | 'cancelled';
+  files_done: number;
+  files_total: number;
+  bytes_done: number;
+  bytes_total: number;
+  error: string | null;
+};
 export type DownloadModelResponse = {
   success: boolean;
   message: string;
+  job: DownloadJob;
 };
 export type DownloadModelPayload = {
   hf_model_id: string;
@@ -113,6 +124,7 @@ export type DownloadModelPayload = {
 export const usePostDownload = () => {
   const { fetchData, response, loading, error } =
     useFetch<DownloadModelResponse>();
+  const [downloadJob, setDownloadJob] = useState<DownloadJob | null>(null);
   const postDownloadModel = async (payload: DownloadModelPayload) => {
     void fetchData(`${baseURL}/download/hf_lang_model/`, {
       method: 'POST',
@@ -122,10 +134,37 @@ export const usePostDownload = () => {
       body: JSON.stringify(payload),
     });
   };
+
+  // The download runs in the background, follow its progress until it finishes
+  useEffect(() => {
+    if (!response) {
+      return;
+    }
+    setDownloadJob(response.job);
+    const source = new EventSource(
+      `${baseURL}/download/jobs/${response.job.job_id}/events/`
+    );
+    source.onmessage = (event: MessageEvent<string>) => {
+      const job = JSON.parse(event.data) as DownloadJob;
+      setDownloadJob(job);
+      if (
+        job.status === 'completed' ||
+        job.status === 'failed' ||
+        job.status === 'cancelled'
+      ) {
+        source.close();
+      }
+    };
+    source.onerror = () => source.close();
+    return () => source.close();
+  }, [response]);
+
+  const downloadRunning =
+    downloadJob?.status === 'queued' || downloadJob?.status === 'downloading';
   return {
     postDownloadModel,
-    downloadModelResponse: response,
-    downloadModelLoading: loading,
+    downloadJob,
+    downloadModelLoading: loading || downloadRunning,
     downloadModelError: error,
   };
 };
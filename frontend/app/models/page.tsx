@@ -11,7 +11,12 @@ import {
   usePostDownload,
 } from '@/app/models/hooks/customHooks';
 import React, { useEffect, useState } from 'react';
-import { success_toast, useDebounce, warning_toast } from '@/app/utils/utils';
+import {
+  error_toast,
+  success_toast,
+  useDebounce,
+  warning_toast,
+} from '@/app/utils/utils';
 import DeleteDialog from '@/app/models/components/DeleteDialog';
 import SearchDownloadComboBox from '@/app/models/components/SearchDownloadComboBox';
 import ConnectDialog from '@/app/models/components/ConnectDialog';
@@ -31,7 +36,7 @@ export default function ModelsPage() {
   const { deleteModel, deleteModelResponse, deleteModelLoading } =
     useDeleteModel();
 
-  const { postDownloadModel, downloadModelResponse, downloadModelLoading } =
+  const { postDownloadModel, downloadJob, downloadModelLoading } =
     usePostDownload();
   const { getSearchHub, searchResponse } = useGetSearchHub();
   const debouncedSearchHub = useDebounce(getSearchHub, 300);
@@ -57,11 +62,13 @@ export default function ModelsPage() {
     }
   }, [copyModelResponse, getModelDetails]);
   useEffect(() => {
-    if (downloadModelResponse) {
-      success_toast(downloadModelResponse.message);
+    if (downloadJob?.status === 'completed') {
+      success_toast('Model downloaded successfully');
       void getModelDetails();
+    } else if (downloadJob?.status === 'failed') {
+      error_toast(downloadJob.error ?? 'Model download failed');
     }
-  }, [downloadModelResponse, getModelDetails]);
+  }, [downloadJob?.status, downloadJob?.error, getModelDetails]);
 
   useEffect(() => {
     if (ggufFileNamesResponse) {
@@ -114,6 +121,7 @@ export default function ModelsPage() {
           void postDownloadModel({ hf_model_id: selectedSearchName });
         }}
         downloadModelLoading={downloadModelLoading}
+        downloadJob={downloadJob}
       />
       {modelDetailsLoading && <Loader />}
       {!modelDetailsLoading && (